@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm.session import Session
+
+from marcottimls.models import BaseSchema
+
+
+@pytest.fixture(scope='session')
+def db_connection(request):
+    engine = create_engine('sqlite://')
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'connect')
+    def fk_on(dbapi_conn, rec):
+        dbapi_conn.execute('PRAGMA foreign_keys=ON')
+    connection = engine.connect()
+    BaseSchema.metadata.create_all(connection)
+
+    def fin():
+        connection.close()
+        engine.dispose()
+    request.addfinalizer(fin)
+    return connection
+
+
+@pytest.fixture()
+def session(request, db_connection):
+    __transaction = db_connection.begin_nested()
+    session = Session(db_connection)
+
+    def fin():
+        session.close()
+        __transaction.rollback()
+    request.addfinalizer(fin)
+    return session
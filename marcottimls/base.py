@@ -4,24 +4,108 @@ import logging
 import pkg_resources
 from contextlib import contextmanager
 
+from sqlalchemy import event, exc, select
 from sqlalchemy.engine import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.session import Session
 
 from .version import __version__
-from etl import create_seasons, ingest_feeds, get_local_handles, CountryIngest
-from models import BaseSchema
+from etl import bootstrap_db
 
 
 logger = logging.getLogger(__name__)
 
 
+def ping_connection(connection, branch):
+    """
+    Test connection as it is checked out of the pool, and reconnect if it has been disconnected.
+
+    Event handler of the engine_connect event.
+    """
+    if branch:
+        return
+    should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as ex:
+        if not ex.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close_with_result
+
+
+def batch_executemany(page_size):
+    """
+    Create handler of the do_executemany event that sends executemany() parameters to PostgreSQL
+    in pages of statements, with psycopg2's execute_batch.
+
+    execute_batch requires psycopg2 2.7 or later.  With earlier versions, no handler is created, and
+    parameters are sent by executemany().
+
+    :param page_size: Number of parameter sets per page.
+    :return: Event handler function, or None if execute_batch is not available.
+    """
+    try:
+        from psycopg2.extras import execute_batch
+    except ImportError:
+        logger.warning("Batch executemany mode requires psycopg2 2.7 or later: using executemany()")
+        return None
+
+    def do_executemany(cursor, statement, parameters, context):
+        execute_batch(cursor, statement, parameters, page_size=page_size)
+        return True
+    return do_executemany
+
+
+def configure_engine(engine, config):
+    """
+    Attach connection pre-ping and executemany handlers to engine, as defined in configuration.
+
+    :param engine: Engine object.
+    :param config: MarcottiConfig object.
+    """
+    if config.POOL_PRE_PING:
+        event.listen(engine, 'engine_connect', ping_connection)
+    if config.EXECUTEMANY_MODE == 'batch':
+        if engine.dialect.name != 'postgresql':
+            raise ValueError("Batch executemany mode not supported on {}".format(engine.dialect.name))
+        handler = batch_executemany(config.EXECUTEMANY_PAGE_SIZE)
+        if handler is not None:
+            event.listen(engine, 'do_executemany', handler)
+    elif config.EXECUTEMANY_MODE is not None:
+        raise ValueError("Invalid executemany mode: {}".format(config.EXECUTEMANY_MODE))
+
+
+class ReadOnlySession(Session):
+    """
+    Session that reads from the database and does not write to it.
+
+    Read-only sessions do not autoflush, and flushing changes to records raises an error.  They are
+    closed without committing.
+    """
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            raise exc.InvalidRequestError("Cannot flush changes in a read-only session")
+
+
 class Marcotti(object):
 
     def __init__(self, config):
         logger.info("Marcotti-MLS v{0}: Python {1} on {2}".format(__version__, sys.version, sys.platform))
-        logger.info("Opened connection to {0}".format(self._public_db_uri(config.database_uri)))
-        self.engine = create_engine(config.database_uri)
-        self.connection = self.engine.connect()
+        logger.info("Connecting to {0}".format(self._public_db_uri(config.database_uri)))
+        self.engine = create_engine(config.database_uri, **config.engine_options)
+        configure_engine(self.engine, config)
+        if config.read_database_uri != config.database_uri:
+            logger.info("Connecting read sessions to {0}".format(self._public_db_uri(config.read_database_uri)))
+            self.read_engine = create_engine(config.read_database_uri, **config.engine_options)
+            configure_engine(self.read_engine, config)
+        else:
+            self.read_engine = self.engine
+        self.read_sessions = scoped_session(sessionmaker(bind=self.read_engine, class_=ReadOnlySession,
+                                                         autoflush=False))
         self.start_year = config.START_YEAR
         self.end_year = config.END_YEAR
 
@@ -35,26 +119,35 @@ class Marcotti(object):
         """
         return re.sub(r"//.*@", "//", uri)
 
-    def create_db(self):
+    def create_db(self, force=False):
         """
         Create database tables from models defined in schema and populate validation tables.
+
+        Returns immediately if the schema and validation data are unchanged since the database was created.
+
+        :param force: If True, check tables and validation data even if they are unchanged.
         """
-        logger.info("Creating data models...")
-        BaseSchema.metadata.create_all(self.connection)
         with self.create_session() as sess:
-            create_seasons(sess, self.start_year, self.end_year)
             interior_path = pkg_resources.resource_filename('marcottimls', 'data')
-            ingest_feeds(get_local_handles, interior_path, ('countries.csv',), CountryIngest(sess))
+            bootstrap_db(sess, self.start_year, self.end_year, interior_path, force)
 
     @contextmanager
-    def create_session(self):
+    def create_session(self, dedicated=False, reraise=False):
         """
         Create a session context that communicates with the database.
 
         Commits all changes to the database before closing the session, and if an exception is raised,
-        rollback the session.
+        rollback the session.  The exception is logged, and raised again if reraise is True.
+
+        Sessions check connections out of the engine's pool for each transaction and return them to
+        the pool when the transaction ends.
+
+        :param dedicated: If True, check one connection out of the pool for the lifetime of the session,
+                          and return it afterwards.
+        :param reraise: If True, raise exceptions again after the session is rolled back.
         """
-        session = Session(self.connection)
+        connection = self.engine.connect() if dedicated else None
+        session = Session(connection if dedicated else self.engine)
         logger.info("Create session {0} with {1}".format(
             id(session), self._public_db_uri(str(self.engine.url))))
         try:
@@ -64,20 +157,78 @@ class Marcotti(object):
         except Exception:
             session.rollback()
             logger.exception("Database transactions rolled back")
+            if reraise:
+                raise
         finally:
             logger.info("Session {0} with {1} closed".format(
                 id(session), self._public_db_uri(str(self.engine.url))))
             session.close()
+            if dedicated:
+                connection.close()
+
+    @contextmanager
+    def read_session(self):
+        """
+        Create a read-only session context for the current thread, for the analytics classes of
+        marcottimls.lib.
+
+        Read sessions connect to the read database (e.g. a replica) if the configuration defines one,
+        and to the database written by create_session otherwise.  Sessions are thread-local, so that
+        analytics in several threads can query the database concurrently, each with connections
+        checked out of the read engine's pool.  Nested contexts in a
+        thread share its session, which is closed without committing when the outermost context exits.
+        """
+        if self.read_sessions.registry.has():
+            yield self.read_sessions()
+            return
+        session = self.read_sessions()
+        try:
+            yield session
+        finally:
+            self.read_sessions.remove()
 
 
 class MarcottiConfig(object):
     """
-    Base configuration class for Marcotti-MLS.  Contains one property that defines the database URI.
+    Base configuration class for Marcotti-MLS.  Contains properties that define the database URI
+    and the options of the database engine.
 
     This class is to be subclassed and its attributes defined therein.
     """
 
+    # Connection pool options.  None keeps the SQLAlchemy default.  Pool size, overflow and timeout
+    # do not apply to SQLite databases.
+    POOL_SIZE = None
+    MAX_OVERFLOW = None
+    POOL_TIMEOUT = None
+    POOL_RECYCLE = None
+    POOL_PRE_PING = False
+
+    # Transaction isolation level of connections, e.g. 'READ COMMITTED', or None.
+    ISOLATION_LEVEL = None
+
+    # executemany() mode: None, or 'batch' to send parameters in pages (PostgreSQL with psycopg2 2.7+ only).
+    EXECUTEMANY_MODE = None
+    EXECUTEMANY_PAGE_SIZE = 100
+
+    # Database URI of read sessions (e.g. a read replica), or None to read from the database URI.
+    READ_DATABASE_URI = None
+
     @property
     def database_uri(self):
         return r'sqlite://{p.DBNAME}'.format(p=self) if getattr(self, 'DIALECT') == 'sqlite' else \
             r'{p.DIALECT}://{p.DBUSER}:{p.DBPASSWD}@{p.HOSTNAME}:{p.PORT}/{p.DBNAME}'.format(p=self)
+
+    @property
+    def read_database_uri(self):
+        return self.READ_DATABASE_URI or self.database_uri
+
+    @property
+    def engine_options(self):
+        """
+        Keyword arguments of create_engine for the connection pool and isolation level options that are set.
+        """
+        options = dict(pool_recycle=self.POOL_RECYCLE, isolation_level=self.ISOLATION_LEVEL)
+        if getattr(self, 'DIALECT') != 'sqlite':
+            options.update(pool_size=self.POOL_SIZE, max_overflow=self.MAX_OVERFLOW, pool_timeout=self.POOL_TIMEOUT)
+        return {key: value for key, value in options.items() if value is not None}
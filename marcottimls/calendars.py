@@ -0,0 +1,90 @@
+import logging
+from collections import namedtuple
+
+from marcottimls.models import CompetitionSeasons
+from marcottimls.sessions import SessionCache
+
+logger = logging.getLogger(__name__)
+
+
+SeasonDates = namedtuple('SeasonDates', ['start_date', 'end_date', 'weeks'])
+
+
+class SeasonCalendar(SessionCache):
+    """
+    In-memory calendar of the start and end dates and week counts of all competition seasons.
+
+    The calendar is loaded with one query per session.  Competition seasons that are not in the
+    calendar are not looked up again until the calendar is reset, as ingestions of competition
+    seasons do.
+    """
+
+    KEY = 'season_calendar'
+
+    def __init__(self, session):
+        super(SeasonCalendar, self).__init__(session)
+        self.seasons = None
+
+    def build(self):
+        """
+        Load dates of all competition seasons into calendar.
+        """
+        self.seasons = {}
+        for competition_id, season_id, start_date, end_date in self.session.query(
+                CompetitionSeasons.competition_id, CompetitionSeasons.season_id,
+                CompetitionSeasons.start_date, CompetitionSeasons.end_date):
+            weeks = ((end_date - start_date).days + 1) / 7 if start_date and end_date else None
+            self.seasons[(competition_id, season_id)] = SeasonDates(start_date, end_date, weeks)
+        logger.debug("Loaded {} competition seasons into season calendar".format(len(self.seasons)))
+
+    def reset(self):
+        """
+        Discard calendar, so that it is reloaded from the database on next use.
+        """
+        self.seasons = None
+
+    def dates(self, competition_id, season_id):
+        """
+        Retrieve dates of competition season.
+
+        :param competition_id: ID of competition.
+        :param season_id: ID of season.
+        :return: SeasonDates tuple of (start date, end date, number of weeks), or None.
+        """
+        if self.seasons is None:
+            self.build()
+        return self.seasons.get((competition_id, season_id))
+
+    def weeks(self, competition_id, season_id):
+        """
+        Number of calendar weeks in competition season, as in CompetitionSeasons.weeks.
+
+        :param competition_id: ID of competition.
+        :param season_id: ID of season.
+        :return: Number of weeks, or None if competition season is not in calendar.
+        """
+        season = self.dates(competition_id, season_id)
+        return season.weeks if season else None
+
+    def week(self, competition_id, season_id, ref_date):
+        """
+        Week of competition season that contains a date.  The first week of the season is week 1.
+
+        :param competition_id: ID of competition.
+        :param season_id: ID of season.
+        :param ref_date: Date object.
+        :return: Week number, or None if competition season is not in calendar.
+        """
+        season = self.dates(competition_id, season_id)
+        return (ref_date - season.start_date).days / 7 + 1 if season else None
+
+    def last_week(self, competition_id, season_id):
+        """
+        Week of competition season that contains the end date of the season.
+
+        :param competition_id: ID of competition.
+        :param season_id: ID of season.
+        :return: Week number, or None if competition season is not in calendar.
+        """
+        season = self.dates(competition_id, season_id)
+        return self.week(competition_id, season_id, season.end_date) if season else None
@@ -1,8 +1,19 @@
-from base import BaseCSV, SeasonalDataIngest, get_local_handles, ingest_feeds, create_seasons
+from base import (BaseCSV, SeasonalDataIngest, DimensionCache, CSVRecordReader, JSONRecordReader,
+                  get_local_handles, ingest_feed, ingest_feeds, create_seasons)
+from cache import ParsedFeedCache
+from matching import PlayerMatchIndex
+from writers import OrmWriter, CoreWriter, CopyWriter, create_writer
+from scheduler import ETLScheduler
+from parallel import ingest_feeds_parallel
+from pipeline import ETLPipeline
+from rejects import RejectLog, create_reject_sink
 from overview import (ClubIngest, CountryIngest, CompetitionIngest, CompetitionSeasonIngest,
                       PlayerIngest, PersonIngest)
 from financial import (AcquisitionIngest, PlayerSalaryIngest, PartialTenureIngest)
 from statistics import (PlayerMinuteIngest, FieldStatIngest, GoalkeeperStatIngest, LeaguePointIngest)
+from bootstrap import bootstrap_db
+from staging import (StagingIngest, SalaryStagingIngest, MinuteStagingIngest, FieldStatStagingIngest,
+                     GoalkeeperStatStagingIngest, LeaguePointStagingIngest)
 
 
 CSV_ETL_CLASSES = [
@@ -18,3 +29,32 @@ CSV_ETL_CLASSES = [
     ('GkStats', GoalkeeperStatIngest),
     ('LeaguePoints', LeaguePointIngest)
 ]
+
+
+# Entities that must be ingested before each entity in CSV_ETL_CLASSES.  Countries, Years and Seasons
+# are loaded when the database is created.  Minutes, FieldStats and GkStats all write CommonStats records,
+# so they are run in sequence.
+CSV_ETL_DEPENDENCIES = {
+    'Clubs': (),
+    'Competitions': (),
+    'CompetitionSeasons': ('Competitions',),
+    'Players': (),
+    'Acquisitions': ('Players', 'Clubs'),
+    'Salaries': ('Players', 'Clubs', 'CompetitionSeasons'),
+    'Partials': ('Players', 'Clubs', 'CompetitionSeasons'),
+    'Minutes': ('Players', 'Clubs', 'CompetitionSeasons'),
+    'FieldStats': ('Players', 'Clubs', 'CompetitionSeasons', 'Minutes'),
+    'GkStats': ('Players', 'Clubs', 'CompetitionSeasons', 'FieldStats'),
+    'LeaguePoints': ('Clubs', 'CompetitionSeasons')
+}
+
+
+# Staging table ingestion classes that replace the row-by-row ingestion classes of CSV_ETL_CLASSES
+# in staging mode.
+CSV_STAGING_CLASSES = {
+    'Salaries': SalaryStagingIngest,
+    'Minutes': MinuteStagingIngest,
+    'FieldStats': FieldStatStagingIngest,
+    'GkStats': GoalkeeperStatStagingIngest,
+    'LeaguePoints': LeaguePointStagingIngest
+}
@@ -1,39 +1,321 @@
 import csv
 import glob
+import json
 import logging
 import os
-
+import re
+from collections import Counter, namedtuple
+from contextlib import closing
+from datetime import date
+from itertools import islice
+
+from sqlalchemy import Integer
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
-from marcottimls.models import Seasons, Years, Players
+from marcottimls.etl.manifest import FeedCheckpoint, FeedManifest
+from marcottimls.etl.matching import PlayerMatchIndex
+from marcottimls.etl.pipeline import ETLPipeline
+from marcottimls.etl.rejects import RejectLog
+from marcottimls.etl.sources import MappedFeed, is_mappable, open_feeds
+from marcottimls.etl.writers import CoreWriter
+from marcottimls.models import Countries, Clubs, Competitions, Seasons, Years, Players
+from marcottimls.sessions import SessionCache
 
 logger = logging.getLogger(__name__)
 
 
-class BaseIngest(object):
+class DimensionCache(SessionCache):
+    """
+    In-memory lookup tables for the small dimension models of the Marcotti database.
+
+    Each dimension table is loaded once per session and indexed by its natural lookup fields.
+    Lookups on other fields are sent to the database and their results, including misses, are
+    memoized.  Dimension records flushed by the session are added to the lookup tables.
+    """
+
+    KEY = 'dimension_cache'
+    LOOKUP_FIELDS = {
+        Countries: ('name',),
+        Competitions: ('name',),
+        Clubs: ('name', 'symbol'),
+        Years: ('yr',),
+        Seasons: ('name',)
+    }
 
     def __init__(self, session):
+        super(DimensionCache, self).__init__(session)
+        self.rows = {}
+        self.indexes = {}
+        self.memo = {}
+
+    @classmethod
+    def dimension(cls, model):
+        """
+        Return dimension model that is the same as or a parent of model, or None.
+        """
+        for dim_model in cls.LOOKUP_FIELDS:
+            if issubclass(model, dim_model):
+                return dim_model
+        return None
+
+    @staticmethod
+    def normalize(model, field, value):
+        """
+        Convert lookup value to the Python type held in the dimension table.
+        """
+        column = model.__table__.columns.get(field)
+        if column is not None and isinstance(column.type, Integer) and isinstance(value, basestring):
+            try:
+                return int(value)
+            except ValueError:
+                return value
+        return value
+
+    def preload(self, model):
+        """
+        Load all records of dimension model into memory.
+
+        :param model: Marcotti-MLS dimension model.
+        """
+        fields = DimensionCache.LOOKUP_FIELDS[model]
+        query = self.session.query(model.id, *[getattr(model, field) for field in fields])
+        self.rows[model] = [(row[0], dict(zip(fields, row[1:]))) for row in query]
+        logger.debug("Loaded {} {} records into dimension cache".format(len(self.rows[model]), model.__name__))
+
+    def index(self, model, fields):
+        """
+        Retrieve hash map of dimension model records keyed on a subset of its lookup fields.
+
+        :param model: Marcotti-MLS dimension model.
+        :param fields: Sorted tuple of lookup fields.
+        :return: Dictionary of field values and list of record IDs.
+        """
+        if (model, fields) not in self.indexes:
+            if model not in self.rows:
+                self.preload(model)
+            index = {}
+            for record_id, values in self.rows[model]:
+                index.setdefault(tuple(values[field] for field in fields), []).append(record_id)
+            self.indexes[(model, fields)] = index
+        return self.indexes[(model, fields)]
+
+    def lookup(self, model, **conditions):
+        """
+        Retrieve IDs of dimension model records that satisfy conditions.
+
+        :param model: Marcotti-MLS dimension model.
+        :param conditions: Dictionary of fields/values that describe a record in model.
+        :return: List of record IDs.
+        """
+        if self.session.autoflush and self.session.new:
+            self.session.flush()
+        fields = tuple(sorted(conditions))
+        if model in DimensionCache.LOOKUP_FIELDS and set(fields) <= set(DimensionCache.LOOKUP_FIELDS[model]):
+            key = tuple(self.normalize(model, field, conditions[field]) for field in fields)
+            return self.index(model, fields).get(key, [])
+        memo_key = (model, tuple(sorted(conditions.items())))
+        if memo_key not in self.memo:
+            self.memo[memo_key] = [row[0] for row in self.session.query(model.id).filter_by(**conditions)]
+        return self.memo[memo_key]
+
+    def register(self, record):
+        """
+        Add new dimension record to lookup tables that have been loaded.
+
+        :param record: Dimension model object with assigned ID.
+        """
+        model = self.dimension(type(record))
+        self.memo = {key: ids for key, ids in self.memo.items() if not issubclass(key[0], model)}
+        if model not in self.rows:
+            return
+        values = {field: getattr(record, field) for field in DimensionCache.LOOKUP_FIELDS[model]}
+        self.rows[model].append((record.id, values))
+        for (index_model, fields), index in self.indexes.items():
+            if index_model is model:
+                index.setdefault(tuple(values[field] for field in fields), []).append(record.id)
+
+    def forget(self, model):
+        """
+        Discard lookup tables and memoized lookups of dimension model, so that it is loaded again on next use.
+
+        Records written without the session's flush, for example by Core inserts, are not added to the
+        lookup tables, which are discarded instead.
+
+        :param model: Marcotti-MLS dimension model.
+        """
+        self.rows.pop(model, None)
+        self.indexes = {key: index for key, index in self.indexes.items() if key[0] is not model}
+        self.memo = {key: ids for key, ids in self.memo.items() if not issubclass(key[0], model)}
+
+    def snapshot(self):
+        """
+        Load all dimension models and return copy of their records for warming other caches.
+
+        :return: Dictionary of dimension models and lists of (ID, lookup field dictionary) tuples.
+        """
+        for model in DimensionCache.LOOKUP_FIELDS:
+            if model not in self.rows:
+                self.preload(model)
+        return {model: list(rows) for model, rows in self.rows.items()}
+
+    def warm(self, snapshot):
+        """
+        Replace lookup tables with records from snapshot of another dimension cache.
+
+        :param snapshot: Return value of DimensionCache.snapshot.
+        """
+        self.reset()
+        self.rows = {model: list(rows) for model, rows in snapshot.items()}
+
+    def reset(self):
+        """
+        Discard all lookup tables and memoized lookups.
+        """
+        self.rows = {}
+        self.indexes = {}
+        self.memo = {}
+
+    def after_flush(self, session, flush_context):
+        for record in session.new:
+            if self.dimension(type(record)) is not None:
+                self.register(record)
+
+
+class NaturalKeyRegistry(SessionCache):
+    """
+    In-memory sets of the natural keys of database records, shared by all ingestion objects of a session.
+
+    Keys of competition- and season-specific models are loaded one competition season at a time.
+    Keys of all other models are loaded at once.  Keys of records accepted for insertion are added
+    to the sets, so that duplicate records inside a data file are detected before insertion.
+    """
+
+    KEY = 'natural_keys'
+    SCOPE_FIELDS = ('competition_id', 'season_id')
+
+    def __init__(self, session):
+        super(NaturalKeyRegistry, self).__init__(session)
+        self.keys = {}
+
+    @classmethod
+    def is_scoped(cls, model):
+        """
+        Return True if natural keys of model are loaded by competition season.
+        """
+        return set(cls.SCOPE_FIELDS) < set(model.__natural_key__)
+
+    def key_set(self, model, scope):
+        """
+        Retrieve set of natural keys of model records, loading them from the database if necessary.
+
+        :param model: Marcotti-MLS data model.
+        :param scope: Tuple of (competition ID, season ID) or empty tuple.
+        :return: Set of natural key tuples.
+        """
+        if (model, scope) not in self.keys:
+            query = self.session.query(*[getattr(model, field) for field in model.__natural_key__])
+            if scope:
+                query = query.filter_by(**dict(zip(NaturalKeyRegistry.SCOPE_FIELDS, scope)))
+            self.keys[(model, scope)] = set(tuple(row) for row in query)
+            logger.debug("Loaded {} {} keys for scope {}".format(
+                len(self.keys[(model, scope)]), model.__name__, scope))
+        return self.keys[(model, scope)]
+
+    def claim(self, model, **fields):
+        """
+        Check that natural key of record is new, and if so, add it to the key set.
+
+        :param model: Marcotti-MLS data model.
+        :param fields: Dictionary of fields/values of record.  Missing key fields are treated as None.
+        :return: Boolean value that is True if natural key is new.
+        """
+        scope = tuple(fields.get(field) for field in NaturalKeyRegistry.SCOPE_FIELDS) \
+            if self.is_scoped(model) else ()
+        key = tuple(fields.get(field) for field in model.__natural_key__)
+        keys = self.key_set(model, scope)
+        if key in keys:
+            return False
+        keys.add(key)
+        return True
+
+    def forget(self, model):
+        """
+        Discard natural keys of model, so that they are reloaded from the database on next use.
+        """
+        self.keys = {(key_model, scope): keys for (key_model, scope), keys in self.keys.items()
+                     if key_model is not model}
+
+    def reset(self):
+        """
+        Discard natural keys of all models.
+        """
+        self.keys = {}
+
+
+class BaseIngest(object):
+    """
+    Base class of data file ingestions.
+
+    Ingestions write records with a record writer (CoreWriter by default).  Other options are passed
+    by keyword, and OPTIONS declares the options of an ingestion class and their defaults:
+
+    - rejects: Sink of rejected rows, or None to log them only.
+    - cache: ParsedFeedCache of parsed data files, or None.
+    """
+
+    OPTIONS = dict(rejects=None, cache=None)
+
+    def __init__(self, session, writer=None, **options):
+        unknown = set(options) - set(self.OPTIONS)
+        if unknown:
+            raise TypeError("Unknown options of {}: {}".format(type(self).__name__, ', '.join(sorted(unknown))))
+        options = dict(self.OPTIONS, **options)
         self.session = session
+        self.writer = writer or CoreWriter(session)
+        self.upsert = False
+        self.pipeline = False
+        self.mapped = False
+        self.counts = Counter()
+        self.rejects = RejectLog(type(self).__name__, options['rejects'])
+        self.cache = options['cache']
+        self.checkpoint = None
+        self.checksum = None
+        self.position = None
+
+    @property
+    def dimensions(self):
+        return DimensionCache.for_session(self.session)
 
     def get_id(self, model, **conditions):
         """
         Retrieve unique ID of record in database model that satisfies conditions.
 
-        If no unique record exists, communicate error in log file and return None.
+        Lookups on dimension models (Countries, Competitions, Clubs, Years, Seasons) are served
+        by the session's dimension cache.
+
+        If no unique record exists, return None.  Ingestions record the row as rejected.
 
         :param model: Marcotti-MLS data model.
         :param conditions: Dictionary of fields/values that describe a record in model.
         :return: Unique ID of database record.
         """
         record_id = None
+        if self.dimensions.dimension(model) is not None:
+            record_ids = self.dimensions.lookup(model, **conditions)
+            if len(record_ids) == 1:
+                record_id = record_ids[0]
+            return record_id
         try:
             record_id = self.session.query(model).filter_by(**conditions).one().id
-        except NoResultFound:
-            logger.error("{} has no records in Marcotti database for: {}".format(model.__name__, conditions))
-        except MultipleResultsFound:
-            logger.error("{} has multiple records in Marcotti database for: {}".format(model.__name__, conditions))
+        except (NoResultFound, MultipleResultsFound):
+            pass
         return record_id
 
+    @property
+    def natural_keys(self):
+        return NaturalKeyRegistry.for_session(self.session)
+
     def record_exists(self, model, **conditions):
         """
         Check for existence of specific record in database.
@@ -44,25 +326,121 @@ class BaseIngest(object):
         """
         return self.session.query(model).filter_by(**conditions).count() != 0
 
-    def bulk_insert(self, record_list, threshold):
+    def reject(self, reason, name=None, **values):
+        """
+        Record current row of data feed as rejected.
+
+        :param reason: Reason code of rejection, such as 'unknown_club'.
+        :param name: Value that could not be resolved, or None.
+        :param values: Dictionary of fields/values of rejected row.
+        """
+        self.rejects.add(reason, name, self.counts['read'] - self.rejects.offset, **values)
+
+    def claim_key(self, model, **fields):
+        """
+        Check that natural key of record is not in database or already accepted for insertion.
+
+        If the key is new, it is claimed for the record so that later duplicates are rejected.
+
+        :param model: Marcotti-MLS data model.
+        :param fields: Dictionary of fields/values of record.
+        :return: Boolean value that is True if record is new.
+        """
+        if self.natural_keys.claim(model, **fields):
+            return True
+        self.counts['skipped'] += 1
+        return False
+
+    def bulk_insert(self, record_list, threshold, model=None):
         """
         Add list of data models to database transaction if enough models are present.
 
         After bulk insertion, list is reset to empty.
 
-        :param record_list: List of SQLAlchemy objects
+        :param record_list: List of SQLAlchemy objects, or list of field dictionaries if model is defined
         :param threshold: Number of objects in list required to bulk insertions
+        :param model: Marcotti-MLS data model of field dictionaries, or None
         :return: tuple of (number of records inserted, list of objects)
         """
         if len(record_list) != threshold:
             inserted = 0
         else:
-            self.session.add_all(record_list)
-            self.session.commit()
+            inserted = self.write_records(record_list, model)
             record_list = []
-            inserted = threshold
         return inserted, record_list
 
+    def write_records(self, record_list, model=None):
+        """
+        Write list of records to database and commit transaction.
+
+        Field dictionaries of a data model are written by the ingestion's record writer, as upserts
+        if the ingestion is in upsert mode, and SQLAlchemy objects are added to the session.
+
+        If a batch of field dictionaries violates a database constraint, for example because another
+        session has written a record with the same natural key since the keys were loaded, the batch
+        is rolled back and its records are written one at a time.  Records that fail again are rejected.
+
+        :param record_list: List of SQLAlchemy objects, or list of field dictionaries if model is defined
+        :param model: Marcotti-MLS data model of field dictionaries, or None
+        :return: Number of records written.
+        """
+        if model is None:
+            if not self.dry_run:
+                self.session.add_all(record_list)
+        else:
+            write = self.writer.upsert if self.upsert else self.writer.write
+            try:
+                write(model, record_list)
+            except IntegrityError:
+                self.session.rollback()
+                record_list = self.write_each(write, model, record_list)
+        self.commit()
+        self.counts['inserted'] += len(record_list)
+        return len(record_list)
+
+    def write_each(self, write, model, record_list):
+        """
+        Write records one at a time, each in a transaction of its own, and reject the records that
+        violate a database constraint.
+
+        :param write: Write or upsert method of record writer.
+        :param model: Marcotti-MLS data model of field dictionaries.
+        :param record_list: List of field dictionaries.
+        :return: List of records written.
+        """
+        written = []
+        for record in record_list:
+            try:
+                write(model, [record])
+                self.session.commit()
+                written.append(record)
+            except IntegrityError as ex:
+                self.session.rollback()
+                logger.warning(u"{} record not written: {}".format(model.__name__, ex.orig))
+                self.rejects.add('constraint_violation', None, None, **record)
+        return written
+
+    @property
+    def dry_run(self):
+        """
+        True if the ingestion writes nothing to the database, because its record writer is a null writer.
+        """
+        return self.writer.dry_run
+
+    def commit(self):
+        """
+        Commit transaction, unless the ingestion is a dry run.
+
+        If a data file is checkpointed, the number of its rows processed so far is saved in the same
+        transaction.  Rows are processed when they are read, or in a pipeline, when they reach the
+        write stage (position).
+        """
+        if not self.dry_run:
+            if self.checkpoint is not None:
+                position = self.counts['read'] if self.position is None else self.position
+                self.checkpoint.save(position - self.checkpoint.offset)
+            self.session.commit()
+
     @staticmethod
     def prepare_db_dict(fields, values):
         """
@@ -76,57 +454,414 @@ class BaseIngest(object):
         """
         return {field: value for (field, value) in zip(fields, values) if value is not None and value >= 0}
 
+    @property
+    def summary(self):
+        """
+        Counts of rows read by ingestion, and of records inserted, skipped as existing, and rejected.
+
+        In upsert mode, records that update existing records are counted as inserted and as updated.
+        In dry runs, records that would be inserted are counted as inserted.
+
+        :return: Dictionary of counts.
+        """
+        summary = {key: self.counts[key] for key in ['read', 'inserted', 'updated', 'skipped']}
+        summary['rejected'] = summary['read'] - summary['inserted'] - summary['skipped']
+        return summary
+
+    def count_rows(self, rows):
+        """
+        Pass rows of data feed through while counting them.
+        """
+        for row in rows:
+            self.counts['read'] += 1
+            yield row
+
     def load_feed(self, handle):
         raise NotImplementedError
 
 
+CSV_CONVERTERS = {
+    str: str,
+    unicode: lambda value: value.decode('utf-8'),
+    int: int,
+    float: float,
+    bool: lambda value: bool(int(value)),
+    date: lambda value: date(*tuple(int(x) for x in value.split('-')))
+}
+
+
+class CSVRecordReader(object):
+    """
+    Read rows of a CSV data file as records of typed fields.
+
+    Columns are (field, header, type) tuples, where type is one of str, unicode, int, float,
+    bool or date (ISO format).  The header row is compiled once into column positions and
+    converters, and rows are read lazily as named tuples of the fields.  Empty values and
+    columns missing from the file are None.
+    """
+
+    HEADER = True
+
+    def __init__(self, handle, columns):
+        self.rows = csv.reader(handle)
+        self.headers = [name.strip() for name in next(self.rows, [])]
+        positions = {name: index for index, name in enumerate(self.headers)}
+        self.record = namedtuple('CSVRecord', [field for field, _, _ in columns])
+        self.converters = tuple((positions.get(header), CSV_CONVERTERS[kind]) for _, header, kind in columns)
+
+    def __iter__(self):
+        make_record, converters = self.record._make, self.converters
+        for row in self.rows:
+            if not row:
+                continue
+            values = []
+            for index, convert in converters:
+                value = row[index].strip() if index is not None and index < len(row) else ''
+                values.append(convert(value) if value != '' else None)
+            yield make_record(values)
+
+
+class JSONRecordReader(CSVRecordReader):
+    """
+    Read rows of a JSON Lines data file as records of typed fields.
+
+    Each line is a JSON object whose keys are the column headers.  String values are converted
+    like CSV values, and other values are converted to the column type.  Empty strings, nulls and
+    missing keys are None.
+    """
+
+    HEADER = False
+
+    def __init__(self, handle, columns):
+        self.rows = handle
+        self.record = namedtuple('CSVRecord', [field for field, _, _ in columns])
+        self.converters = tuple((header, kind, CSV_CONVERTERS[kind]) for _, header, kind in columns)
+
+    def __iter__(self):
+        make_record, converters = self.record._make, self.converters
+        for line in self.rows:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            values = []
+            for header, kind, convert in converters:
+                value = row.get(header)
+                if isinstance(value, basestring):
+                    value = value.strip()
+                    value = convert(value.encode('utf-8')) if value != '' else None
+                elif value is not None and kind is not date:
+                    value = kind(value)
+                values.append(value)
+            yield make_record(values)
+
+
+FEED_FORMATS = {
+    '.jsonl': JSONRecordReader,
+    '.ndjson': JSONRecordReader
+}
+
+
+def feed_format(handle):
+    """
+    Select reader class of a data file by the extension of its name.
+
+    Data files with extension .jsonl or .ndjson (before any compression extension) are JSON Lines
+    files, and all other data files are CSV files.  Byte ranges of data files are named after the
+    data file with the offsets of the range (MappedRange).
+
+    :param handle: File handle or name of data file.
+    :return: CSVRecordReader or JSONRecordReader class.
+    """
+    name = handle if isinstance(handle, basestring) else getattr(handle, 'name', None)
+    if not isinstance(name, basestring):
+        return CSVRecordReader
+    base, extension = os.path.splitext(re.sub(r'#\d+-\d+$', '', name.lower()))
+    if extension in ('.gz', '.bz2', '.xz'):
+        extension = os.path.splitext(base)[1]
+    return FEED_FORMATS.get(extension, CSVRecordReader)
+
+
 class BaseCSV(BaseIngest):
+    """
+    Ingestion methods for CSV data files.
+
+    Subclasses declare the columns that they read in COLUMNS as (field, header, type) tuples.
+
+    Subclasses that write records of one data model (MODEL) convert each row to model fields in
+    transform, and can run in an ETLPipeline.
+
+    In mapped mode, local data files are read through memory-mapped windows (see MappedFeed).
+    """
+
+    COLUMNS = ()
+    MODEL = None
 
     def load_feed(self, handle):
-        rows = csv.DictReader(handle)
-        self.parse_file(rows)
+        if self.mapped and is_mappable(handle):
+            with closing(MappedFeed(handle.name, feed_format(handle).HEADER)) as feed:
+                self.load_lines(handle, feed.lines())
+        else:
+            self.load_lines(handle)
 
-    @staticmethod
-    def column(field, **kwargs):
-        try:
-            value = kwargs[field].strip()
-            return value if value != "" else None
-        except (AttributeError, KeyError, TypeError) as ex:
-            raise ex
+    def load_lines(self, handle, lines=None):
+        """
+        Ingest lines of data file.
 
-    def column_unicode(self, field, **kwargs):
-        try:
-            return self.column(field, **kwargs).decode('utf-8')
-        except (KeyError, AttributeError):
-            return None
+        :param handle: File handle of data file.
+        :param lines: Iterable of lines of data file, if they are not read from handle.
+        """
+        if self.pipeline and self.MODEL is not None:
+            ETLPipeline(self).load_feed(handle, lines)
+            return
+        rows = self.start_feed(handle, lines)
+        self.parse_file(self.count_rows(rows))
+        self.finish_feed()
+
+    def start_feed(self, handle, lines=None):
+        """
+        Start ingestion of data file and create reader of its records.
 
-    def column_int(self, field, **kwargs):
-        try:
-            return int(self.column(field, **kwargs))
-        except (KeyError, TypeError):
-            return None
+        If the ingestion has a parsed-feed cache, records of local data files are read from the
+        cache, or written to it as they are parsed.  Rows committed by an interrupted ingestion of
+        the data file are skipped.
 
-    def column_bool(self, field, **kwargs):
-        try:
-            return bool(self.column_int(field, **kwargs))
-        except (KeyError, TypeError):
-            return None
+        :param handle: File handle of data file.
+        :param lines: Iterable of lines of data file, if they are not read from handle.
+        :return: Iterator of data file records.
+        """
+        position = self.checkpoint.position if self.checkpoint is not None else 0
+        offset = self.counts['read'] - position
+        self.rejects.start(getattr(handle, 'name', None), offset)
+        if self.checkpoint is not None:
+            self.checkpoint.offset = offset
+        reader_class = feed_format(handle)
+        parse = lambda: iter(reader_class(handle if lines is None else lines, self.COLUMNS))
+        if self.cache is not None and self.checksum is not None:
+            record = namedtuple('CSVRecord', [field for field, _, _ in self.COLUMNS])
+            signature = repr((reader_class.__name__,
+                              [(field, header, kind.__name__) for field, header, kind in self.COLUMNS]))
+            rows = self.cache.records(self.checksum, signature, record._make, parse, getattr(handle, 'name', None))
+        else:
+            rows = parse()
+        if position:
+            logger.info("Resuming {} after {} committed rows".format(type(self).__name__, position))
+            return islice(rows, position, None)
+        return iter(rows)
 
-    def column_float(self, field, **kwargs):
-        try:
-            return float(self.column(field, **kwargs))
-        except (KeyError, TypeError):
-            return None
+    def collect_resolution(self, resolver):
+        """
+        Add the resolution counts of a copy of the ingestion that transformed records in another session.
+
+        :param resolver: Ingestion object.
+        """
+        pass
+
+    def finish_feed(self):
+        """
+        Complete ingestion of data file: report rejected rows, and end dry runs.
+        """
+        self.rejects.report()
+        if self.dry_run:
+            self.session.rollback()
+            logger.info("Dry run of {}: {}".format(type(self).__name__, u", ".join(
+                u"{}={}".format(key, value) for key, value in sorted(self.summary.items()))))
 
     def parse_file(self, rows):
         raise NotImplementedError
 
+    def transform(self, row):
+        """
+        Convert record of data file to fields of a MODEL record, resolving their IDs.
+
+        Rows that cannot be converted are recorded as rejected.
+
+        :param row: Record of data file.
+        :return: Dictionary of MODEL fields/values, or None if the row is rejected.
+        """
+        raise NotImplementedError
+
+    def insert_records(self, records):
+        """
+        Write MODEL records whose natural keys are new to the database, in batches of BATCH_SIZE.
+
+        :param records: Iterable of dictionaries of MODEL fields/values, or None for rejected rows.
+        :return: Number of records inserted.
+        """
+        inserts = 0
+        insertion_list = []
+        for record in records:
+            if record is not None and self.claim_key(self.MODEL, **record):
+                insertion_list.append(record)
+                inserted, insertion_list = self.bulk_insert(insertion_list, self.BATCH_SIZE, self.MODEL)
+                inserts += inserted
+                if inserted and not inserts % self.BATCH_SIZE:
+                    logger.info("{} records inserted".format(inserts))
+        inserts += self.write_records(insertion_list, self.MODEL)
+        return inserts
+
+
+class PlayerNameResolver(SessionCache):
+    """
+    In-memory index of player IDs keyed on full name, and on full name and birth date.
+
+    The index is built with one query per session, and players flushed by the session are added to it.
+    Resolution counts are kept until they are reported.
+    """
+
+    KEY = 'player_resolver'
+
+    def __init__(self, session):
+        super(PlayerNameResolver, self).__init__(session)
+        self.names = None
+        self.birth_names = None
+        self.hits = 0
+        self.misses = 0
+        self.ambiguous = 0
+
+    def build(self):
+        """
+        Load full names and birth dates of all players into index.
+        """
+        self.names = {}
+        self.birth_names = {}
+        for player_id, full_name, birth_date in self.session.query(Players.id, Players.full_name,
+                                                                   Players.birth_date):
+            self.add(player_id, full_name, birth_date)
+        logger.debug("Loaded {} player names into resolver index".format(len(self.names)))
+
+    def add(self, player_id, full_name, birth_date):
+        self.names.setdefault(full_name, []).append(player_id)
+        self.birth_names.setdefault((full_name, birth_date), []).append(player_id)
+
+    def resolve(self, full_name, birth_date=None):
+        """
+        Retrieve unique ID of player with full name and, if given, birth date.
+
+        If no unique player exists, return None.  Resolution counts are logged by report.
+
+        :param full_name: Full name of player.
+        :param birth_date: Date object of player's birth date or None.
+        :return: Unique ID of player.
+        """
+        if self.names is None:
+            self.build()
+        if birth_date is None:
+            player_ids = self.names.get(full_name, [])
+        else:
+            player_ids = self.birth_names.get((full_name, birth_date), [])
+        if len(player_ids) == 1:
+            self.hits += 1
+            return player_ids[0]
+        elif not player_ids:
+            self.misses += 1
+        else:
+            self.ambiguous += 1
+        return None
+
+    def report(self):
+        """
+        Log player resolution counts and reset them.
+        """
+        logger.info("Player name resolution: {} resolved, {} not found, {} ambiguous".format(
+            self.hits, self.misses, self.ambiguous))
+        self.hits, self.misses, self.ambiguous = 0, 0, 0
+
+    def after_flush(self, session, flush_context):
+        if self.names is None:
+            return
+        for record in session.new:
+            if isinstance(record, Players):
+                self.add(record.id, record.full_name, record.birth_date)
+
+    def reset(self):
+        """
+        Discard player index, so that it is rebuilt on next resolution.
+        """
+        self.names = None
+        self.birth_names = None
+
 
 class SeasonalDataIngest(BaseCSV):
     """
     Ingestion methods for competition- and season-specific data.
+
+    COLUMNS identify the player, club, competition and season of a record.
+
+    In upsert mode, records whose natural key exists in the database replace the existing records.
+    In pipeline mode, data files are ingested by an ETLPipeline.  In mapped mode, local data files
+    are read through memory-mapped windows.
+
+    If a match threshold is given, player names that are not resolved exactly are matched to players
+    with similar names by a PlayerMatchIndex.  Names whose best candidate is not above the threshold
+    are rejected with the candidates as suggestions.
+
+    Options, in addition to those of BaseIngest: upsert, pipeline and mapped modes (True/False), and
+    match_threshold (or None).
     """
 
+    OPTIONS = dict(BaseIngest.OPTIONS, upsert=False, pipeline=False, mapped=False, match_threshold=None)
+
+    COLUMNS = (
+        ('competition', "Competition", unicode),
+        ('season', "Season", str),
+        ('club_symbol', "Club Symbol", str),
+        ('last_name', "Last Name", unicode),
+        ('first_name', "First Name", unicode)
+    )
+
+    def __init__(self, session, writer=None, **options):
+        super(SeasonalDataIngest, self).__init__(session, writer, **options)
+        options = dict(self.OPTIONS, **options)
+        self.upsert = options['upsert']
+        self.pipeline = options['pipeline']
+        self.mapped = options['mapped']
+        self.match_threshold = options['match_threshold']
+        self.candidates = []
+
+    @property
+    def players(self):
+        return PlayerNameResolver.for_session(self.session)
+
+    @property
+    def matcher(self):
+        return PlayerMatchIndex.for_session(self.session)
+
+    def collect_resolution(self, resolver):
+        players = resolver.players
+        self.players.hits += players.hits
+        self.players.misses += players.misses
+        self.players.ambiguous += players.ambiguous
+        if self.match_threshold is not None:
+            self.matcher.matched += resolver.matcher.matched
+            self.matcher.suggested += resolver.matcher.suggested
+
+    def reject(self, reason, name=None, **values):
+        if reason == 'unknown_player' and self.candidates:
+            values['candidates'] = u"; ".join(u"{} [{}] ({:.2f})".format(candidate.name, candidate.player_id,
+                                                                         candidate.score)
+                                              for candidate in self.candidates)
+        super(SeasonalDataIngest, self).reject(reason, name, **values)
+
+    def claim_key(self, model, **fields):
+        """
+        Check that natural key of record is new, or in upsert mode, count record as an update if it is not.
+
+        :param model: Marcotti-MLS data model.
+        :param fields: Dictionary of fields/values of record.
+        :return: Boolean value that is True if record is to be written.
+        """
+        if not self.upsert:
+            return super(SeasonalDataIngest, self).claim_key(model, **fields)
+        if not self.natural_keys.claim(model, **fields):
+            self.counts['updated'] += 1
+        return True
+
+    def load_feed(self, handle):
+        super(SeasonalDataIngest, self).load_feed(handle)
+        self.players.report()
+        if self.match_threshold is not None:
+            self.matcher.report()
+
     def get_player_from_name(self, first_name, last_name):
         """
         Retrieve player ID associated with player's full name.
@@ -134,24 +869,73 @@ class SeasonalDataIngest(BaseCSV):
         To avoid ambiguity, some last names include the player's birthdate separated by ':'.
         In this situation, the player is searched by full name and birthdate.
 
+        If the name is not resolved and a match threshold is given, the name is matched to players
+        with similar names, and the candidates are kept for the rejection of the row.
+
         :param first_name: First name of player (or last name in case of Eastern word order)
         :param last_name: Last name of player that makes up full name.  Can include birthdate separated by ':'.
         :return: Unique ID of player.
         """
+        self.candidates = []
+        birth_date = None
         if ':' in last_name:
-            last_name_text, birth_date = last_name.split(':')
+            last_name_text, birth_date_iso = last_name.split(':')
             full_name = " ".join([first_name, last_name_text]) if first_name else last_name_text
-            player_id = self.get_id(Players, full_name=full_name, birth_date=birth_date)
+            try:
+                birth_date = date(*tuple(int(x) for x in birth_date_iso.split('-')))
+            except (TypeError, ValueError):
+                return None
+            player_id = self.players.resolve(full_name, birth_date)
         else:
             full_name = " ".join([first_name, last_name]) if first_name else last_name
-            player_id = self.get_id(Players, full_name=full_name)
+            player_id = self.players.resolve(full_name)
+        if player_id is None and self.match_threshold is not None:
+            player_id, self.candidates = self.matcher.match(full_name, self.match_threshold, birth_date)
         return player_id
 
     def parse_file(self, rows):
         return NotImplementedError
 
 
-def ingest_feeds(handle_iterator, prefix, pattern, feed_class):
+def ingest_feed(feed_class, handle, force=False):
+    """Ingest contents of one data file and record it in the feed manifest.
+
+    Local data files whose content is unchanged since their last successful ingestion
+    by the same feed class are skipped.  Batches of local data files are checkpointed as they
+    are committed, and an interrupted ingestion of the same content resumes after the last
+    committed batch.
+
+    :param feed_class: Data feed interface class.
+    :type feed_class: class
+    :param handle: File handle of data file.
+    :type handle: file
+    :param force: If True, ingest data file even if it is unchanged.
+    :type force: bool
+    :return: Dictionary of ingestion counts of data file, or None if the file was skipped.
+    """
+    manifest = FeedManifest(feed_class.session)
+    path = manifest.path(handle)
+    stats = manifest.file_stats(handle) if path is not None else None
+    entity = type(feed_class).__name__
+    if path is not None and not force and manifest.is_unchanged(path, entity, stats):
+        logger.info(u"Skipping data file {}: unchanged since last ingestion".format(path))
+        return None
+    start = feed_class.summary
+    if path is not None and not feed_class.dry_run:
+        feed_class.checkpoint = FeedCheckpoint(feed_class.session, path, entity, stats['checksum'])
+    feed_class.checksum = stats['checksum'] if stats is not None else None
+    try:
+        feed_class.load_feed(handle)
+    finally:
+        feed_class.checkpoint = None
+        feed_class.checksum = None
+    summary = {key: value - start[key] for key, value in feed_class.summary.items()}
+    if path is not None and not feed_class.dry_run:
+        manifest.record(path, entity, stats, summary)
+    return summary
+
+
+def ingest_feeds(handle_iterator, prefix, pattern, feed_class, force=False):
     """Ingest contents of XML files of a common type, as
     described by a common filename pattern.
 
@@ -163,24 +947,34 @@ def ingest_feeds(handle_iterator, prefix, pattern, feed_class):
     :type pattern: tuple
     :param feed_class: Data feed interface class.
     :type feed_class: class
+    :param force: If True, ingest data files that are unchanged since their last ingestion.
+    :type force: bool
     """
     for handle in handle_iterator(prefix, pattern):
-        feed_class.load_feed(handle)
+        ingest_feed(feed_class, handle, force)
 
 
 def get_local_handles(prefix, pattern):
     """Generates a sequence of file handles for XML files of a common type
     that are hosted on a local machine.
 
+    Compressed files (.gz, .bz2, .xz) are decompressed as they are read, and .zip archives
+    generate a handle for each member.  A pattern that ends in '-' reads the standard input.
+
     :param prefix: Common path, which is also defined as the prefix of the filename.
     :type prefix: string
     :param pattern: Local path and text pattern common to group of files.
     :type pattern: tuple
     """
+    if pattern and pattern[-1] == '-':
+        logger.info("Loading data file from standard input")
+        for fh in open_feeds('-'):
+            yield fh
+        return
     glob_pattern = os.path.join(prefix, *pattern)
     for filename in glob.glob(glob_pattern):
         logger.info("Loading data file {}".format(filename))
-        with open(filename) as fh:
+        for fh in open_feeds(filename):
             yield fh
 
 
@@ -188,54 +982,40 @@ def create_seasons(session, start_yr, end_yr):
     """
     Adds Years and calendar and European Seasons records to database.
 
+    Existing Years and Seasons records are read with one query per table, and missing records are
+    inserted with one statement per table.  Years and Seasons are then reloaded by the session's
+    dimension cache on next use.
+
     :param session: Transaction session object.
     :param start_yr: Start of year interval.
     :param end_yr: End of year interval, inclusive.
     """
-    def exists(model, **conditions):
-        return session.query(model).filter_by(**conditions).count() != 0
-
     logger.info("Creating Years between {0} and {1}...".format(start_yr, end_yr))
 
     year_range = range(start_yr, end_yr+1)
-    for yr in year_range:
-        if not exists(Years, yr=yr):
-            session.add(Years(yr=yr))
-    session.commit()
-    session.flush()
+    existing_years = set(yr for yr, in session.query(Years.yr))
+    new_years = [dict(yr=yr) for yr in year_range if yr not in existing_years]
+    if new_years:
+        session.execute(Years.__table__.insert(), new_years)
+    logger.info("{} Year records inserted".format(len(new_years)))
 
     logger.info("Creating Seasons...")
 
-    # insert calendar year season record
-    for year in year_range:
-        try:
-            yr_obj = session.query(Years).filter_by(yr=year).one()
-        except NoResultFound:
-            logger.error("Cannot insert Season record: {} not in database".format(year))
-            continue
-        except MultipleResultsFound:
-            logger.error("Cannot insert Season record: multiple {} records in database".format(year))
-            continue
-        if not exists(Seasons, start_year=yr_obj, end_year=yr_obj):
-            logger.info("Creating record for {0} season".format(yr_obj.yr))
-            season_record = Seasons(start_year=yr_obj, end_year=yr_obj)
-            session.add(season_record)
-
-    # insert European season record
-    for start, end in zip(year_range[:-1], year_range[1:]):
-        try:
-            start_yr_obj = session.query(Years).filter_by(yr=start).one()
-            end_yr_obj = session.query(Years).filter_by(yr=end).one()
-        except NoResultFound:
-            logger.error("Cannot insert Season record: {} or {} not in database".format(start, end))
-            continue
-        except MultipleResultsFound:
-            logger.error("Cannot insert Season record: multiple {} or {} records in database".format(start, end))
-            continue
-        if not exists(Seasons, start_year=start_yr_obj, end_year=end_yr_obj):
-            logger.info("Creating record for {0}-{1} season".format(start_yr_obj.yr, end_yr_obj.yr))
-            season_record = Seasons(start_year=start_yr_obj, end_year=end_yr_obj)
-            session.add(season_record)
+    # calendar year seasons, then European seasons
+    year_ids = dict(session.query(Years.yr, Years.id).filter(Years.yr.between(start_yr, end_yr)))
+    existing_seasons = set(tuple(row) for row in session.query(Seasons.start_year_id, Seasons.end_year_id))
+    new_seasons = []
+    for start, end in zip(year_range, year_range) + zip(year_range[:-1], year_range[1:]):
+        key = (year_ids[start], year_ids[end])
+        if key not in existing_seasons:
+            logger.debug("Creating record for {0} season".format(
+                start if start == end else "{0}-{1}".format(start, end)))
+            new_seasons.append(dict(start_year_id=key[0], end_year_id=key[1]))
+    if new_seasons:
+        session.execute(Seasons.__table__.insert(), new_seasons)
     session.commit()
-    logger.info("Season records committed to database")
+    cache = DimensionCache.for_session(session)
+    cache.forget(Years)
+    cache.forget(Seasons)
+    logger.info("{} Season records committed to database".format(len(new_seasons)))
     logger.info("Season creation complete.")
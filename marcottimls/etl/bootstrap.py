@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import inspect, text, UniqueConstraint
+from sqlalchemy.exc import IntegrityError
+
+from marcottimls.etl.base import create_seasons, ingest_feed
+from marcottimls.etl.manifest import FeedManifest
+from marcottimls.etl.overview import CountryIngest
+from marcottimls.models import BaseSchema, BootstrapStates
+from marcottimls.version import __version__
+
+logger = logging.getLogger(__name__)
+
+
+COUNTRIES_FILE = 'countries.csv'
+
+
+def schema_signature(metadata):
+    """
+    Describe tables, columns and unique constraints of schema metadata as a list of strings.
+
+    :param metadata: MetaData object of schema.
+    :return: List of strings.
+    """
+    signature = []
+    for table in metadata.sorted_tables:
+        signature.append(table.name)
+        signature.extend("{}.{} {!r} nullable={} unique={}".format(
+            table.name, column.name, column.type, column.nullable, column.unique) for column in table.columns)
+        constraints = [', '.join(column.name for column in constraint.columns)
+                       for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+        signature.extend("{} unique ({})".format(table.name, columns) for columns in sorted(constraints))
+    return signature
+
+
+def missing_unique_constraints(connection, metadata):
+    """
+    Find unique constraints of schema metadata that existing database tables lack.
+
+    create_all does not alter existing tables, so tables created before a unique constraint was added
+    to their model do not have it.  Unique indexes on the same columns count as unique constraints.
+
+    :param connection: Connection object.
+    :param metadata: MetaData object of schema.
+    :return: List of (table name, list of column names) tuples.
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = [set(constraint['column_names']) for constraint in inspector.get_unique_constraints(table.name)]
+        existing.extend(set(index['column_names']) for index in inspector.get_indexes(table.name) if index['unique'])
+        for constraint in table.constraints:
+            columns = [column.name for column in constraint.columns]
+            if isinstance(constraint, UniqueConstraint) and set(columns) not in existing:
+                missing.append((table.name, columns))
+    return missing
+
+
+def add_unique_constraints(connection, metadata):
+    """
+    Add unique constraints of schema metadata that existing database tables lack, as unique indexes.
+
+    :param connection: Connection object.
+    :param metadata: MetaData object of schema.
+    :return: List of names of unique indexes created.
+    :raises ValueError: if a table holds duplicate values of the columns of a missing constraint.
+    """
+    preparer = connection.dialect.identifier_preparer
+    created = []
+    for table_name, columns in missing_unique_constraints(connection, metadata):
+        name = 'uq_{}_{}'.format(table_name, '_'.join(columns))
+        logger.info("Adding unique index {} to existing table {}".format(name, table_name))
+        try:
+            connection.execute(text("CREATE UNIQUE INDEX {} ON {} ({})".format(
+                preparer.quote(name), preparer.quote(table_name),
+                ', '.join(preparer.quote(column) for column in columns))))
+        except IntegrityError:
+            raise ValueError("Table {} has duplicate rows on ({}): remove them before adding its unique "
+                             "constraint".format(table_name, ', '.join(columns)))
+        created.append(name)
+    return created
+
+
+def check_unique_constraints(connection, metadata):
+    """
+    Check that existing database tables have the unique constraints of schema metadata, which upserts need.
+
+    :param connection: Connection object.
+    :param metadata: MetaData object of schema.
+    :raises ValueError: if unique constraints are missing.
+    """
+    missing = missing_unique_constraints(connection, metadata)
+    if missing:
+        raise ValueError("Tables lack unique constraints required by upsert mode: {}.  Bootstrap the database "
+                         "with force=True or call add_unique_constraints to add them.".format(
+                             ', '.join("{} ({})".format(table, ', '.join(columns)) for table, columns in missing)))
+
+
+def bootstrap_fingerprint(start_yr, end_yr, data_path):
+    """
+    Calculate fingerprint of the database schema and reference data.
+
+    The fingerprint is a SHA-256 hash of the package version, the schema, the year interval and the
+    content of the countries data file.
+
+    :param start_yr: Start of year interval.
+    :param end_yr: End of year interval, inclusive.
+    :param data_path: Directory of countries data file.
+    :return: Hexadecimal fingerprint string.
+    """
+    digest = hashlib.sha256()
+    digest.update(__version__)
+    for line in schema_signature(BaseSchema.metadata):
+        digest.update(line)
+    digest.update("years {}-{}".format(start_yr, end_yr))
+    with open(os.path.join(data_path, COUNTRIES_FILE)) as handle:
+        digest.update(FeedManifest.file_stats(handle)['checksum'])
+    return digest.hexdigest()
+
+
+def bootstrap_db(session, start_yr, end_yr, data_path, force=False):
+    """
+    Create database tables and populate validation tables, unless the schema and reference data are
+    unchanged since the last bootstrap.
+
+    An unchanged database is detected with one query on the bootstrap_states table.  Otherwise,
+    missing tables are created, unique constraints missing from existing tables are added, and missing
+    Years, Seasons and Countries records are inserted in bulk.
+
+    :param session: Transaction session object.
+    :param start_yr: Start of year interval.
+    :param end_yr: End of year interval, inclusive.
+    :param data_path: Directory of countries data file.
+    :param force: If True, bootstrap database even if it is unchanged.
+    :return: True if database was bootstrapped, False if it was unchanged.
+    """
+    fingerprint = bootstrap_fingerprint(start_yr, end_yr, data_path)
+    connection = session.connection()
+    if not force and BootstrapStates.__table__.exists(bind=connection):
+        state = session.query(BootstrapStates).filter_by(name='reference_data').first()
+        if state is not None and state.fingerprint == fingerprint:
+            logger.info("Database schema and reference data unchanged: skipping bootstrap")
+            return False
+    logger.info("Creating data models...")
+    BaseSchema.metadata.create_all(connection)
+    add_unique_constraints(connection, BaseSchema.metadata)
+    create_seasons(session, start_yr, end_yr)
+    with open(os.path.join(data_path, COUNTRIES_FILE)) as handle:
+        ingest_feed(CountryIngest(session), handle, force=True)
+    state = session.query(BootstrapStates).filter_by(name='reference_data').first()
+    if state is None:
+        state = BootstrapStates(name='reference_data')
+        session.add(state)
+    state.fingerprint = fingerprint
+    state.loaded_at = datetime.now()
+    session.commit()
+    logger.info("Database bootstrap complete.")
+    return True
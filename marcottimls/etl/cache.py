@@ -0,0 +1,123 @@
+import cPickle
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class ParsedFeedCache(object):
+    """
+    On-disk cache of data files after parsing and type conversion.
+
+    Records of a data file are stored as pickled batches of tuples, in a file named by the hash of
+    the data file's content and of the columns that are read from it.  A data file whose content
+    changes is parsed again, and its cache file is written anew as it is parsed.  Cache files of
+    named data files are prefixed with the hash of the name and columns, and when a new cache file
+    of a data file is complete, its older cache files are deleted.
+    """
+
+    BATCH_SIZE = 5000
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def prefix(signature, name):
+        """
+        Return prefix of the names of cache files of a data file.
+
+        :param signature: Description of the columns and format of the records read from data file.
+        :param name: Name of data file, or None.
+        :return: Prefix of cache file names.
+        """
+        if name is None:
+            return ''
+        return '{}-'.format(hashlib.sha256(repr((name, signature))).hexdigest()[:16])
+
+    def path(self, checksum, signature, name=None):
+        """
+        Return path of cache file of a data file.
+
+        :param checksum: Content hash of data file.
+        :param signature: Description of the columns and format of the records read from data file.
+        :param name: Name of data file, or None.
+        :return: Path of cache file.
+        """
+        key = hashlib.sha256("{}\n{}".format(checksum, signature)).hexdigest()
+        return os.path.join(self.directory, '{}{}.records'.format(self.prefix(signature, name), key))
+
+    def records(self, checksum, signature, make_record, parse, name=None):
+        """
+        Generate records of a data file, from its cache file if it exists.
+
+        Otherwise the data file is parsed, and its records are written to the cache file as they are
+        generated.  The cache file is only kept if all records of the data file are generated, and
+        then replaces the older cache files of a named data file.
+
+        :param checksum: Content hash of data file.
+        :param signature: Description of the columns and format of the records read from data file.
+        :param make_record: Function that creates a record from a tuple of values.
+        :param parse: Function that returns an iterator of parsed records of the data file.
+        :param name: Name of data file, or None.
+        :return: Iterator of records.
+        """
+        path = self.path(checksum, signature, name)
+        if os.path.exists(path):
+            logger.info("Reading parsed records from cache file {}".format(path))
+            return self.read(path, make_record)
+        return self.write(path, parse(), self.prefix(signature, name))
+
+    @staticmethod
+    def read(path, make_record):
+        with open(path, 'rb') as fh:
+            while True:
+                try:
+                    batch = cPickle.load(fh)
+                except EOFError:
+                    return
+                for values in batch:
+                    yield make_record(values)
+
+    def write(self, path, records, prefix=''):
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(handle, 'wb') as fh:
+                batch = []
+                for record in records:
+                    batch.append(tuple(record))
+                    if len(batch) == ParsedFeedCache.BATCH_SIZE:
+                        cPickle.dump(batch, fh, cPickle.HIGHEST_PROTOCOL)
+                        batch = []
+                    yield record
+                if batch:
+                    cPickle.dump(batch, fh, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, path)
+            complete = True
+            logger.info("Wrote parsed records to cache file {}".format(path))
+            if prefix:
+                self.evict(os.path.join(self.directory, '{}*.records'.format(prefix)), path)
+        finally:
+            if not complete and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def evict(pattern, path):
+        """
+        Delete cache files that match a pattern, except the current cache file.
+
+        :param pattern: Glob pattern of cache file paths.
+        :param path: Path of current cache file.
+        """
+        for stale in glob.glob(pattern):
+            if stale != path:
+                logger.info("Deleting stale cache file {}".format(stale))
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
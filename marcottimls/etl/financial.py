@@ -1,27 +1,51 @@
 import datetime
 import logging
 
+from marcottimls.calendars import SeasonCalendar
 from marcottimls.etl import PersonIngest, SeasonalDataIngest
 from marcottimls.models import (Countries, Players, PlayerSalaries, PartialTenures, AcquisitionPaths,
-                                AcquisitionType, PlayerDrafts, Competitions, CompetitionSeasons, Clubs,
+                                AcquisitionType, PlayerDrafts, Competitions, Clubs,
                                 Years, Seasons)
 
 logger = logging.getLogger(__name__)
 
 
+def to_cents(amount):
+    """
+    Convert a currency amount to whole cents.
+
+    The amount in cents is rounded to six decimal places, and then to the nearest integer with
+    halves rounded away from zero, as the staging ingestion does inside the database.
+
+    :param amount: Currency amount.
+    :return: Integer amount in cents.
+    """
+    return int(round(round(amount * 100, 6)))
+
+
 class AcquisitionIngest(PersonIngest):
 
     BATCH_SIZE = 200
 
+    COLUMNS = PersonIngest.COLUMNS + (
+        ('country', "Country", unicode),
+        ('acquisition', "Acquisition", str),
+        ('year', "Year", str),
+        ('round', "Round", int),
+        ('pick', "Pick", int),
+        ('gen_adidas', "Gen Adidas", bool),
+        ('acquiring_club', "Acquiring Club", unicode)
+    )
+
     def parse_file(self, rows):
         inserts = 0
         insertion_list = []
         logger.info("Ingesting Player Acquisition Paths...")
-        for keys in rows:
-            person_dict = self.get_person_data(**keys)
-            country_name = self.column_unicode("Country", **keys)
-            path = self.column("Acquisition", **keys)
-            acquisition_year = self.column("Year", **keys)
+        for row in rows:
+            person_dict = self.get_person_data(row)
+            country_name = row.country
+            path = row.acquisition
+            acquisition_year = row.year
 
             try:
                 acquisition_path = AcquisitionType.from_string(path)
@@ -29,116 +53,104 @@ class AcquisitionIngest(PersonIngest):
                 acquisition_path = None
             country_id = self.get_id(Countries, name=country_name)
             if country_id is None:
-                logger.error(u"Cannot insert Acquisition record for {}: "
-                             u"Database error involving Country record {}".format(person_dict, country_name))
+                self.reject('unknown_country', country_name, **row._asdict())
                 continue
             year_id = self.get_id(Years, yr=acquisition_year)
             if year_id is None:
-                logger.error(u"Cannot insert Acquisition record for {}: "
-                             u"Database error involving Year record {}".format(person_dict, acquisition_year))
+                self.reject('unknown_year', acquisition_year, **row._asdict())
                 continue
             player_dict = dict(country_id=country_id, **person_dict)
             player_id = self.get_id(Players, **player_dict)
             if player_id is None:
-                logger.error(u"Cannot insert Acquisition record for {}: "
-                             u"Database error involving Player record".format(player_dict))
+                self.reject('unknown_player', u" ".join(filter(None, [row.first_name, row.last_name])),
+                            **row._asdict())
                 continue
 
             acquisition_dict = dict(player_id=player_id, year_id=year_id, path=acquisition_path)
-            if not self.record_exists(AcquisitionPaths, **acquisition_dict):
+            if self.claim_key(AcquisitionPaths, **acquisition_dict):
                 acquisition_record = AcquisitionPaths(**acquisition_dict)
                 if acquisition_path in [AcquisitionType.college_draft, AcquisitionType.inaugural_draft,
                                         AcquisitionType.super_draft, AcquisitionType.supplemental_draft]:
-                    acquisition_record = self.parse_draft_data(acquisition_dict, keys)
+                    acquisition_record = self.parse_draft_data(acquisition_dict, row)
                 if acquisition_record is not None:
                     insertion_list.append(acquisition_record)
                 inserted, insertion_list = self.bulk_insert(insertion_list, AcquisitionIngest.BATCH_SIZE)
                 inserts += inserted
                 if inserted and not inserts % AcquisitionIngest.BATCH_SIZE:
                     logger.info("{} records inserted".format(inserts))
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts += self.write_records(insertion_list)
         logger.info("Total {} Acquisition records inserted and committed to database".format(inserts))
         logger.info("Acquisition Ingestion complete.")
 
-    def parse_draft_data(self, acq_tuple, keys):
-        draft_round = self.column_int("Round", **keys)
-        draft_selection = self.column_int("Pick", **keys)
-        is_generation_adidas = self.column_bool("Gen Adidas", **keys)
-        drafting_club = self.column_unicode("Acquiring Club", **keys)
-
-        club_id = self.get_id(Clubs, name=drafting_club)
+    def parse_draft_data(self, acq_tuple, row):
+        club_id = self.get_id(Clubs, name=row.acquiring_club)
         if club_id is None:
-            logger.error(u"Cannot insert {p[Acquisition]} record for {p[First Name]} {p[Last Name]}: "
-                         u"Club {p[Acquiring Club]} not in database".format(p=keys))
+            self.reject('unknown_club', row.acquiring_club, **row._asdict())
             return None
-        return PlayerDrafts(round=draft_round, selection=draft_selection,
-                            gen_adidas=is_generation_adidas, club_id=club_id, **acq_tuple)
+        return PlayerDrafts(round=row.round, selection=row.pick,
+                            gen_adidas=row.gen_adidas, club_id=club_id, **acq_tuple)
 
 
 class PlayerSalaryIngest(SeasonalDataIngest):
 
     BATCH_SIZE = 100
+    MODEL = PlayerSalaries
+
+    COLUMNS = SeasonalDataIngest.COLUMNS + (
+        ('base', "Base", float),
+        ('guaranteed', "Guaranteed", float)
+    )
 
     def parse_file(self, rows):
-        inserts = 0
-        insertion_list = []
         logger.info("Ingesting Player Salaries...")
-        for keys in rows:
-            competition_name = self.column_unicode("Competition", **keys)
-            season_name = self.column("Season", **keys)
-            club_symbol = self.column("Club Symbol", **keys)
-            last_name = self.column_unicode("Last Name", **keys)
-            first_name = self.column_unicode("First Name", **keys)
-            base_salary = int(self.column_float("Base", **keys) * 100)
-            guar_salary = int(self.column_float("Guaranteed", **keys) * 100)
-
-            competition_id = self.get_id(Competitions, name=competition_name)
-            if competition_id is None:
-                logger.error(u"Cannot insert Salary record for {} {}: "
-                             u"Competition {} not in database".format(first_name, last_name, competition_name))
-                continue
-            season_id = self.get_id(Seasons, name=season_name)
-            if season_id is None:
-                logger.error(u"Cannot insert Salary record for {} {}: "
-                             u"Season {} not in database".format(first_name, last_name, season_name))
-                continue
-            club_id = self.get_id(Clubs, symbol=club_symbol)
-            if club_id is None:
-                logger.error(u"Cannot insert Salary record for {} {}: "
-                             u"Club {} not in database".format(first_name, last_name, club_symbol))
-                continue
-            player_id = self.get_player_from_name(first_name, last_name)
-            if player_id is None:
-                logger.error(u"Cannot insert Salary record for {} {}: "
-                             u"Player not in database".format(first_name, last_name))
-                continue
-
-            salary_dict = dict(player_id=player_id, club_id=club_id,
-                               competition_id=competition_id, season_id=season_id)
-            if not self.record_exists(PlayerSalaries, **salary_dict):
-                insertion_list.append(PlayerSalaries(base_salary=base_salary,
-                                                     avg_guaranteed=guar_salary,
-                                                     **salary_dict))
-                inserted, insertion_list = self.bulk_insert(insertion_list, PlayerSalaryIngest.BATCH_SIZE)
-                inserts += inserted
-                if inserted and not inserts % PlayerSalaryIngest.BATCH_SIZE:
-                    logger.info("{} records inserted".format(inserts))
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
         logger.info("Total {} Player Salary records inserted and committed to database".format(inserts))
         logger.info("Player Salary Ingestion complete.")
 
+    def transform(self, row):
+        competition_name = row.competition
+        season_name = row.season
+        club_symbol = row.club_symbol
+        last_name = row.last_name
+        first_name = row.first_name
+        base_salary = to_cents(row.base)
+        guar_salary = to_cents(row.guaranteed)
+
+        competition_id = self.get_id(Competitions, name=competition_name)
+        if competition_id is None:
+            self.reject('unknown_competition', competition_name, **row._asdict())
+            return None
+        season_id = self.get_id(Seasons, name=season_name)
+        if season_id is None:
+            self.reject('unknown_season', season_name, **row._asdict())
+            return None
+        club_id = self.get_id(Clubs, symbol=club_symbol)
+        if club_id is None:
+            self.reject('unknown_club', club_symbol, **row._asdict())
+            return None
+        player_id = self.get_player_from_name(first_name, last_name)
+        if player_id is None:
+            self.reject('unknown_player', u" ".join(filter(None, [first_name, last_name])), **row._asdict())
+            return None
+
+        return dict(player_id=player_id, club_id=club_id, competition_id=competition_id, season_id=season_id,
+                    base_salary=base_salary, avg_guaranteed=guar_salary)
+
 
 class PartialTenureIngest(SeasonalDataIngest):
 
     BATCH_SIZE = 10
+    MODEL = PartialTenures
+
+    COLUMNS = SeasonalDataIngest.COLUMNS + (
+        ('start_term', "Start Term", int),
+        ('end_term', "End Term", int),
+        ('start_date', "Start Date", str),
+        ('end_date', "End Date", str)
+    )
 
     def season_week(self, competition_id, season_id, **kwargs):
-        compseason = self.session.query(CompetitionSeasons).filter_by(
-            competition_id=competition_id, season_id=season_id).one()
+        calendar = SeasonCalendar.for_session(self.session)
         if 'start' in kwargs:
             ref_date_string = kwargs.get('start')
             if ref_date_string is None:
@@ -146,65 +158,53 @@ class PartialTenureIngest(SeasonalDataIngest):
         elif 'end' in kwargs:
             ref_date_string = kwargs.get('end')
             if ref_date_string is None:
-                date_delta = compseason.end_date - compseason.start_date
-                return date_delta.days / 7 + 1
+                return calendar.last_week(competition_id, season_id)
         else:
             logger.error("No 'start' or 'end' parameter in season_week call")
         year, month, day = [int(x) for x in ref_date_string.split('-')]
         ref_date = datetime.date(year, month, day)
-        date_delta = ref_date - compseason.start_date
-        return date_delta.days / 7 + 1
+        return calendar.week(competition_id, season_id, ref_date)
 
     def parse_file(self, rows):
-        inserts = 0
-        insertion_list = []
         logger.info("Ingesting Partial Tenure records...")
-        for keys in rows:
-            competition_name = self.column_unicode("Competition", **keys)
-            season_name = self.column("Season", **keys)
-            club_symbol = self.column("Club Symbol", **keys)
-            last_name = self.column_unicode("Last Name", **keys)
-            first_name = self.column_unicode("First Name", **keys)
-            start_week = self.column_int("Start Term", **keys)
-            end_week = self.column_int("End Term", **keys)
-            start_date_iso = self.column("Start Date", **keys) if "Start Date" in keys else None
-            end_date_iso = self.column("End Date", **keys) if "End Date" in keys else None
-
-            competition_id = self.get_id(Competitions, name=competition_name)
-            if competition_id is None:
-                logger.error(u"Cannot insert Partial Tenure record for {} {}: "
-                             u"Competition {} not in database".format(first_name, last_name, competition_name))
-                continue
-            season_id = self.get_id(Seasons, name=season_name)
-            if season_id is None:
-                logger.error(u"Cannot insert Partial Tenure record for {} {}: "
-                             u"Season {} not in database".format(first_name, last_name, season_name))
-                continue
-            club_id = self.get_id(Clubs, symbol=club_symbol)
-            if club_id is None:
-                logger.error(u"Cannot insert Partial Tenure record for {} {}: "
-                             u"Club {} not in database".format(first_name, last_name, club_symbol))
-                continue
-            player_id = self.get_player_from_name(first_name, last_name)
-            if player_id is None:
-                logger.error(u"Cannot insert Partial Tenure record for {} {}: "
-                             u"Player not in database".format(first_name, last_name))
-                continue
-
-            start_week = start_week or self.season_week(competition_id, season_id, start=start_date_iso)
-            end_week = end_week or self.season_week(competition_id, season_id, end=end_date_iso)
-
-            partials_dict = dict(player_id=player_id, club_id=club_id,
-                                 competition_id=competition_id,
-                                 season_id=season_id)
-            if not self.record_exists(PartialTenures, **partials_dict):
-                insertion_list.append(PartialTenures(start_week=start_week,
-                                                     end_week=end_week,
-                                                     **partials_dict))
-                inserted, insertion_list = self.bulk_insert(insertion_list, PartialTenureIngest.BATCH_SIZE)
-                inserts += inserted
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
         logger.info("Total {} Partial Tenure records inserted and committed to database".format(inserts))
         logger.info("Partial Tenure Ingestion complete.")
+
+    def transform(self, row):
+        competition_name = row.competition
+        season_name = row.season
+        club_symbol = row.club_symbol
+        last_name = row.last_name
+        first_name = row.first_name
+        start_week = row.start_term
+        end_week = row.end_term
+        start_date_iso = row.start_date
+        end_date_iso = row.end_date
+
+        competition_id = self.get_id(Competitions, name=competition_name)
+        if competition_id is None:
+            self.reject('unknown_competition', competition_name, **row._asdict())
+            return None
+        season_id = self.get_id(Seasons, name=season_name)
+        if season_id is None:
+            self.reject('unknown_season', season_name, **row._asdict())
+            return None
+        club_id = self.get_id(Clubs, symbol=club_symbol)
+        if club_id is None:
+            self.reject('unknown_club', club_symbol, **row._asdict())
+            return None
+        player_id = self.get_player_from_name(first_name, last_name)
+        if player_id is None:
+            self.reject('unknown_player', u" ".join(filter(None, [first_name, last_name])), **row._asdict())
+            return None
+
+        start_week = start_week or self.season_week(competition_id, season_id, start=start_date_iso)
+        end_week = end_week or self.season_week(competition_id, season_id, end=end_date_iso)
+        if start_week is None or end_week is None:
+            self.reject('unknown_competition_season', u"{} {}".format(competition_name, season_name),
+                        **row._asdict())
+            return None
+
+        return dict(player_id=player_id, club_id=club_id, competition_id=competition_id, season_id=season_id,
+                    start_week=start_week, end_week=end_week)
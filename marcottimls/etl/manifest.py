@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from marcottimls.etl.sources import FeedStream
+from marcottimls.models import FeedCheckpoints, FeedManifests
+
+logger = logging.getLogger(__name__)
+
+
+class FeedManifest(object):
+    """
+    Manifest of data files that have been ingested into the database.
+
+    A data file is unchanged if its content hash is the same as at its last successful ingestion
+    by the same entity, and no rows were rejected then.  Data files with rejected rows are ingested
+    again, because the records that their rows refer to may have been loaded since.
+    """
+
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, session):
+        self.session = session
+
+    @staticmethod
+    def file_stats(handle):
+        """
+        Calculate size, modification time and SHA-256 content hash of an open data file.
+
+        The file is read to the end and rewound.  Compressed files and archive members are not read.
+
+        :param handle: File handle.
+        :return: Dictionary of size, mtime and checksum fields.
+        """
+        if isinstance(handle, FeedStream):
+            return handle.stats()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: handle.read(FeedManifest.CHUNK_SIZE), ''):
+            digest.update(chunk)
+        handle.seek(0)
+        status = os.fstat(handle.fileno())
+        return dict(size=status.st_size, mtime=datetime.fromtimestamp(status.st_mtime),
+                    checksum=digest.hexdigest())
+
+    @staticmethod
+    def path(handle):
+        """
+        Return absolute path of data file handle, or None if the handle is not a local file.
+
+        Archive members are identified by the path of the archive and the name of the member.
+        """
+        if isinstance(handle, FeedStream):
+            path = handle.path
+        else:
+            name = getattr(handle, 'name', None)
+            if not isinstance(name, basestring) or not os.path.isfile(name):
+                return None
+            path = os.path.abspath(name)
+        return path.decode('utf-8') if isinstance(path, str) else path
+
+    def entry(self, path, entity):
+        return self.session.query(FeedManifests).filter_by(path=path, entity=entity).first()
+
+    def is_unchanged(self, path, entity, stats):
+        """
+        Check if data file has been ingested by an entity with the same content.
+
+        :param path: Absolute path of data file.
+        :param entity: Name of ingestion entity.
+        :param stats: Dictionary of file statistics from file_stats.
+        :return: True if content hash is unchanged since last successful ingestion without rejected rows.
+        """
+        entry = self.entry(path, entity)
+        return entry is not None and entry.checksum == stats['checksum'] and not entry.rows_rejected
+
+    def record(self, path, entity, stats, summary):
+        """
+        Record successful ingestion of data file, remove its checkpoint, and commit it.
+
+        :param path: Absolute path of data file.
+        :param entity: Name of ingestion entity.
+        :param stats: Dictionary of file statistics from file_stats.
+        :param summary: Dictionary of ingestion counts (read, inserted, skipped, rejected).
+        """
+        entry = self.entry(path, entity)
+        if entry is None:
+            entry = FeedManifests(path=path, entity=entity)
+            self.session.add(entry)
+        for field, value in stats.items():
+            setattr(entry, field, value)
+        for key in ['read', 'inserted', 'skipped', 'rejected']:
+            setattr(entry, 'rows_{}'.format(key), summary.get(key, 0))
+        entry.loaded_at = datetime.now()
+        self.session.query(FeedCheckpoints).filter_by(path=path, entity=entity).delete()
+        self.session.commit()
+
+
+class FeedCheckpoint(object):
+    """
+    Checkpoint of the rows of a data file that are committed to the database.
+
+    The checkpoint is saved in the transaction of each committed batch, so that an interrupted
+    ingestion of the same file content resumes after the last committed batch.
+    """
+
+    def __init__(self, session, path, entity, checksum):
+        self.session = session
+        self.path = path
+        self.entity = entity
+        self.checksum = checksum
+        self.offset = 0
+        self.entry = self.session.query(FeedCheckpoints).filter_by(path=path, entity=entity).first()
+
+    @property
+    def position(self):
+        """
+        Number of rows of data file committed by an earlier ingestion of the same content.
+        """
+        if self.entry is None or self.entry.checksum != self.checksum:
+            return 0
+        return self.entry.rows_committed or 0
+
+    def save(self, rows):
+        """
+        Add checkpoint of rows processed so far to the current transaction.
+
+        :param rows: Number of rows of data file processed.
+        """
+        if self.entry is None:
+            self.entry = FeedCheckpoints(path=self.path, entity=self.entity)
+            self.session.add(self.entry)
+        self.entry.checksum = self.checksum
+        self.entry.rows_committed = rows
+        self.entry.updated_at = datetime.now()
@@ -0,0 +1,238 @@
+# coding=utf-8
+import logging
+import re
+import unicodedata
+from collections import namedtuple
+
+from marcottimls.models import Players
+from marcottimls.sessions import SessionCache
+
+logger = logging.getLogger(__name__)
+
+
+PlayerMatch = namedtuple('PlayerMatch', ['player_id', 'name', 'score'])
+
+
+TRANSLITERATIONS = {
+    u'ø': u'o',
+    u'æ': u'ae',
+    u'œ': u'oe',
+    u'ß': u'ss',
+    u'ł': u'l',
+    u'đ': u'd',
+    u'ð': u'd',
+    u'þ': u'th',
+    u'ı': u'i'
+}
+
+
+def name_tokens(name):
+    """
+    Split name into lowercase ASCII tokens, with accents removed and special letters transliterated.
+
+    :param name: Name string.
+    :return: List of tokens.
+    """
+    if isinstance(name, str):
+        name = name.decode('utf-8')
+    name = u''.join(TRANSLITERATIONS.get(char, char) for char in name.lower())
+    name = u''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+    return re.findall(r'[a-z0-9]+', name)
+
+
+def name_grams(tokens):
+    """
+    Character trigrams of name tokens, each token padded at both ends.  Trigrams do not depend on
+    the order of tokens.
+
+    :param tokens: List of name tokens.
+    :return: Set of trigrams.
+    """
+    grams = set()
+    for token in tokens:
+        padded = u'${}$'.format(token)
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+class PlayerMatchIndex(SessionCache):
+    """
+    Index of normalized name tokens and their character trigrams, for fuzzy matching of unresolved
+    player names.
+
+    Each player is indexed under several variants of its name, made from the first, known first,
+    middle, last, second last and nick names.  Each token of a query is compared with the distinct
+    tokens of all names through an inverted index of trigrams, and the variants that contain a
+    similar token are scored by the soft Dice coefficient of their tokens and the query's tokens.
+    Only variants that share a similar token with the query are scored, so queries do not scan the
+    players.
+
+    The index is built with one query per session, and players flushed by the session are added to it.
+    """
+
+    KEY = 'player_matcher'
+    VARIANTS = (
+        ('first_name', 'last_name'),
+        ('known_first_name', 'last_name'),
+        ('first_name', 'middle_name', 'last_name'),
+        ('first_name', 'last_name', 'second_last_name'),
+        ('known_first_name', 'last_name', 'second_last_name'),
+        ('nick_name',)
+    )
+    TOKEN_SCORE = 0.5
+    LIMIT = 5
+    MARGIN = 0.1
+
+    def __init__(self, session):
+        super(PlayerMatchIndex, self).__init__(session)
+        self.players = None
+        self.variants = None
+        self.tokens = None
+        self.grams = None
+        self.sizes = None
+        self.similar = None
+        self.matched = 0
+        self.suggested = 0
+
+    def build(self):
+        """
+        Load names of all players into index.
+        """
+        self.players = {}
+        self.variants = []
+        self.tokens = {}
+        self.grams = {}
+        self.sizes = {}
+        self.similar = {}
+        fields = ['first_name', 'known_first_name', 'middle_name', 'last_name', 'second_last_name', 'nick_name']
+        for row in self.session.query(Players.id, Players.full_name, Players.birth_date,
+                                      *[getattr(Players, field) for field in fields]):
+            self.add(row[0], row[1], row[2], **dict(zip(fields, row[3:])))
+        logger.debug("Loaded {} players and {} name tokens into match index".format(
+            len(self.players), len(self.tokens)))
+
+    def add(self, player_id, full_name, birth_date, **names):
+        self.players[player_id] = (full_name, birth_date)
+        seen = set()
+        for fields in PlayerMatchIndex.VARIANTS:
+            if any(names.get(field) is None for field in fields):
+                continue
+            tokens = frozenset(sum((name_tokens(names[field]) for field in fields), []))
+            if not tokens or tokens in seen:
+                continue
+            seen.add(tokens)
+            variant = len(self.variants)
+            self.variants.append((player_id, len(tokens)))
+            for token in tokens:
+                if token not in self.tokens:
+                    grams = name_grams([token])
+                    self.tokens[token] = []
+                    self.sizes[token] = len(grams)
+                    for gram in grams:
+                        self.grams.setdefault(gram, []).append(token)
+                    self.similar.clear()
+                self.tokens[token].append(variant)
+
+    def similar_tokens(self, token):
+        """
+        Retrieve indexed tokens whose trigrams are similar to a token's trigrams.
+
+        :param token: Name token.
+        :return: List of (token, Dice coefficient) tuples of tokens at or above TOKEN_SCORE.
+        """
+        if token not in self.similar:
+            grams = name_grams([token])
+            shared = {}
+            shared_count = shared.get
+            for gram in grams:
+                for other in self.grams.get(gram, ()):
+                    shared[other] = shared_count(other, 0) + 1
+            similar = []
+            for other, count in shared.iteritems():
+                score = 1.0 if other == token else 2.0 * count / (len(grams) + self.sizes[other])
+                if score >= PlayerMatchIndex.TOKEN_SCORE:
+                    similar.append((other, score))
+            self.similar[token] = similar
+        return self.similar[token]
+
+    def candidates(self, name, birth_date=None, limit=None):
+        """
+        Retrieve players whose names are most similar to a name.
+
+        :param name: Name to match.
+        :param birth_date: Date object of player's birth date, or None to match players of any birth date.
+        :param limit: Maximum number of candidates, or None for the default LIMIT.
+        :return: List of PlayerMatch tuples of (player ID, full name, score) in descending order of score.
+        """
+        if self.players is None:
+            self.build()
+        tokens = set(name_tokens(name))
+        totals = {}
+        for token in tokens:
+            best = {}
+            for other, similarity in self.similar_tokens(token):
+                for variant in self.tokens[other]:
+                    if similarity > best.get(variant, 0.0):
+                        best[variant] = similarity
+            for variant, similarity in best.iteritems():
+                totals[variant] = totals.get(variant, 0.0) + similarity
+        scores = {}
+        for variant, total in totals.iteritems():
+            player_id, size = self.variants[variant]
+            score = 2.0 * total / (len(tokens) + size)
+            if score > scores.get(player_id, 0.0):
+                scores[player_id] = score
+        if birth_date is not None:
+            scores = {player_id: score for player_id, score in scores.iteritems()
+                      if self.players[player_id][1] == birth_date}
+        ranked = sorted(scores.iteritems(), key=lambda item: (-item[1], item[0]))[:limit or PlayerMatchIndex.LIMIT]
+        return [PlayerMatch(player_id, self.players[player_id][0], score) for player_id, score in ranked]
+
+    def match(self, name, threshold, birth_date=None):
+        """
+        Match name to a player if the best candidate is above a confidence threshold and clearly
+        ahead of the next candidate.
+
+        :param name: Name to match.
+        :param threshold: Minimum score of a match, between 0 and 1.
+        :param birth_date: Date object of player's birth date, or None.
+        :return: Tuple of (matched player ID or None, list of PlayerMatch candidates).
+        """
+        candidates = self.candidates(name, birth_date)
+        if candidates and candidates[0].score >= threshold and (
+                len(candidates) == 1 or candidates[0].score - candidates[1].score >= PlayerMatchIndex.MARGIN):
+            self.matched += 1
+            logger.debug(u"Matched player name {} to {} (score {:.2f})".format(
+                name, candidates[0].name, candidates[0].score))
+            return candidates[0].player_id, candidates
+        if candidates:
+            self.suggested += 1
+        return None, candidates
+
+    def report(self):
+        """
+        Log fuzzy match counts and reset them.
+        """
+        if self.matched or self.suggested:
+            logger.info("Player name matching: {} matched, {} unmatched with suggestions".format(
+                self.matched, self.suggested))
+        self.matched, self.suggested = 0, 0
+
+    def after_flush(self, session, flush_context):
+        if self.players is None:
+            return
+        for record in session.new:
+            if isinstance(record, Players):
+                self.add(record.id, record.full_name, record.birth_date,
+                         **{field: getattr(record, field) for fields in PlayerMatchIndex.VARIANTS for field in fields})
+
+    def reset(self):
+        """
+        Discard match index, so that it is rebuilt on next query.
+        """
+        self.players = None
+        self.variants = None
+        self.tokens = None
+        self.grams = None
+        self.sizes = None
+        self.similar = None
@@ -2,7 +2,9 @@ import logging
 import re
 from datetime import date
 
-from marcottimls.etl.base import BaseCSV
+from marcottimls.calendars import SeasonCalendar
+from marcottimls.etl.base import BaseCSV, PlayerNameResolver
+from marcottimls.etl.matching import PlayerMatchIndex
 from marcottimls.models import (Countries, Clubs, Competitions, DomesticCompetitions, InternationalCompetitions,
                                 Seasons, CompetitionSeasons, Persons, Players, NameOrderType, PositionType,
                                 ConfederationType)
@@ -13,42 +15,47 @@ logger = logging.getLogger(__name__)
 class CountryIngest(BaseCSV):
 
     BATCH_SIZE = 50
+    MODEL = Countries
+
+    COLUMNS = (
+        ('name', "Name", unicode),
+        ('confederation', "Confederation", str)
+    )
 
     def parse_file(self, rows):
-        insertion_list = []
-        inserts = 0
         logger.info("Ingesting Countries...")
-        for keys in rows:
-            country_name = "{Name}".format(**keys).strip().decode('utf-8')
-            confederation = "{Confederation}".format(**keys).strip()
-            if not self.record_exists(Countries, name=country_name):
-                country_dict = dict(name=country_name, confederation=ConfederationType.from_string(confederation))
-                insertion_list.append(Countries(**country_dict))
-                inserted, insertion_list = self.bulk_insert(insertion_list, CountryIngest.BATCH_SIZE)
-                inserts += inserted
-        self.session.add_all(insertion_list)
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
+        self.dimensions.forget(Countries)
         logger.info("Total of {0} Country records inserted and committed to database".format(inserts))
         logger.info("Country Ingestion complete.")
 
+    def transform(self, row):
+        return dict(name=row.name, confederation=ConfederationType.from_string(row.confederation))
+
 
 class CompetitionIngest(BaseCSV):
 
     BATCH_SIZE = 20
 
+    COLUMNS = (
+        ('name', "Name", unicode),
+        ('level', "Level", int),
+        ('country', "Country", unicode),
+        ('confederation', "Confederation", unicode)
+    )
+
     def parse_file(self, rows):
         inserts = 0
         insertion_list = []
         logger.info("Ingesting Competitions...")
-        for keys in rows:
-            competition_name = self.column_unicode("Name", **keys)
-            level = self.column_int("Level", **keys)
-            country_name = self.column_unicode("Country", **keys)
-            confederation_name = self.column_unicode("Confederation", **keys)
+        for row in rows:
+            competition_name = row.name
+            level = row.level
+            country_name = row.country
+            confederation_name = row.confederation
 
             if all(var is not None for var in [country_name, confederation_name]):
-                logger.error(u"Cannot insert Competition record for {}: "
-                             u"Country and Confederation defined".format(competition_name))
+                self.reject('conflicting_values', competition_name, **row._asdict())
                 continue
             else:
                 comp_record = None
@@ -56,32 +63,28 @@ class CompetitionIngest(BaseCSV):
                     country_id = self.get_id(Countries, name=country_name)
                     comp_dict = dict(name=competition_name, level=level, country_id=country_id)
                     if country_id is None:
-                        logger.error(u"Cannot insert Domestic Competition record for {}: "
-                                     u"Country {} not found".format(competition_name, country_name))
+                        self.reject('unknown_country', country_name, **row._asdict())
                         continue
-                    elif not self.record_exists(DomesticCompetitions, **comp_dict):
+                    elif self.claim_key(DomesticCompetitions, **comp_dict):
                         comp_record = DomesticCompetitions(**comp_dict)
                 elif confederation_name is not None:
                     try:
                         confederation = ConfederationType.from_string(confederation_name)
                     except ValueError:
-                        logger.error(u"Cannot insert International Competition record for {}: "
-                                     u"Confederation {} not found".format(competition_name, confederation_name))
+                        self.reject('invalid_value', confederation_name, **row._asdict())
                         continue
                     comp_dict = dict(name=competition_name, level=level, confederation=confederation)
-                    if not self.record_exists(InternationalCompetitions, **comp_dict):
+                    if self.claim_key(InternationalCompetitions, **comp_dict):
                         comp_record = InternationalCompetitions(**comp_dict)
                 else:
-                    logger.error(u"Cannot insert Competition record: Neither Country nor Confederation defined")
+                    self.reject('missing_value', competition_name, **row._asdict())
                     continue
                 if comp_record is not None:
                     insertion_list.append(comp_record)
                     logger.debug(u"Adding Competition record: {}".format(comp_dict))
                     inserted, insertion_list = self.bulk_insert(insertion_list, CompetitionIngest.BATCH_SIZE)
                     inserts += inserted
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts += self.write_records(insertion_list)
         logger.info("Total {} Competition records inserted and committed to database".format(inserts))
         logger.info("Competition Ingestion complete.")
 
@@ -90,40 +93,42 @@ class CompetitionSeasonIngest(BaseCSV):
 
     BATCH_SIZE = 10
 
+    COLUMNS = (
+        ('competition', "Competition", unicode),
+        ('season', "Season", str),
+        ('start', "Start", date),
+        ('end', "End", date),
+        ('matchdays', "Matchdays", int)
+    )
+
     def parse_file(self, rows):
         inserts = 0
         insertion_list = []
-        for keys in rows:
-            competition_name = self.column_unicode("Competition", **keys)
-            season_name = self.column("Season", **keys)
-            start_date_iso = self.column("Start", **keys)
-            end_date_iso = self.column("End", **keys)
-            matchdays = self.column_int("Matchdays", **keys)
-
-            start_date = date(*tuple(int(x) for x in start_date_iso.split('-'))) if start_date_iso else None
-            end_date = date(*tuple(int(x) for x in end_date_iso.split('-'))) if end_date_iso else None
+        for row in rows:
+            competition_name = row.competition
+            season_name = row.season
+            start_date = row.start
+            end_date = row.end
+            matchdays = row.matchdays
 
             competition_id = self.get_id(Competitions, name=competition_name)
             if competition_id is None:
-                logger.error(u"Cannot insert Competition Season record: "
-                             u"Competition {} not in database".format(competition_name))
+                self.reject('unknown_competition', competition_name, **row._asdict())
                 continue
             season_id = self.get_id(Seasons, name=season_name)
             if season_id is None:
-                logger.error(u"Cannot insert Competition Season record: "
-                             u"Season {} not in database".format(season_name))
+                self.reject('unknown_season', season_name, **row._asdict())
                 continue
             compseason_dict = dict(competition_id=competition_id, season_id=season_id, start_date=start_date,
                                    end_date=end_date, matchdays=matchdays)
-            if not self.record_exists(CompetitionSeasons, **compseason_dict):
+            if self.claim_key(CompetitionSeasons, **compseason_dict):
                 insertion_list.append(CompetitionSeasons(**compseason_dict))
                 inserted, insertion_list = self.bulk_insert(insertion_list, CompetitionSeasonIngest.BATCH_SIZE)
                 inserts += inserted
                 if inserted and not inserts % CompetitionSeasonIngest.BATCH_SIZE:
                     logger.info("{} records inserted".format(inserts))
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts += self.write_records(insertion_list)
+        SeasonCalendar.for_session(self.session).reset()
         logger.info("Total {} Competition Season records inserted and committed to database".format(inserts))
         logger.info("Competition Season Ingestion complete.")
 
@@ -132,60 +137,64 @@ class ClubIngest(BaseCSV):
 
     BATCH_SIZE = 50
 
+    COLUMNS = (
+        ('name', "Name", unicode),
+        ('symbol', "Symbol", str),
+        ('country', "Country", unicode)
+    )
+
     def parse_file(self, rows):
         inserts = 0
         insertion_list = []
         logger.info("Ingesting Clubs...")
-        for keys in rows:
-            club_name = self.column_unicode("Name", **keys)
-            club_symbol = self.column("Symbol", **keys)
-            country_name = self.column_unicode("Country", **keys)
+        for row in rows:
+            club_name = row.name
+            club_symbol = row.symbol
+            country_name = row.country
 
             if country_name is None:
-                logger.error(u"Cannot insert Club record for {}: Country required".format(club_name))
+                self.reject('missing_value', club_name, **row._asdict())
                 continue
             else:
                 country_id = self.get_id(Countries, name=country_name)
                 club_dict = dict(name=club_name, symbol=club_symbol, country_id=country_id)
                 if country_id is None:
-                    logger.error(u"Cannot insert Club record {}: "
-                                 u"Country {} not in database".format(club_dict, country_name))
-                elif not self.record_exists(Clubs, **club_dict):
+                    self.reject('unknown_country', country_name, **row._asdict())
+                elif self.claim_key(Clubs, **club_dict):
                     insertion_list.append(Clubs(**club_dict))
                     inserted, insertion_list = self.bulk_insert(insertion_list, ClubIngest.BATCH_SIZE)
                     inserts += inserted
                     if inserted and not inserts % ClubIngest.BATCH_SIZE:
                         logger.info("{} records inserted".format(inserts))
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts += self.write_records(insertion_list)
         logger.info("Total {} Club records inserted and committed to database".format(inserts))
         logger.info("Club Ingestion complete.")
 
 
 class PersonIngest(BaseCSV):
 
+    COLUMNS = (
+        ('first_name', "First Name", unicode),
+        ('known_first_name', "Known First Name", unicode),
+        ('middle_name', "Middle Name", unicode),
+        ('last_name', "Last Name", unicode),
+        ('second_last_name', "Second Last Name", unicode),
+        ('nick_name', "Nickname", unicode),
+        ('birth_date', "Birthdate", date),
+        ('order', "Name Order", str)
+    )
+
     def parse_file(self, rows):
         raise NotImplementedError
 
-    def get_person_data(self, **keys):
-        first_name = self.column_unicode("First Name", **keys)
-        known_first_name = self.column_unicode("Known First Name", **keys)
-        middle_name = self.column_unicode("Middle Name", **keys)
-        last_name = self.column_unicode("Last Name", **keys)
-        second_last_name = self.column_unicode("Second Last Name", **keys)
-        nickname = self.column_unicode("Nickname", **keys)
-        date_of_birth = self.column("Birthdate", **keys)
-        order = self.column("Name Order", **keys) or "Western"
-
-        name_order = NameOrderType.from_string(order)
-        birth_date = date(*tuple(int(x) for x in date_of_birth.split('-'))) if date_of_birth else None
+    def get_person_data(self, row):
+        name_order = NameOrderType.from_string(row.order or "Western")
 
         person_dict = {field: value for (field, value) in zip(
             ['first_name', 'known_first_name', 'middle_name', 'last_name',
              'second_last_name', 'nick_name', 'birth_date', 'order'],
-            [first_name, known_first_name, middle_name, last_name,
-             second_last_name, nickname, birth_date, name_order]) if value is not None}
+            [row.first_name, row.known_first_name, row.middle_name, row.last_name,
+             row.second_last_name, row.nick_name, row.birth_date, name_order]) if value is not None}
         return person_dict
 
 
@@ -193,18 +202,57 @@ class PlayerIngest(PersonIngest):
 
     BATCH_SIZE = 200
 
+    COLUMNS = PersonIngest.COLUMNS + (
+        ('position', "Position", str),
+        ('country', "Country", unicode)
+    )
+
+    def __init__(self, session, writer=None, **options):
+        super(PlayerIngest, self).__init__(session, writer, **options)
+        self._person_ids = None
+
+    @property
+    def person_ids(self):
+        """
+        Dictionary of natural keys and IDs of Persons records that are not Players records.
+
+        Loaded from the database in one query on first access.
+        """
+        if self._person_ids is None:
+            query = self.session.query(Persons.person_id, *[getattr(Persons, field)
+                                                            for field in Persons.__natural_key__]).filter(
+                Persons.type != Players.__mapper__.polymorphic_identity)
+            self._person_ids = {tuple(row[1:]): row[0] for row in query}
+        return self._person_ids
+
+    def insert_players(self, new_players, existing_persons):
+        """
+        Write batch of Players records to database and commit transaction.
+
+        :param new_players: List of field dictionaries of Players records without a Persons record.
+        :param existing_persons: List of field dictionaries of Players records of existing Persons records.
+        :return: Number of Players records inserted.
+        """
+        self.writer.write(Players, new_players)
+        self.writer.promote(Players, existing_persons)
+        self.commit()
+        inserted = len(new_players) + len(existing_persons)
+        self.counts['inserted'] += inserted
+        return inserted
+
     def parse_file(self, rows):
         inserts = 0
+        new_players = []
+        existing_persons = []
         logger.info("Ingesting Players...")
-        for keys in rows:
-            person_dict = self.get_person_data(**keys)
-            position_chars = self.column("Position", **keys)
-            country_name = self.column_unicode("Country", **keys)
+        for row in rows:
+            person_dict = self.get_person_data(row)
+            position_chars = row.position
+            country_name = row.country
 
             country_id = self.get_id(Countries, name=country_name)
             if country_id is None:
-                logger.error(u"Cannot insert Player record {}: "
-                             u"Country {} not in database".format(person_dict, country_name))
+                self.reject('unknown_country', country_name, **row._asdict())
                 continue
 
             position = [PositionType.unknown, None]
@@ -214,18 +262,20 @@ class PlayerIngest(PersonIngest):
                     position[i] = PositionType.from_string(code)
 
             person_dict = dict(country_id=country_id, **person_dict)
-            if not self.record_exists(Players, **person_dict):
-                if not self.record_exists(Persons, **person_dict):
-                    player_record = Players(primary_position=position[0], secondary_position=position[1],
-                                            **person_dict)
+            if self.claim_key(Players, **person_dict):
+                position_dict = dict(primary_position=position[0], secondary_position=position[1])
+                person_id = self.person_ids.pop(tuple(person_dict.get(field) for field in Persons.__natural_key__),
+                                                None)
+                if person_id is None:
+                    new_players.append(dict(position_dict, **person_dict))
                 else:
-                    person_id = self.get_id(Persons, **person_dict)
-                    player_record = Players(person_id=person_id, primary_position=position[0],
-                                            secondary_position=position[1])
-                self.session.add(player_record)
-                self.session.commit()
-                inserts += 1
-                if inserts % PlayerIngest.BATCH_SIZE == 0:
+                    existing_persons.append(dict(position_dict, person_id=person_id))
+                if len(new_players) + len(existing_persons) == PlayerIngest.BATCH_SIZE:
+                    inserts += self.insert_players(new_players, existing_persons)
+                    new_players, existing_persons = [], []
                     logger.info("{} records inserted".format(inserts))
+        inserts += self.insert_players(new_players, existing_persons)
+        PlayerNameResolver.for_session(self.session).reset()
+        PlayerMatchIndex.for_session(self.session).reset()
         logger.info("Total {} Player records inserted and committed to database".format(inserts))
         logger.info("Player Ingestion complete.")
@@ -0,0 +1,132 @@
+import glob
+import logging
+import multiprocessing
+import os
+from collections import Counter
+
+from sqlalchemy.engine import create_engine
+from sqlalchemy.orm.session import Session
+
+from marcottimls.etl.base import DimensionCache, feed_format, ingest_feed
+from marcottimls.etl.sources import is_mappable, open_feeds, open_ranges
+from marcottimls.etl.writers import create_writer
+
+logger = logging.getLogger(__name__)
+
+
+_worker_state = {}
+
+
+def _init_worker(database_uri, dimensions):
+    """
+    Create database engine of worker process and store snapshot of dimension lookups.
+    """
+    _worker_state['engine'] = create_engine(database_uri)
+    _worker_state['dimensions'] = dimensions
+
+
+def _ingest_file(task):
+    """
+    Ingest one data file, or one byte range of a data file, in a worker process, in a session of its own.
+
+    :param task: Tuple of (ingestion class, filename, writer backend, force flag, ingestion options,
+                 (range index, range count) or None).
+    :return: Tuple of (filename, dictionary of ingestion counts or None if file is unchanged,
+             error message or None).
+    """
+    ingest_class, filename, backend, force, options, part = task
+    handles = open_feeds(filename) if part is None else open_ranges(filename, *part,
+                                                                     header=feed_format(filename).HEADER)
+    if part is not None:
+        filename = "{} (range {} of {})".format(filename, part[0] + 1, part[1])
+    connection = _worker_state['engine'].connect()
+    session = Session(connection)
+    error = None
+    try:
+        if _worker_state['dimensions'] is not None:
+            DimensionCache.for_session(session).warm(_worker_state['dimensions'])
+        feed = ingest_class(session, create_writer(session, backend), **options)
+        logger.info("Loading data file {} in process {}".format(filename, os.getpid()))
+        start = feed.summary
+        summaries = [ingest_feed(feed, fh, force) for fh in handles]
+        session.commit()
+        summary = None if all(summary is None for summary in summaries) else \
+            {key: value - start[key] for key, value in feed.summary.items()}
+    except Exception as ex:
+        session.rollback()
+        logger.exception("Ingestion of data file {} failed".format(filename))
+        summary, error = {}, str(ex)
+    finally:
+        session.close()
+        connection.close()
+    return filename, summary, error
+
+
+def ingest_feeds_parallel(database_uri, prefix, pattern, ingest_class, workers, dimensions=None, backend='core',
+                          force=False, options=None, ranges=1):
+    """Ingest contents of data files of a common type in a pool of worker processes,
+    one file per task.
+
+    Each worker process opens its own database engine, and each file is ingested in its own session.
+    Dimension lookups are warmed from a snapshot taken in the parent process.
+
+    Plain local data files can be split into byte ranges on line boundaries, one range per task,
+    so that a large file is ingested by several workers.  Each range is memory-mapped by its worker
+    and recorded in the feed manifest on its own.  Ranges are ingested in separate sessions and
+    transactions, so a natural key that is repeated in several ranges of a file may reach the
+    unique constraint of its table instead of being skipped.  Row-by-row ingestions then reject the
+    records of the later range with reason 'constraint_violation'; staging table ingestions fail the range.
+
+    :param database_uri: Database URI of Marcotti database.
+    :type database_uri: string
+    :param prefix: File path, which is also defined as the prefix of the filename.
+    :type prefix: string
+    :param pattern: Local path and text pattern common to group of files.
+    :type pattern: tuple
+    :param ingest_class: Data feed interface class.
+    :type ingest_class: class
+    :param workers: Number of worker processes.
+    :type workers: int
+    :param dimensions: Snapshot of dimension lookups from DimensionCache.snapshot, or None.
+    :type dimensions: dict
+    :param backend: Record writer backend of workers.
+    :type backend: string
+    :param force: If True, ingest data files that are unchanged since their last ingestion.
+    :type force: bool
+    :param options: Keyword arguments of ingestion class, such as upsert mode.
+    :type options: dict
+    :param ranges: Number of byte ranges that each plain local data file is split into.
+    :type ranges: int
+    :return: Dictionary of total ingestion counts and numbers of failed and unchanged files.
+    """
+    filenames = sorted(glob.glob(os.path.join(prefix, *pattern)))
+    totals = Counter(files=len(filenames), failed=0, unchanged=0)
+    if not filenames:
+        return dict(totals)
+    tasks = []
+    for filename in filenames:
+        if ranges > 1 and is_mappable(filename):
+            tasks.extend((ingest_class, filename, backend, force, options or {}, (index, ranges))
+                         for index in range(ranges))
+        else:
+            tasks.append((ingest_class, filename, backend, force, options or {}, None))
+    pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_worker,
+                                initargs=(database_uri, dimensions))
+    try:
+        for filename, summary, error in pool.imap_unordered(_ingest_file, tasks):
+            if error is not None:
+                totals['failed'] += 1
+                logger.error("Data file {} not ingested: {}".format(filename, error))
+            elif summary is None:
+                totals['unchanged'] += 1
+            else:
+                totals.update(summary)
+                logger.info("Data file {} ingested: {}".format(filename, summary))
+        pool.close()
+    except Exception:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    logger.info("{} ingestion of {} files: {}".format(ingest_class.__name__, len(filenames), dict(totals)))
+    return dict(totals)
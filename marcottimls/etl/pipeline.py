@@ -0,0 +1,234 @@
+import copy
+import logging
+import sys
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+_END = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class PipelineStage(object):
+    """
+    Thread that draws items from an iterator and puts them on a bounded queue.
+
+    The stage is iterated by the next stage of the pipeline, which blocks while the queue is empty.
+    The stage blocks while the queue is full, so that a slow consumer holds back its producers.
+    Errors raised by the iterator are raised again by the consumer.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name, items, queue_size, stopped):
+        self.name = name
+        self.items = items
+        self.queue = Queue(queue_size)
+        self.stopped = stopped
+        self.error = None
+        self.count = 0
+        self.busy = 0.0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.thread = threading.Thread(target=self.run, name='pipeline-{}'.format(name))
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def put(self, item):
+        depth = self.queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        start = time.time()
+        self.offer(item)
+        self.put_wait += time.time() - start
+
+    def offer(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=PipelineStage.POLL_INTERVAL)
+                return
+            except Full:
+                if self.stopped.is_set():
+                    raise PipelineAborted()
+
+    def run(self):
+        try:
+            iterator = iter(self.items)
+            while True:
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    self.busy += time.time() - start
+                self.count += 1
+                self.put(item)
+        except PipelineAborted:
+            return
+        except Exception:
+            self.error = sys.exc_info()
+        try:
+            self.offer(_END)
+        except PipelineAborted:
+            pass
+
+    def get(self):
+        start = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=PipelineStage.POLL_INTERVAL)
+                break
+            except Empty:
+                if self.stopped.is_set():
+                    raise PipelineAborted()
+        self.get_wait += time.time() - start
+        return item
+
+    def __iter__(self):
+        while True:
+            item = self.get()
+            if item is _END:
+                if self.error is not None:
+                    raise self.error[0], self.error[1], self.error[2]
+                return
+            yield item
+
+
+class ETLPipeline(object):
+    """
+    Ingest a data file in a pipeline of stages connected by bounded queues.
+
+    The read stage reads lines of the data file, the parse stage converts them to typed records,
+    and the resolve stage converts records to data model fields with the ingestion's transform.
+    Each stage runs in a thread of its own.  The write stage runs in the calling thread, which owns
+    the session, and writes batches of records with the ingestion's insert_records.  The resolve
+    thread transforms records with a copy of the ingestion that has a session, and session caches,
+    of its own, so that records are resolved while others are written.  The read stage is started
+    when the parse stage first asks for lines, so that data files whose records are read from a
+    parsed-feed cache are not read.
+
+    SQLite connections cannot be used outside the thread that created them, so on SQLite the resolve
+    stage runs in the calling thread, interleaved with the write stage, unless resolve_thread is True.
+
+    Stage statistics are available in stats after the data file is loaded.
+    """
+
+    QUEUE_SIZE = 1000
+
+    def __init__(self, ingest, queue_size=None, resolve_thread=None):
+        self.ingest = ingest
+        self.queue_size = queue_size or ETLPipeline.QUEUE_SIZE
+        self.resolve_thread = resolve_thread if resolve_thread is not None else \
+            ingest.session.get_bind().dialect.name != 'sqlite'
+        self.stopped = threading.Event()
+        self.stages = []
+        self.write_time = 0.0
+        self.write_count = 0
+
+    def stage(self, name, items):
+        stage = PipelineStage(name, items, self.queue_size, self.stopped).start()
+        self.stages.append(stage)
+        return stage
+
+    def resolver(self):
+        """
+        Create copy of the ingestion that transforms records in the resolve thread, in a session of its own.
+
+        The copy shares the row counts and rejected rows of the ingestion.
+        """
+        resolver = copy.copy(self.ingest)
+        resolver.session = Session(bind=self.ingest.session.get_bind())
+        return resolver
+
+    def resolve(self, rows, resolver):
+        ingest = self.ingest
+        for row in ingest.count_rows(rows):
+            record = resolver.transform(row)
+            yield ingest.counts['read'], record
+
+    def records(self, items):
+        ingest = self.ingest
+        for position, record in items:
+            ingest.position = position
+            self.write_count += 1
+            yield record
+
+    def lines(self, source):
+        stage = PipelineStage('read', source, self.queue_size, self.stopped).start()
+        self.stages.insert(0, stage)
+        for line in stage:
+            yield line
+
+    def load_feed(self, handle, lines=None):
+        """
+        Ingest data file through the pipeline.
+
+        :param handle: File handle of data file.
+        :param lines: Iterable of lines of data file, if they are not read from handle.
+        :return: Number of records inserted.
+        """
+        start = time.time()
+        records = None
+        resolve_stage = None
+        resolver = self.resolver() if self.resolve_thread else self.ingest
+        try:
+            rows = self.stage('parse', self.ingest.start_feed(handle, self.lines(handle if lines is None else lines)))
+            resolved = self.resolve(rows, resolver)
+            if self.resolve_thread:
+                resolved = resolve_stage = self.stage('resolve', resolved)
+            records = self.records(resolved)
+            inserts = self.ingest.insert_records(records)
+        finally:
+            self.stopped.set()
+            if records is not None:
+                records.close()
+            if resolver is not self.ingest:
+                if resolve_stage is not None:
+                    resolve_stage.thread.join()
+                self.ingest.collect_resolution(resolver)
+                resolver.session.close()
+            self.ingest.position = None
+            self.write_time = time.time() - start
+        self.ingest.finish_feed()
+        for stats in self.stats:
+            logger.info("Pipeline stage {name}: {items} items in {busy:.2f}s, waited {wait:.2f}s on full queue, "
+                        "queue depth max {max_depth} mean {mean_depth:.1f}".format(**stats))
+        return inserts
+
+    @property
+    def stats(self):
+        """
+        Throughput and queue statistics of pipeline stages.
+
+        Busy time of a stage excludes time spent waiting for items from the stage before it.  Wait
+        time is time spent blocked on the stage's full queue.
+
+        :return: List of dictionaries of stage name, items, busy and wait seconds, items per second,
+                 and maximum and mean queue depths.
+        """
+        stats = []
+        for index, stage in enumerate(self.stages):
+            busy = stage.busy - (self.stages[index - 1].get_wait if index else 0.0)
+            stats.append(dict(name=stage.name, items=stage.count, busy=busy, wait=stage.put_wait,
+                              rate=stage.count / busy if busy > 0 else None, max_depth=stage.max_depth,
+                              mean_depth=float(stage.total_depth) / stage.count if stage.count else 0.0))
+        if self.stages:
+            busy = self.write_time - self.stages[-1].get_wait
+            stats.append(dict(name='write', items=self.write_count, busy=busy, wait=0.0,
+                              rate=self.write_count / busy if busy > 0 else None, max_depth=0,
+                              mean_depth=0.0))
+        return stats
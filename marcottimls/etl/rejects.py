@@ -0,0 +1,175 @@
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class RejectSink(object):
+    """
+    Side file of rows rejected by ingestions.
+
+    Rejected rows are tuples of (entity, source, row, reason, name, values), where values is a JSON
+    object of the row's fields.  Sinks can be shared by ingestions running in several threads.
+    """
+
+    FIELDS = ('entity', 'source', 'row', 'reason', 'name', 'data')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, rows):
+        """
+        Write batch of rejected rows to side file.
+
+        :param rows: List of rejected row tuples.
+        """
+        with self.lock:
+            self.write_rows(rows)
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CSVRejectSink(RejectSink):
+    """
+    Append rejected rows to a CSV file.
+    """
+
+    def __init__(self, path):
+        super(CSVRejectSink, self).__init__(path)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.handle = open(path, 'ab')
+        self.writer = csv.writer(self.handle)
+        if is_new:
+            self.writer.writerow(RejectSink.FIELDS)
+
+    def write_rows(self, rows):
+        self.writer.writerows([[value.encode('utf-8') if isinstance(value, unicode) else value for value in row]
+                               for row in rows])
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+class SQLiteRejectSink(RejectSink):
+    """
+    Insert rejected rows into the rejects table of a SQLite database file.
+    """
+
+    def __init__(self, path):
+        super(SQLiteRejectSink, self).__init__(path)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS rejects "
+                                "(entity TEXT, source TEXT, row INTEGER, reason TEXT, name TEXT, data TEXT)")
+        self.connection.commit()
+
+    def write_rows(self, rows):
+        self.connection.executemany("INSERT INTO rejects VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def create_reject_sink(path):
+    """
+    Create reject sink for a side file, selected by file extension.
+
+    Files with extension .db, .sqlite or .sqlite3 are SQLite databases, all other files are CSV files.
+
+    :param path: Path of side file, or None.
+    :return: RejectSink object, or None if path is None.
+    """
+    if path is None:
+        return None
+    if os.path.splitext(path)[1].lower() in ('.db', '.sqlite', '.sqlite3'):
+        return SQLiteRejectSink(path)
+    return CSVRejectSink(path)
+
+
+class RejectLog(object):
+    """
+    Counts of rows rejected by an ingestion, by reason and unresolved name.
+
+    Rejected rows are written to the reject sink in batches, and the counts are logged as one summary
+    per data file.
+    """
+
+    BATCH_SIZE = 500
+    TOP_NAMES = 5
+
+    def __init__(self, entity, sink=None):
+        self.entity = entity
+        self.sink = sink
+        self.source = None
+        self.offset = 0
+        self.reasons = Counter()
+        self.names = Counter()
+        self.rows = []
+
+    def start(self, source, offset):
+        """
+        Start counting rejected rows of a data file.
+
+        :param source: Name of data file, or None.
+        :param offset: Number of rows read by ingestion before the data file.
+        """
+        self.source = source
+        self.offset = offset
+
+    def add(self, reason, name=None, row=None, **values):
+        """
+        Record rejected row.
+
+        :param reason: Reason code of rejection, such as 'unknown_club'.
+        :param name: Value that could not be resolved, or None.
+        :param row: Row number of rejected row in data file.
+        :param values: Dictionary of fields/values of rejected row.
+        """
+        self.reasons[reason] += 1
+        if name is not None:
+            self.names[(reason, name)] += 1
+        if self.sink is not None:
+            self.rows.append((self.entity, self.source, row, reason, name,
+                              json.dumps(values, default=unicode, sort_keys=True)))
+            if len(self.rows) == RejectLog.BATCH_SIZE:
+                self.flush()
+
+    def flush(self):
+        """
+        Write buffered rejected rows to reject sink.
+        """
+        if self.rows:
+            self.sink.write(self.rows)
+            self.rows = []
+
+    def report(self):
+        """
+        Log summary of rejected rows, flush them to the reject sink, and reset counts.
+
+        :return: Dictionary of rejection counts by reason.
+        """
+        reasons = dict(self.reasons)
+        if reasons:
+            logger.warning(u"{} rejected {} rows of {}: {}".format(
+                self.entity, sum(reasons.values()), self.source or "data feed",
+                u", ".join(u"{}={}".format(reason, count) for reason, count in sorted(reasons.items()))))
+            top_names = self.names.most_common(RejectLog.TOP_NAMES)
+            if top_names:
+                logger.warning(u"Top unresolved names: {}".format(u", ".join(
+                    u"{} ({}, {})".format(name, reason, count) for (reason, name), count in top_names)))
+        if self.sink is not None:
+            self.flush()
+        self.reasons.clear()
+        self.names.clear()
+        return reasons
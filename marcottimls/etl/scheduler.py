@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from Queue import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class ETLScheduler(object):
+    """
+    Run ETL stages in worker threads as soon as the stages they depend on are complete.
+
+    Stages are (entity, callable) pairs, and dependencies map an entity to the entities that must be
+    ingested before it.  Each stage callable is responsible for opening its own session.  A stage whose
+    dependency fails is skipped.
+    """
+
+    def __init__(self, stages, dependencies, workers=4):
+        self.stages = list(stages)
+        self.dependencies = {entity: tuple(dependencies.get(entity, ())) for entity, _ in self.stages}
+        self.workers = max(1, workers)
+        self.timings = {}
+        self.failed = set()
+        self.skipped = set()
+        self.validate()
+
+    def validate(self):
+        """
+        Check that dependencies refer to scheduled stages and contain no cycles.
+
+        :raises ValueError: if dependency graph is invalid.
+        """
+        entities = set(self.dependencies)
+        for entity, depends in self.dependencies.items():
+            unknown = set(depends) - entities
+            if unknown:
+                raise ValueError("Stage {} depends on unscheduled stages: {}".format(entity, sorted(unknown)))
+        visited, remaining = set(), dict(self.dependencies)
+        while remaining:
+            ready = [entity for entity, depends in remaining.items() if set(depends) <= visited]
+            if not ready:
+                raise ValueError("Cyclic dependencies between stages: {}".format(sorted(remaining)))
+            for entity in ready:
+                visited.add(entity)
+                del remaining[entity]
+
+    def worker(self, tasks, results):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            entity, stage = task
+            logger.info("Stage {} started".format(entity))
+            start = time.time()
+            try:
+                stage()
+                error = None
+            except Exception as ex:
+                logger.exception("Stage {} failed".format(entity))
+                error = ex
+            results.put((entity, time.time() - start, error))
+
+    def run(self):
+        """
+        Run all stages and wait for them to finish.
+
+        :return: Dictionary of entities and elapsed times in seconds of completed stages.
+        """
+        stage_functions = dict(self.stages)
+        waiting = {entity: set(depends) for entity, depends in self.dependencies.items()}
+        dependents = {entity: [] for entity in waiting}
+        for entity, depends in self.dependencies.items():
+            for dependency in depends:
+                dependents[dependency].append(entity)
+
+        tasks, results = Queue(), Queue()
+        threads = [threading.Thread(target=self.worker, args=(tasks, results), name="etl-worker-{}".format(n))
+                   for n in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        pending = 0
+        for entity, _ in self.stages:
+            if not waiting[entity]:
+                tasks.put((entity, stage_functions[entity]))
+                pending += 1
+        while pending:
+            entity, elapsed, error = results.get()
+            pending -= 1
+            if error is None:
+                self.timings[entity] = elapsed
+                logger.info("Stage {} complete in {:.2f} s".format(entity, elapsed))
+                for dependent in dependents[entity]:
+                    waiting[dependent].discard(entity)
+                    if not waiting[dependent] and dependent not in self.skipped:
+                        tasks.put((dependent, stage_functions[dependent]))
+                        pending += 1
+            else:
+                self.failed.add(entity)
+                for dependent in self.downstream(entity, dependents):
+                    if dependent not in self.skipped:
+                        logger.error("Stage {} skipped: stage {} failed".format(dependent, entity))
+                        self.skipped.add(dependent)
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+        return self.timings
+
+    @staticmethod
+    def downstream(entity, dependents):
+        """
+        Return all stages that depend directly or indirectly on a stage.
+        """
+        found, frontier = set(), list(dependents[entity])
+        while frontier:
+            dependent = frontier.pop()
+            if dependent not in found:
+                found.add(dependent)
+                frontier.extend(dependents[dependent])
+        return found
@@ -0,0 +1,283 @@
+import bz2
+import gzip
+import hashlib
+import logging
+import mmap
+import os
+import sys
+import zipfile
+from datetime import datetime
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+logger = logging.getLogger(__name__)
+
+
+class FeedStream(object):
+    """
+    Data file read as a stream of lines, from a compressed file, an archive member or a pipe.
+
+    Streams are decompressed incrementally as they are iterated.  The manifest path of a stream
+    identifies its data file on disk (with the member name for archive members), and is None for
+    pipes.
+    """
+
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, stream, name, path=None, info=None):
+        """
+        :param stream: File-like object or iterator of lines.
+        :param name: Name of data file.
+        :param path: Absolute path of local file that holds data file, or None.
+        :param info: ZipInfo object of archive member, or None.
+        """
+        self.stream = stream
+        self.name = name
+        self.path = path
+        self.info = info
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readline(self):
+        return self.stream.readline()
+
+    def close(self):
+        if hasattr(self.stream, 'close'):
+            self.stream.close()
+
+    def stats(self):
+        """
+        Calculate size, modification time and content hash of the stream's data file.
+
+        Compressed files are hashed as stored on disk, and archive members are identified by their
+        CRC-32 in the archive, so the stream itself is not read.
+
+        :return: Dictionary of size, mtime and checksum fields.
+        """
+        if self.info is not None:
+            return dict(size=self.info.file_size, mtime=datetime(*self.info.date_time),
+                        checksum='crc32:{:08x}:{}'.format(self.info.CRC & 0xffffffff, self.info.file_size))
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as raw:
+            for chunk in iter(lambda: raw.read(FeedStream.CHUNK_SIZE), ''):
+                digest.update(chunk)
+        status = os.stat(self.path)
+        return dict(size=status.st_size, mtime=datetime.fromtimestamp(status.st_mtime),
+                    checksum=digest.hexdigest())
+
+
+class MappedFeed(object):
+    """
+    Local data file read through memory-mapped windows, in byte ranges that end on line boundaries.
+
+    Lines are sliced from a window of the file as they are read, and each window is unmapped before
+    the next one is mapped, so the file is not copied into Python strings up front and memory use
+    does not grow with the size of the file.  Each byte range can be parsed on its own with the
+    header line of the file, including in separate worker processes.  Files without a header line,
+    such as JSON Lines files, are split from their first line.  Ranges are split on line breaks, so
+    data files with line breaks inside quoted CSV fields must not be split into ranges.
+    """
+
+    WINDOW_SIZE = 1 << 26
+
+    def __init__(self, filename, header=True):
+        """
+        :param filename: Name of local file.
+        :param header: If True, the first line of the file is a header line.
+        """
+        self.filename = filename
+        self.path = os.path.abspath(filename)
+        self.handle = open(filename, 'rb')
+        self.size = os.fstat(self.handle.fileno()).st_size
+        self.header = self.handle.readline() if header else ''
+
+    def close(self):
+        self.handle.close()
+
+    def line_end(self, offset):
+        """
+        Return offset of the start of the first line that begins at or after an offset.
+        """
+        if offset <= len(self.header):
+            return len(self.header)
+        self.handle.seek(offset - 1)
+        return min(offset - 1 + len(self.handle.readline()), self.size)
+
+    def ranges(self, count):
+        """
+        Split the lines after the header line, if any, into byte ranges of similar size.
+
+        Ranges are the same for the same file content and count, so that worker processes can split
+        a file independently.  Ranges of a short file may be empty.
+
+        :param count: Number of ranges.
+        :return: List of (start, end) byte offsets.
+        """
+        body = len(self.header)
+        bounds = [self.line_end(body + (self.size - body) * index / count) for index in range(count)]
+        return zip(bounds, bounds[1:] + [self.size])
+
+    def lines(self, start=None, end=None):
+        """
+        Generate the header line, if any, and the lines of a byte range of the data file.
+
+        :param start: Start offset of range, or None for the start of the first line after the header.
+        :param end: End offset of range, or None for the end of the file.
+        :return: Generator of lines.
+        """
+        position = len(self.header) if start is None else start
+        end = self.size if end is None else end
+        if self.header:
+            yield self.header
+        tail = ''
+        while position < end:
+            offset = position - position % mmap.ALLOCATIONGRANULARITY
+            length = min(offset + MappedFeed.WINDOW_SIZE, end) - offset
+            window = mmap.mmap(self.handle.fileno(), length, access=mmap.ACCESS_READ, offset=offset)
+            try:
+                index = position - offset
+                while True:
+                    newline = window.find('\n', index)
+                    if newline < 0:
+                        tail += window[index:]
+                        break
+                    yield tail + window[index:newline + 1]
+                    tail = ''
+                    index = newline + 1
+            finally:
+                window.close()
+            position = offset + length
+        if tail:
+            yield tail
+
+
+class MappedRange(FeedStream):
+    """
+    Byte range of a memory-mapped data file, read as a data file of its own.
+
+    The manifest path of a range is the path of its data file with the offsets of the range, and
+    its content hash covers the header line and the lines of the range.
+    """
+
+    def __init__(self, feed, start, end):
+        """
+        :param feed: MappedFeed object.
+        :param start: Start offset of range.
+        :param end: End offset of range.
+        """
+        super(MappedRange, self).__init__(feed.lines(start, end), "{}#{}-{}".format(feed.filename, start, end),
+                                          "{}#{}-{}".format(feed.path, start, end))
+        self.feed = feed
+        self.start = start
+        self.end = end
+
+    def close(self):
+        self.stream.close()
+
+    def stats(self):
+        digest = hashlib.sha256(self.feed.header)
+        with open(self.feed.path, 'rb') as raw:
+            raw.seek(self.start)
+            remaining = self.end - self.start
+            while remaining > 0:
+                chunk = raw.read(min(FeedStream.CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+        status = os.stat(self.feed.path)
+        return dict(size=self.end - self.start, mtime=datetime.fromtimestamp(status.st_mtime),
+                    checksum=digest.hexdigest())
+
+
+def is_mappable(handle):
+    """
+    Check if a data file handle or filename is a plain local file that can be memory-mapped.
+    """
+    name = handle if isinstance(handle, basestring) else getattr(handle, 'name', None)
+    return not isinstance(handle, FeedStream) and isinstance(name, basestring) and os.path.isfile(name) \
+        and os.path.splitext(name)[1].lower() not in DECOMPRESSORS.keys() + ['.zip']
+
+
+def open_ranges(filename, index, count, header=True):
+    """
+    Open one of the byte ranges of a local data file.
+
+    :param filename: Name of local file.
+    :param index: Index of range.
+    :param count: Number of ranges the file is split into.
+    :param header: If True, the first line of the file is a header line.
+    :return: Generator of the MappedRange handle, which is closed after it is used.
+    """
+    feed = MappedFeed(filename, header)
+    try:
+        start, end = feed.ranges(count)[index]
+        handle = MappedRange(feed, start, end)
+        try:
+            yield handle
+        finally:
+            handle.close()
+    finally:
+        feed.close()
+
+
+def open_xz(filename):
+    if lzma is None:
+        raise ValueError("Reading .xz data files requires the lzma module (backports.lzma on Python 2)")
+    return lzma.LZMAFile(filename)
+
+
+DECOMPRESSORS = {
+    '.gz': lambda filename: gzip.open(filename, 'rb'),
+    '.bz2': lambda filename: bz2.BZ2File(filename, 'rb'),
+    '.xz': open_xz
+}
+
+
+def open_feeds(filename):
+    """
+    Open data files stored in a local file.
+
+    Plain files are opened as they are.  Files with extension .gz, .bz2 or .xz are decompressed as
+    they are read, and each file member of a .zip archive is a data file.  The name '-' is the
+    standard input.
+
+    :param filename: Name of local file, or '-'.
+    :return: Generator of file handles, which are closed when the next handle is generated.
+    """
+    if filename == '-':
+        yield FeedStream(sys.stdin, '<stdin>')
+        return
+    path = os.path.abspath(filename)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.zip':
+        with zipfile.ZipFile(filename) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                logger.info("Loading archive member {} of {}".format(info.filename, filename))
+                handle = FeedStream(archive.open(info), "{}!{}".format(filename, info.filename),
+                                    "{}!{}".format(path, info.filename), info)
+                try:
+                    yield handle
+                finally:
+                    handle.close()
+    elif extension in DECOMPRESSORS:
+        handle = FeedStream(DECOMPRESSORS[extension](filename), filename, path)
+        try:
+            yield handle
+        finally:
+            handle.close()
+    else:
+        with open(filename) as fh:
+            yield fh
@@ -0,0 +1,487 @@
+import logging
+import uuid
+from datetime import date
+
+from sqlalchemy import (and_, case, cast, exists, func, literal, or_, select, Boolean, Column, Date, Float, Index,
+                        Integer, MetaData, Numeric, String, Table, Unicode)
+from sqlalchemy.orm import class_mapper
+
+from marcottimls.etl.base import BaseIngest, feed_format
+from marcottimls.etl.writers import RecordWriter
+from marcottimls.etl.financial import PlayerSalaryIngest
+from marcottimls.etl.statistics import PlayerMinuteIngest, FieldStatIngest, GoalkeeperStatIngest, LeaguePointIngest
+from marcottimls.models import (Clubs, Competitions, Seasons, Years, Persons, Players, PlayerSalaries,
+                                FieldPlayerStats, GoalkeeperStats, LeaguePoints)
+
+logger = logging.getLogger(__name__)
+
+
+STAGING_TYPES = {
+    str: String,
+    unicode: Unicode,
+    int: Integer,
+    float: Float,
+    bool: Boolean,
+    date: Date
+}
+
+
+def cents_expression(amount):
+    """
+    Create SQL expression of a currency amount in whole cents.
+
+    The rounding rule is the same as to_cents, on every backend: the amount in cents is converted
+    to a six-decimal NUMERIC, whose rounding is half away from zero unlike that of floats.
+
+    :param amount: SQL expression of currency amount.
+    :return: SQL expression.
+    """
+    return cast(func.round(cast(amount * 100, Numeric(18, 6))), Integer)
+
+
+class StagingIngest(BaseIngest):
+    """
+    Ingestion of seasonal data files through a staging table.
+
+    Rows of a data file are bulk-loaded into a staging table with the columns of the row-by-row
+    ingestion class.  Names are then resolved to database IDs, and new records are merged into the
+    data model, with a few set-based statements inside the database.  Rows with unresolved IDs are
+    reported from the staging table.
+
+    Dry runs count the records that would be merged without merging them.  They are not supported on
+    MySQL, where creating the staging table commits the session's transaction.
+
+    Subclasses define the data model (MODEL), the columns of the data file (COLUMNS), the ID fields
+    that are resolved (RESOLVED), and the expressions of the resolved IDs and of the model fields.
+    """
+
+    MODEL = None
+    COLUMNS = ()
+    RESOLVED = ()
+    BATCH_SIZE = 1000
+
+    def staging_table(self):
+        """
+        Create Table object of staging table of the ingestion.
+
+        The table is temporary, except on MySQL which cannot refer to a temporary table twice in a query.
+        Its name is unique to each data file ingestion, so that parallel workers on MySQL do not write
+        to the same staging table.
+        """
+        fields = [field for field, _, _ in self.COLUMNS]
+        columns = [Column('row_id', Integer, primary_key=True, autoincrement=False)]
+        columns.extend(Column(field, STAGING_TYPES[kind]) for field, _, kind in self.COLUMNS)
+        if 'last_name' in fields:
+            columns.append(Column('birth_date', Date))
+        columns.extend(Column(field, Integer) for field in self.RESOLVED)
+        return self.work_table('staging_{}'.format(self.MODEL.__tablename__), MetaData(), *columns)
+
+    def work_table(self, name, metadata, *columns):
+        """
+        Create Table object of a work table of the ingestion, with a name unique to the ingestion.
+
+        :param name: Prefix of table name.
+        :param metadata: MetaData object of the work tables of the ingestion.
+        :param columns: Column and Index objects of table.
+        :return: Table object.
+        """
+        prefixes = [] if self.session.get_bind().dialect.name == 'mysql' else ['TEMPORARY']
+        return Table('{}_{}'.format(name, uuid.uuid4().hex[:12]), metadata, *columns, prefixes=prefixes)
+
+    def load_feed(self, handle):
+        if self.dry_run and self.session.get_bind().dialect.name == 'mysql':
+            raise ValueError("Dry runs through staging tables are not supported on MySQL")
+        staging = self.staging_table()
+        connection = self.session.connection()
+        staging.create(connection)
+        self.rejects.start(getattr(handle, 'name', None), self.counts['read'])
+        try:
+            self.stage(handle, staging)
+            for field in self.RESOLVED:
+                connection.execute(staging.update().values({field: self.resolution(field, staging)}))
+            unresolved = self.report_unresolved(staging)
+            filled = self.fill(staging)
+            inserted = self.merge(staging)
+        except Exception:
+            self.session.rollback()
+            staging.metadata.drop_all(self.session.connection())
+            raise
+        staging.metadata.drop_all(connection)
+        if self.dry_run:
+            self.session.rollback()
+        else:
+            self.session.commit()
+        self.natural_keys.forget(self.MODEL)
+        self.rejects.report()
+        self.counts['inserted'] += inserted + filled
+        self.counts['updated'] += filled
+        self.counts['skipped'] += self.counts['read'] - inserted - filled - unresolved
+        logger.info("Total {} {} records merged from staging table and committed to database".format(
+            inserted, self.MODEL.__name__))
+        if filled:
+            logger.info("{} existing {} records filled in from staging table".format(filled, self.MODEL.__name__))
+        logger.info("{} staging table rows with unresolved IDs".format(unresolved))
+
+    def stage(self, handle, staging):
+        """
+        Bulk-load rows of data file into staging table.
+
+        :param handle: File handle of data file.
+        :param staging: Table object of staging table.
+        """
+        rows = []
+        for row in self.count_rows(feed_format(handle)(handle, self.COLUMNS)):
+            rows.append(self.stage_row(row, staging))
+            if len(rows) == self.BATCH_SIZE:
+                self.session.execute(staging.insert(), rows)
+                rows = []
+        if rows:
+            self.session.execute(staging.insert(), rows)
+
+    def stage_row(self, row, staging):
+        """
+        Convert data file record to row of staging table.
+
+        Last names that include the player's birthdate separated by ':' are split into last name
+        and birth date.
+
+        :param row: Record of data file.
+        :param staging: Table object of staging table.
+        :return: Dictionary of staging table columns/values.
+        """
+        record = dict(row._asdict(), row_id=self.counts['read'])
+        if 'birth_date' in staging.c:
+            record['birth_date'] = None
+            last_name = record['last_name']
+            if last_name is not None and ':' in last_name:
+                record['last_name'], birth_date_iso = last_name.split(':')
+                try:
+                    record['birth_date'] = date(*tuple(int(x) for x in birth_date_iso.split('-')))
+                except (TypeError, ValueError):
+                    record['last_name'] = None
+        return record
+
+    @staticmethod
+    def unique_id(id_column, *conditions, **kwargs):
+        """
+        Create scalar subquery of the ID of the unique record that satisfies conditions.
+
+        The subquery is NULL if no record or several records satisfy the conditions.
+
+        :param id_column: ID column of the data model.
+        :param conditions: Conditions on the data model, correlated to the staging table.
+        :param select_from: Optional FROM clause of the subquery.
+        :return: Scalar subquery.
+        """
+        query = select([func.max(id_column)]).where(and_(*conditions)).having(func.count(id_column) == 1)
+        if 'select_from' in kwargs:
+            query = query.select_from(kwargs['select_from'])
+        return query.as_scalar()
+
+    def resolution(self, field, staging):
+        """
+        Create SQL expression of a resolved ID field of the staging table.
+
+        :param field: Name of resolved ID field.
+        :param staging: Table object of staging table.
+        :return: SQL expression.
+        """
+        raise NotImplementedError
+
+    def fields(self, staging):
+        """
+        Create SQL expressions of the data model fields from the staging table.
+
+        :param staging: Table object of staging table.
+        :return: Dictionary of model fields and SQL expressions.
+        """
+        raise NotImplementedError
+
+    def player_names(self, staging):
+        """
+        Create work table of the full names and birth dates of players, indexed on full name.
+
+        Full names are computed once for all players, instead of once per staging table row.
+
+        :param staging: Table object of staging table.
+        :return: Table object.
+        """
+        names = self.work_table('player_names', staging.metadata,
+                                Column('id', Integer), Column('full_name', Unicode(200)), Column('birth_date', Date))
+        Index('ix_{}'.format(names.name), names.c.full_name)
+        connection = self.session.connection()
+        names.create(connection)
+        connection.execute(names.insert().from_select(
+            ['id', 'full_name', 'birth_date'],
+            select([Players.id, Players.full_name, Persons.birth_date]).select_from(
+                Players.__table__.join(Persons.__table__))))
+        return names
+
+    def player_resolution(self, staging):
+        """
+        Resolve player ID from the player's full name, and from the birth date if the data file includes it.
+        """
+        names = self.player_names(staging)
+        full_name = case([(staging.c.first_name != None, staging.c.first_name + u' ' + staging.c.last_name)],
+                         else_=staging.c.last_name)
+        return self.unique_id(names.c.id, names.c.full_name == full_name,
+                              or_(staging.c.birth_date == None, names.c.birth_date == staging.c.birth_date))
+
+    def unresolved(self, staging):
+        """
+        Create query of staging table rows with unresolved IDs.
+
+        :param staging: Table object of staging table.
+        :return: Select object.
+        """
+        return select([staging]).where(or_(*[staging.c[field] == None for field in self.RESOLVED])).order_by(
+            staging.c.row_id)
+
+    def report_unresolved(self, staging):
+        """
+        Record staging table rows with unresolved IDs as rejected rows.
+
+        The rejection reason is the first unresolved ID field of the row.
+
+        :param staging: Table object of staging table.
+        :return: Number of unresolved rows.
+        """
+        fields = [field for field, _, _ in self.COLUMNS]
+        unresolved = 0
+        for row in self.session.execute(self.unresolved(staging)):
+            unresolved += 1
+            entity = next(field for field in self.RESOLVED if row[field] is None)[:-3]
+            if entity == 'player':
+                name = u" ".join(filter(None, [row['first_name'], row['last_name']]))
+            else:
+                name = next((row[field] for field in fields if field.startswith(entity)), None)
+            self.rejects.add('unknown_{}'.format(entity), name, row.row_id - self.rejects.offset,
+                             **{field: row[field] for field in fields})
+        return unresolved
+
+    def first_rows(self, staging):
+        """
+        Create condition on resolved staging table rows that are the first rows with their natural key.
+
+        :param staging: Table object of staging table.
+        :return: SQL expression.
+        """
+        duplicate = staging.alias('duplicate')
+        first = staging.c.row_id == select([func.min(duplicate.c.row_id)]).where(
+            and_(*[duplicate.c[field] == staging.c[field] for field in self.MODEL.__natural_key__])).as_scalar()
+        return and_(first, *[staging.c[field] != None for field in self.RESOLVED])
+
+    def key_match(self, table, staging):
+        """
+        Create conditions that match records of the data model's base table to staging table rows by natural key.
+
+        :param table: Table object of base table.
+        :param staging: Table object of staging table.
+        :return: List of SQL expressions.
+        """
+        mapper = class_mapper(self.MODEL)
+        conditions = [table.c[field] == staging.c[field] for field in self.MODEL.__natural_key__]
+        if mapper.polymorphic_on is not None:
+            conditions.append(mapper.polymorphic_on == mapper.polymorphic_identity)
+        return conditions
+
+    def fill(self, staging):
+        """
+        Update existing records that are filled in by resolved staging table rows.
+
+        By default, no records are filled in.  In dry runs, the records that would be updated are counted instead.
+
+        :param staging: Table object of staging table.
+        :return: Number of records updated.
+        """
+        return 0
+
+    def merge(self, staging):
+        """
+        Insert records from resolved staging table rows whose natural keys are not in the database.
+
+        Of several rows with the same natural key, the first row is inserted.  Subclass tables of
+        joined-inheritance models are written after the base table, with the base table key of the
+        new records.  In dry runs, the rows that would be inserted are counted instead.
+
+        :param staging: Table object of staging table.
+        :return: Number of records inserted.
+        """
+        mapper = class_mapper(self.MODEL)
+        tables = RecordWriter.tables(mapper)
+        base_table = tables[0]
+        fields = self.fields(staging)
+        first = self.first_rows(staging)
+
+        def key_match(table):
+            return self.key_match(table, staging)
+
+        base_fields = dict((column.key, fields[field]) for field, column in RecordWriter.table_columns(
+            mapper, base_table) if field in fields)
+        if mapper.polymorphic_on is not None:
+            base_fields[mapper.polymorphic_on.key] = literal(mapper.polymorphic_identity)
+        names = base_fields.keys()
+        query = select([base_fields[name] for name in names]).where(
+            and_(first, ~exists().where(and_(*key_match(base_table)))))
+        if self.dry_run:
+            return self.session.execute(select([func.count()]).select_from(query.alias())).scalar()
+        inserted = self.session.execute(base_table.insert().from_select(names, query)).rowcount
+
+        base_pk, = base_table.primary_key.columns
+        for table in tables[1:]:
+            child_pk, = table.primary_key.columns
+            child_fields = dict((column.key, fields[field]) for field, column in RecordWriter.table_columns(
+                mapper, table) if field in fields and column is not child_pk)
+            names = [child_pk.key] + child_fields.keys()
+            query = select([base_pk] + [child_fields[name] for name in names[1:]]).select_from(
+                staging.join(base_table, and_(*key_match(base_table)))).where(
+                and_(first, ~exists().where(child_pk == base_pk)))
+            self.session.execute(table.insert().from_select(names, query))
+        return inserted
+
+
+class SeasonalStagingIngest(StagingIngest):
+    """
+    Staging table ingestion of data files of competition- and season-specific player data.
+
+    Competitions are resolved by name, seasons by name and clubs by symbol.
+    """
+
+    RESOLVED = ('competition_id', 'season_id', 'club_id', 'player_id')
+
+    def resolution(self, field, staging):
+        if field == 'competition_id':
+            return self.unique_id(Competitions.id, Competitions.name == staging.c.competition)
+        elif field == 'season_id':
+            return self.unique_id(Seasons.id, Seasons.name == staging.c.season)
+        elif field == 'club_id':
+            return self.unique_id(Clubs.id, Clubs.symbol == staging.c.club_symbol)
+        elif field == 'player_id':
+            return self.player_resolution(staging)
+
+    def key_fields(self, staging):
+        return {field: staging.c[field] for field in self.RESOLVED}
+
+
+class SalaryStagingIngest(SeasonalStagingIngest):
+
+    MODEL = PlayerSalaries
+    COLUMNS = PlayerSalaryIngest.COLUMNS
+
+    def fields(self, staging):
+        return dict(self.key_fields(staging), base_salary=cents_expression(staging.c.base),
+                    avg_guaranteed=cents_expression(staging.c.guaranteed))
+
+
+class MinuteStagingIngest(SeasonalStagingIngest):
+
+    MODEL = FieldPlayerStats
+    COLUMNS = PlayerMinuteIngest.COLUMNS
+
+    def fields(self, staging):
+        return dict(self.key_fields(staging), minutes=staging.c.minutes)
+
+
+class MatchStatStagingIngest(StagingIngest):
+    """
+    Staging table ingestion of data files of season statistics.
+
+    Competitions and clubs are resolved by name, and seasons by their start and end years.
+    Negative statistics are written as NULL.
+    """
+
+    RESOLVED = ('competition_id', 'season_id', 'club_id', 'player_id')
+    COMMON_FIELDS = ('appearances', 'substituted', 'minutes', 'yellows', 'reds')
+    STAT_FIELDS = ()
+
+    def resolution(self, field, staging):
+        if field == 'competition_id':
+            return self.unique_id(Competitions.id, Competitions.name == staging.c.competition)
+        elif field == 'season_id':
+            start_year, end_year = Years.__table__.alias('start_year'), Years.__table__.alias('end_year')
+            return self.unique_id(Seasons.id, start_year.c.yr == staging.c.start_year,
+                                  end_year.c.yr == staging.c.end_year,
+                                  select_from=Seasons.__table__.join(
+                                      start_year, Seasons.start_year_id == start_year.c.id).join(
+                                      end_year, Seasons.end_year_id == end_year.c.id))
+        elif field == 'club_id':
+            return self.unique_id(Clubs.id, Clubs.name == staging.c.club)
+        elif field == 'player_id':
+            return self.player_resolution(staging)
+
+    def fields(self, staging):
+        fields = {field: staging.c[field] for field in self.RESOLVED}
+        for field in self.COMMON_FIELDS + self.STAT_FIELDS:
+            fields[field] = case([(staging.c[field] >= 0, staging.c[field])])
+        return fields
+
+
+class FieldStatStagingIngest(MatchStatStagingIngest):
+    """
+    Staging table ingestion of data files of field player statistics.
+
+    Player minutes records without statistics are filled in with the statistics of the same natural key,
+    as in FieldStatIngest.  Negative statistics keep the values of the existing record.
+    """
+
+    MODEL = FieldPlayerStats
+    COLUMNS = FieldStatIngest.COLUMNS
+    STAT_FIELDS = FieldStatIngest.STAT_FIELDS
+
+    def fill(self, staging):
+        mapper = class_mapper(self.MODEL)
+        base_table, stat_table = RecordWriter.tables(mapper)
+        base_pk, = base_table.primary_key.columns
+        stat_pk, = stat_table.primary_key.columns
+        fields = self.fields(staging)
+        source = and_(self.first_rows(staging), *self.key_match(base_table, staging))
+        minutes_only = and_(*[column == None for field, column in RecordWriter.table_columns(mapper, stat_table)
+                              if field in self.STAT_FIELDS])
+
+        def values(table, condition):
+            return {column.key: func.coalesce(select([fields[field]]).where(condition).as_scalar(), column)
+                    for field, column in RecordWriter.table_columns(mapper, table)
+                    if field in fields and field not in self.RESOLVED}
+
+        filled = and_(exists().where(source), exists().where(and_(stat_pk == base_pk, minutes_only)))
+        if self.dry_run:
+            return self.session.execute(select([func.count()]).select_from(base_table).where(filled)).scalar()
+        updated = self.session.execute(base_table.update().where(filled).values(
+            values(base_table, source))).rowcount
+        stat_source = and_(base_pk == stat_pk, source)
+        self.session.execute(stat_table.update().where(and_(minutes_only, exists().where(stat_source))).values(
+            values(stat_table, stat_source)))
+        return updated
+
+
+class GoalkeeperStatStagingIngest(MatchStatStagingIngest):
+
+    MODEL = GoalkeeperStats
+    COLUMNS = GoalkeeperStatIngest.COLUMNS
+    STAT_FIELDS = ('wins', 'draws', 'losses', 'goals_allowed', 'shots_allowed', 'clean_sheets')
+
+
+class LeaguePointStagingIngest(StagingIngest):
+    """
+    Staging table ingestion of data files of league points.
+
+    Clubs are resolved by name, symbol, or both.
+    """
+
+    MODEL = LeaguePoints
+    COLUMNS = LeaguePointIngest.COLUMNS
+    RESOLVED = ('competition_id', 'season_id', 'club_id')
+
+    def resolution(self, field, staging):
+        if field == 'competition_id':
+            return self.unique_id(Competitions.id, Competitions.name == staging.c.competition)
+        elif field == 'season_id':
+            return self.unique_id(Seasons.id, Seasons.name == staging.c.season)
+        elif field == 'club_id':
+            return self.unique_id(Clubs.id, or_(staging.c.club != None, staging.c.club_symbol != None),
+                                  or_(staging.c.club == None, Clubs.name == staging.c.club),
+                                  or_(staging.c.club_symbol == None, Clubs.symbol == staging.c.club_symbol))
+
+    def fields(self, staging):
+        return dict({field: staging.c[field] for field in self.RESOLVED}, played=staging.c.played,
+                    points=staging.c.points)
@@ -13,53 +13,47 @@ class PlayerMinuteIngest(SeasonalDataIngest):
     """
 
     BATCH_SIZE = 50
-    
+    MODEL = FieldPlayerStats
+
+    COLUMNS = SeasonalDataIngest.COLUMNS + (
+        ('minutes', "Mins", int),
+    )
+
     def parse_file(self, rows):
-        inserts = 0
-        insertion_list = []
         logger.info("Ingesting Player Minutes...")
-        for keys in rows:
-            competition_name = self.column_unicode("Competition", **keys)
-            season_name = self.column("Season", **keys)
-            club_symbol = self.column("Club Symbol", **keys)
-            last_name = self.column_unicode("Last Name", **keys)
-            first_name = self.column_unicode("First Name", **keys)
-            total_minutes = self.column_int("Mins", **keys)
-
-            competition_id = self.get_id(Competitions, name=competition_name)
-            if competition_id is None:
-                logger.error(u"Cannot insert Player Minutes record for {} {}: "
-                             u"Competition {} not in database".format(first_name, last_name, competition_name))
-                continue
-            season_id = self.get_id(Seasons, name=season_name)
-            if season_id is None:
-                logger.error(u"Cannot insert Player Minutes record for {} {}: "
-                             u"Season {} not in database".format(first_name, last_name, season_name))
-                continue
-            club_id = self.get_id(Clubs, symbol=club_symbol)
-            if club_id is None:
-                logger.error(u"Cannot insert Player Minutes record for {} {}: "
-                             u"Club {} not in database".format(first_name, last_name, club_symbol))
-                continue
-            player_id = self.get_player_from_name(first_name, last_name)
-            if player_id is None:
-                logger.error(u"Cannot insert Player Minutes record for {} {}: "
-                             u"Player not in database".format(first_name, last_name))
-                continue
-
-            stat_dict = self.prepare_db_dict(
-                ['player_id', 'club_id', 'competition_id', 'season_id', 'minutes'],
-                [player_id, club_id, competition_id, season_id, total_minutes])
-            if not self.record_exists(FieldPlayerStats, **stat_dict):
-                insertion_list.append(FieldPlayerStats(**stat_dict))
-                inserted, insertion_list = self.bulk_insert(insertion_list, PlayerMinuteIngest.BATCH_SIZE)
-                inserts += inserted
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
         logger.info("Total {} Player Minutes records inserted and committed to database".format(inserts))
         logger.info("Player Minutes Ingestion complete.")
 
+    def transform(self, row):
+        competition_name = row.competition
+        season_name = row.season
+        club_symbol = row.club_symbol
+        last_name = row.last_name
+        first_name = row.first_name
+        total_minutes = row.minutes
+
+        competition_id = self.get_id(Competitions, name=competition_name)
+        if competition_id is None:
+            self.reject('unknown_competition', competition_name, **row._asdict())
+            return None
+        season_id = self.get_id(Seasons, name=season_name)
+        if season_id is None:
+            self.reject('unknown_season', season_name, **row._asdict())
+            return None
+        club_id = self.get_id(Clubs, symbol=club_symbol)
+        if club_id is None:
+            self.reject('unknown_club', club_symbol, **row._asdict())
+            return None
+        player_id = self.get_player_from_name(first_name, last_name)
+        if player_id is None:
+            self.reject('unknown_player', u" ".join(filter(None, [first_name, last_name])), **row._asdict())
+            return None
+
+        return self.prepare_db_dict(
+            ['player_id', 'club_id', 'competition_id', 'season_id', 'minutes'],
+            [player_id, club_id, competition_id, season_id, total_minutes])
+
 
 class MatchStatIngest(SeasonalDataIngest):
     """
@@ -68,6 +62,20 @@ class MatchStatIngest(SeasonalDataIngest):
     Assume categories and nomenclature of Nielsen soccer database.
     """
 
+    COLUMNS = (
+        ('last_name', "Last Name", unicode),
+        ('first_name', "First Name", unicode),
+        ('club', "Club", unicode),
+        ('competition', "Competition", unicode),
+        ('start_year', "Year1", int),
+        ('end_year', "Year2", int),
+        ('appearances', "Gp", int),
+        ('substituted', "Sb", int),
+        ('minutes', "Min", int),
+        ('yellows', "Yc", int),
+        ('reds', "Rc", int)
+    )
+
     @staticmethod
     def is_empty_record(*args):
         """Check for sparseness of statistical record.
@@ -95,33 +103,31 @@ class MatchStatIngest(SeasonalDataIngest):
         """
         return any(arg is None for arg in args)
 
-    def get_common_stats(self, **keys):
-        last_name = self.column_unicode("Last Name", **keys)
-        first_name = self.column_unicode("First Name", **keys)
-        club_name = self.column_unicode("Club", **keys)
-        competition_name = self.column_unicode("Competition", **keys)
-        start_year = self.column_int("Year1", **keys)
-        end_year = self.column_int("Year2", **keys)
-        match_appearances = self.column_int("Gp", **keys)
-        matches_subbed = self.column_int("Sb", **keys)
-        total_minutes = self.column_int("Min", **keys)
-        yellow_cards = self.column_int("Yc", **keys)
-        red_cards = self.column_int("Rc", **keys)
+    def get_common_stats(self, row):
+        start_year = row.start_year
+        end_year = row.end_year
 
-        player_id = self.get_player_from_name(first_name, last_name)
-        club_id = self.get_id(Clubs, name=club_name)
-        competition_id = self.get_id(Competitions, name=competition_name)
+        player_id = self.get_player_from_name(row.first_name, row.last_name)
+        club_id = self.get_id(Clubs, name=row.club)
+        competition_id = self.get_id(Competitions, name=row.competition)
         season_name = "{}".format(start_year) if start_year == end_year else "{}-{}".format(start_year, end_year)
         season_id = self.get_id(Seasons, name=season_name)
 
         if self.empty_ids(player_id, club_id, competition_id, season_id):
+            for reason, name, record_id in [
+                    ('unknown_player', u" ".join(filter(None, [row.first_name, row.last_name])), player_id),
+                    ('unknown_club', row.club, club_id), ('unknown_competition', row.competition, competition_id),
+                    ('unknown_season', season_name, season_id)]:
+                if record_id is None:
+                    self.reject(reason, name, **row._asdict())
+                    break
             raise ValueError("At least one of Player/Club/Competition/Season IDs is empty. Skipping insert")
         
         stat_dict = self.prepare_db_dict(
             ['player_id', 'club_id', 'competition_id', 'season_id', 'appearances', 
              'substituted', 'minutes', 'yellows', 'reds'], 
-            [player_id, club_id, competition_id, season_id, match_appearances,
-             matches_subbed, total_minutes, yellow_cards, red_cards])
+            [player_id, club_id, competition_id, season_id, row.appearances,
+             row.substituted, row.minutes, row.yellows, row.reds])
         return stat_dict
 
     def parse_file(self, rows):
@@ -129,145 +135,191 @@ class MatchStatIngest(SeasonalDataIngest):
 
 
 class FieldStatIngest(MatchStatIngest):
+    """
+    Ingestion methods for data files containing field player statistics.
+
+    Player minutes records (PlayerMinuteIngest) share the natural key of field player statistics.
+    Records whose key belongs to a minutes record without statistics fill in that record, and are
+    counted as inserted and as updated.
+    """
 
     BATCH_SIZE = 500
-    
+    MODEL = FieldPlayerStats
+    STAT_FIELDS = ('goals_total', 'goals_headed', 'goals_freekick', 'goals_in_area', 'goals_out_area',
+                   'goals_winners', 'goals_penalty', 'penalties_taken', 'assists_total', 'assists_deadball',
+                   'shots_total', 'fouls_total')
+
+    COLUMNS = MatchStatIngest.COLUMNS + (
+        ('goals_total', "Gl", int),
+        ('goals_headed', "Hd", int),
+        ('goals_freekick', "Fk", int),
+        ('goals_in_area', "In", int),
+        ('goals_out_area', "Out", int),
+        ('goals_winners', "Gw", int),
+        ('goals_penalty', "Pn", int),
+        ('penalties_taken', "Pa", int),
+        ('assists_total', "As", int),
+        ('assists_deadball', "Dd", int),
+        ('shots_total', "Sht", int),
+        ('fouls_total', "Fls", int)
+    )
+
+    def __init__(self, session, writer=None, **options):
+        super(FieldStatIngest, self).__init__(session, writer, **options)
+        self.minute_keys = {}
+        self.filled = set()
+
+    def minute_key_set(self, scope):
+        """
+        Retrieve set of natural keys of minutes records without field statistics in a competition season,
+        loading them from the database if necessary.
+
+        :param scope: Tuple of (competition ID, season ID).
+        :return: Set of natural key tuples.
+        """
+        if scope not in self.minute_keys:
+            query = self.session.query(*[getattr(FieldPlayerStats, field)
+                                         for field in FieldPlayerStats.__natural_key__]).filter_by(
+                **dict(zip(('competition_id', 'season_id'), scope))).filter(
+                *[getattr(FieldPlayerStats, field) == None for field in FieldStatIngest.STAT_FIELDS])
+            self.minute_keys[scope] = set(tuple(row) for row in query)
+        return self.minute_keys[scope]
+
+    def claim_key(self, model, **fields):
+        """
+        Check that natural key of record is new, or that it belongs to a minutes record without statistics,
+        which the record fills in.
+
+        :param model: Marcotti-MLS data model.
+        :param fields: Dictionary of fields/values of record.
+        :return: Boolean value that is True if record is to be written.
+        """
+        if self.upsert:
+            return super(FieldStatIngest, self).claim_key(model, **fields)
+        if self.natural_keys.claim(model, **fields):
+            return True
+        key = tuple(fields.get(field) for field in model.__natural_key__)
+        minute_keys = self.minute_key_set((fields.get('competition_id'), fields.get('season_id')))
+        if key in minute_keys:
+            minute_keys.remove(key)
+            self.filled.add(key)
+            self.counts['updated'] += 1
+            return True
+        self.counts['skipped'] += 1
+        return False
+
+    def write_records(self, record_list, model=None):
+        """
+        Write list of records to database and commit transaction, then update the minutes records that
+        the records fill in.
+        """
+        keys = [tuple(record.get(field) for field in FieldPlayerStats.__natural_key__) for record in record_list]
+        fills = [record for record, key in zip(record_list, keys) if key in self.filled]
+        inserted = super(FieldStatIngest, self).write_records(
+            [record for record, key in zip(record_list, keys) if key not in self.filled], model)
+        if fills:
+            self.writer.update(FieldPlayerStats, fills)
+            self.filled.difference_update(keys)
+            self.commit()
+            self.counts['inserted'] += len(fills)
+        return inserted + len(fills)
+
     def parse_file(self, rows):
-        inserts = 0
-        insertion_list = []
-        for keys in rows:
-            try:
-                common_stat_dict = self.get_common_stats(**keys)
-            except ValueError as err:
-                logger.error(err.message)
-                continue
-
-            total_goals = self.column_int("Gl", **keys)
-            headed_goals = self.column_int("Hd", **keys)
-            freekick_goals = self.column_int("Fk", **keys)
-            in_box_goals = self.column_int("In", **keys)
-            out_box_goals = self.column_int("Out", **keys)
-            game_winning_goals = self.column_int("Gw", **keys)
-            penalty_goals = self.column_int("Pn", **keys)
-            total_penalties = self.column_int("Pa", **keys)
-            assists = self.column_int("As", **keys)
-            deadball_assists = self.column_int("Dd", **keys)
-            shots = self.column_int("Sht", **keys)
-            fouls = self.column_int("Fls", **keys)
-
-            field_stat_dict = self.prepare_db_dict(
-                ['goals_total', 'goals_headed', 'goals_freekick', 'goals_in_area', 'goals_out_area',
-                 'goals_winners', 'goals_penalty', 'penalties_taken', 'assists_total', 'assists_deadball',
-                 'shots_total', 'fouls_total'],
-                [total_goals, headed_goals, freekick_goals, in_box_goals, out_box_goals,
-                 game_winning_goals, penalty_goals, total_penalties, assists, deadball_assists,
-                 shots, fouls]
-            )
-            field_stat_dict.update(common_stat_dict)
-
-            if field_stat_dict is not None:
-                if not self.record_exists(FieldPlayerStats, **field_stat_dict):
-                    insertion_list.append(FieldPlayerStats(**field_stat_dict))
-                    inserted, insertion_list = self.bulk_insert(insertion_list, FieldStatIngest.BATCH_SIZE)
-                    inserts += inserted
-                    if inserted and not inserts % FieldStatIngest.BATCH_SIZE:
-                        logger.info("{} records inserted".format(inserts))
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
         logger.info("Total {} Field Player Statistics records inserted and committed to database".format(inserts))
         logger.info("Field Player Statistics Ingestion complete.")
 
+    def transform(self, row):
+        try:
+            common_stat_dict = self.get_common_stats(row)
+        except ValueError:
+            return None
+
+        field_stat_dict = self.prepare_db_dict(
+            FieldStatIngest.STAT_FIELDS,
+            [row.goals_total, row.goals_headed, row.goals_freekick, row.goals_in_area, row.goals_out_area,
+             row.goals_winners, row.goals_penalty, row.penalties_taken, row.assists_total,
+             row.assists_deadball, row.shots_total, row.fouls_total]
+        )
+        field_stat_dict.update(common_stat_dict)
+        return field_stat_dict
+
 
 class GoalkeeperStatIngest(MatchStatIngest):
 
     BATCH_SIZE = 50
+    MODEL = GoalkeeperStats
+
+    COLUMNS = MatchStatIngest.COLUMNS + (
+        ('wins', "Wn", int),
+        ('draws', "Dr", int),
+        ('losses', "Ls", int),
+        ('goals_allowed', "Ga", int),
+        ('clean_sheets', "Cs", int),
+        ('shots_allowed', "Sht", int)
+    )
 
     def parse_file(self, rows):
-        inserts = 0
-        insertion_list = []
-        for keys in rows:
-            try:
-                common_stat_dict = self.get_common_stats(**keys)
-            except ValueError as err:
-                logger.error(err.message)
-                continue
-
-            wins = self.column_int("Wn", **keys)
-            draws = self.column_int("Dr", **keys)
-            losses = self.column_int("Ls", **keys)
-            goals_allowed = self.column_int("Ga", **keys)
-            clean_sheets = self.column_int("Cs", **keys)
-            shots_allowed = self.column_int("Sht", **keys)
-
-            gk_stat_dict = self.prepare_db_dict(
-                ['wins', 'draws', 'losses', 'goals_allowed', 'shots_allowed', 'clean_sheets'],
-                [wins, draws, losses, goals_allowed, shots_allowed, clean_sheets]
-            )
-            gk_stat_dict.update(common_stat_dict)
-
-            if gk_stat_dict is not None:
-                if not self.record_exists(GoalkeeperStats, **gk_stat_dict):
-                    stat_record = GoalkeeperStats(**gk_stat_dict)
-                    insertion_list.append(stat_record)
-                    inserted, insertion_list = self.bulk_insert(insertion_list, GoalkeeperStatIngest.BATCH_SIZE)
-                    inserts += inserted 
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
         logger.info("Total {} Goalkeeper Statistics records inserted and committed to database".format(inserts))
         logger.info("Goalkeeper Statistics Ingestion complete.")
 
+    def transform(self, row):
+        try:
+            common_stat_dict = self.get_common_stats(row)
+        except ValueError:
+            return None
+
+        gk_stat_dict = self.prepare_db_dict(
+            ['wins', 'draws', 'losses', 'goals_allowed', 'shots_allowed', 'clean_sheets'],
+            [row.wins, row.draws, row.losses, row.goals_allowed, row.shots_allowed, row.clean_sheets]
+        )
+        gk_stat_dict.update(common_stat_dict)
+        return gk_stat_dict
+
 
 class LeaguePointIngest(SeasonalDataIngest):
 
     BATCH_SIZE = 10
+    MODEL = LeaguePoints
+
+    COLUMNS = (
+        ('club_symbol', "Club Symbol", str),
+        ('club', "Club", unicode),
+        ('competition', "Competition", unicode),
+        ('season', "Season", str),
+        ('played', "GP", int),
+        ('points', "Pts", int)
+    )
 
     def parse_file(self, rows):
-        inserts = 0
-        insertion_list = []
-        for keys in rows:
-            try:
-                club_symbol = self.column("Club Symbol", **keys)
-            except KeyError:
-                club_symbol = None
-            try:
-                club_name = self.column_unicode("Club", **keys)
-            except KeyError:
-                club_name = None
-            competition_name = self.column_unicode("Competition", **keys)
-            season_name = self.column("Season", **keys)
-            matches_played = self.column_int("GP", **keys)
-            points = self.column_int("Pts", **keys)
-
-            competition_id = self.get_id(Competitions, name=competition_name)
-            if competition_id is None:
-                logger.error(u"Cannot insert LeaguePoint record: "
-                             u"Competition {} not in database".format(competition_name))
-                continue
-            season_id = self.get_id(Seasons, name=season_name)
-            if season_id is None:
-                logger.error(u"Cannot insert LeaguePoint record: "
-                             u"Season {} not in database".format(season_name))
-                continue
-            club_dict = {field: value for (field, value)
-                         in zip(['name', 'symbol'], [club_name, club_symbol])
-                         if value is not None}
-            club_id = self.get_id(Clubs, **club_dict)
-            if club_id is None:
-                logger.error(u"Cannot insert LeaguePoint record: "
-                             u"Database error involving {}".format(club_dict))
-                continue
-
-            club_season_dict = dict(club_id=club_id, competition_id=competition_id, season_id=season_id)
-            if not self.record_exists(LeaguePoints, **club_season_dict):
-                point_record_dict = dict(played=matches_played, points=points)
-                point_record_dict.update(club_season_dict)
-                insertion_list.append(LeaguePoints(**point_record_dict))
-                inserted, insertion_list = self.bulk_insert(insertion_list, LeaguePointIngest.BATCH_SIZE)
-                inserts += inserted
-        self.session.add_all(insertion_list)
-        self.session.commit()
-        inserts += len(insertion_list)
+        inserts = self.insert_records(self.transform(row) for row in rows)
         logger.info("Total {} League Point records inserted and committed to database".format(inserts))
         logger.info("League Point Ingestion complete.")
+
+    def transform(self, row):
+        club_symbol = row.club_symbol
+        club_name = row.club
+        competition_name = row.competition
+        season_name = row.season
+        matches_played = row.played
+        points = row.points
+
+        competition_id = self.get_id(Competitions, name=competition_name)
+        if competition_id is None:
+            self.reject('unknown_competition', competition_name, **row._asdict())
+            return None
+        season_id = self.get_id(Seasons, name=season_name)
+        if season_id is None:
+            self.reject('unknown_season', season_name, **row._asdict())
+            return None
+        club_dict = {field: value for (field, value)
+                     in zip(['name', 'symbol'], [club_name, club_symbol])
+                     if value is not None}
+        club_id = self.get_id(Clubs, **club_dict)
+        if club_id is None:
+            self.reject('unknown_club', club_name or club_symbol, **row._asdict())
+            return None
+
+        return dict(club_id=club_id, competition_id=competition_id, season_id=season_id,
+                    played=matches_played, points=points)
@@ -0,0 +1,506 @@
+import logging
+from collections import OrderedDict
+from datetime import date, datetime
+from StringIO import StringIO
+
+from sqlalchemy import and_, bindparam, func, select, text, Sequence
+from sqlalchemy.orm import class_mapper
+
+logger = logging.getLogger(__name__)
+
+
+class RecordWriter(object):
+    """
+    Base class for writing records of Marcotti-MLS data models to the database.
+
+    Records are dictionaries of model fields and values.  Writers do not commit transactions.
+    """
+
+    dry_run = False
+
+    def __init__(self, session):
+        self.session = session
+
+    def write(self, model, records):
+        """
+        Write records of data model to database.
+
+        :param model: Marcotti-MLS data model.
+        :param records: List of dictionaries of model fields/values.
+        """
+        raise NotImplementedError
+
+    def upsert(self, model, records):
+        """
+        Write records of data model to database, replacing records with the same natural key.
+
+        :param model: Marcotti-MLS data model.
+        :param records: List of dictionaries of model fields/values.
+        """
+        raise NotImplementedError("{} does not support upserts".format(type(self).__name__))
+
+    def update(self, model, records):
+        """
+        Update fields of existing records of data model, identified by their natural key.
+
+        Each table of the model is updated with one executemany statement per set of fields.  Key fields
+        are not updated, and fields that are missing from a record keep their values.
+
+        :param model: Marcotti-MLS data model.
+        :param records: List of dictionaries of model fields/values, including the natural key.
+        """
+        if not records:
+            return
+        mapper = class_mapper(model)
+        tables = self.tables(mapper)
+        base_table = tables[0]
+        base_pk, = base_table.primary_key.columns
+        key_fields = model.__natural_key__
+        conditions = [mapper.get_property(field).columns[0] == bindparam('key_' + field) for field in key_fields]
+        if mapper.polymorphic_on is not None:
+            conditions.append(mapper.polymorphic_on == mapper.polymorphic_identity)
+        base_id = select([base_pk]).where(and_(*conditions)).as_scalar()
+        groups = OrderedDict()
+        for record in records:
+            groups.setdefault(tuple(sorted(set(record) - set(key_fields))), []).append(record)
+        for fields, group in groups.items():
+            for table in tables:
+                table_pk, = table.primary_key.columns
+                values = [(field, column) for field, column in self.table_columns(mapper, table)
+                          if field in fields and column is not table_pk]
+                if not values:
+                    continue
+                statement = table.update().where(
+                    and_(*conditions) if table is base_table else table_pk == base_id).values(
+                    {column.key: bindparam('value_' + field) for field, column in values})
+                self.session.execute(statement, [dict(
+                    [('key_' + field, record[field]) for field in key_fields] +
+                    [('value_' + field, record[field]) for field, _ in values]) for record in group])
+
+    def promote(self, model, records):
+        """
+        Write subclass records of joined-inheritance model whose base table records already exist.
+
+        The subclass table is written in one statement, and the discriminator of the base table
+        records is set to the identity of the model.  Base model objects of these records are
+        removed from the session.
+
+        :param model: Marcotti-MLS data model.
+        :param records: List of dictionaries of model fields/values, including the base table key.
+        """
+        if not records:
+            return
+        mapper = class_mapper(model)
+        base_table = self.tables(mapper)[0]
+        pk_column, = base_table.primary_key.columns
+        pk_field = mapper.get_property_by_column(pk_column).key
+        self.insert_rows(mapper.local_table, self.table_params(mapper, mapper.local_table, records))
+        if mapper.polymorphic_on is not None:
+            self.session.execute(
+                base_table.update().where(pk_column == bindparam('base_pk')).values(
+                    {mapper.polymorphic_on.key: mapper.polymorphic_identity}),
+                [{'base_pk': record[pk_field]} for record in records])
+        for record in records:
+            identity_key = mapper.base_mapper.identity_key_from_primary_key([record[pk_field]])
+            if identity_key in self.session.identity_map:
+                self.session.expunge(self.session.identity_map[identity_key])
+
+    def insert_rows(self, table, params):
+        """
+        Insert rows into a database table with one executemany statement.
+
+        :param table: Table object.
+        :param params: List of dictionaries of column keys/values.
+        """
+        self.session.execute(table.insert(), params)
+
+    @staticmethod
+    def tables(mapper):
+        """
+        Return tables of data model, ordered from base table to subclass table.
+
+        :param mapper: Mapper of data model.
+        :return: List of Table objects.
+        """
+        tables = []
+        for ancestor in reversed(list(mapper.iterate_to_root())):
+            if ancestor.local_table not in tables:
+                tables.append(ancestor.local_table)
+        return tables
+
+    @staticmethod
+    def table_columns(mapper, table):
+        """
+        Return model fields and the columns of a table to which they are mapped.
+
+        :param mapper: Mapper of data model.
+        :param table: Table object of data model.
+        :return: List of (field name, Column object) tuples.
+        """
+        return [(prop.key, column) for prop in mapper.column_attrs for column in prop.columns
+                if column.table is table]
+
+    @staticmethod
+    def table_params(mapper, table, records):
+        """
+        Create parameter dictionaries of INSERT statement for a table from a batch of records.
+
+        Fields that are missing from some records take the column's default value, or NULL
+        if there is no default.  The discriminator of polymorphic models is filled in.
+
+        :param mapper: Mapper of data model.
+        :param table: Table object of data model.
+        :param records: List of dictionaries of model fields/values.
+        :return: List of dictionaries of column keys/values.
+        """
+        fields = set().union(*records)
+        defaults = {}
+        for field, column in RecordWriter.table_columns(mapper, table):
+            if field in fields:
+                defaults[column.key] = (field, column.default.arg if getattr(column.default, 'is_scalar', False)
+                                        else None)
+        params = [{key: record.get(field, default) for key, (field, default) in defaults.items()}
+                  for record in records]
+        if mapper.polymorphic_on is not None and mapper.polymorphic_on.table is table:
+            for param in params:
+                param[mapper.polymorphic_on.key] = mapper.polymorphic_identity
+        return params
+
+
+class OrmWriter(RecordWriter):
+    """
+    Write records as SQLAlchemy objects through the session's unit of work.
+    """
+
+    def write(self, model, records):
+        self.session.add_all([model(**record) for record in records])
+        self.session.flush()
+
+
+class NullWriter(RecordWriter):
+    """
+    Discard records instead of writing them, for dry runs of ingestions.
+
+    Ingestions with a null writer do not add objects to the session or commit transactions.
+    """
+
+    dry_run = True
+
+    def write(self, model, records):
+        pass
+
+    def upsert(self, model, records):
+        pass
+
+    def update(self, model, records):
+        pass
+
+    def promote(self, model, records):
+        pass
+
+
+class CoreWriter(RecordWriter):
+    """
+    Write records with one Core executemany INSERT statement per table and batch.
+
+    For joined-inheritance models on PostgreSQL, primary keys of the base table are allocated from the
+    table's sequence before insertion, so that base and subclass tables are each written in one
+    statement.  On backends without sequences (SQLite, MySQL), base table rows are inserted in one
+    statement and the keys generated by the database are read back with one query on the natural key,
+    so that concurrent writers never use the same key; subclass tables are still written in one
+    statement.  Records of models whose keys cannot be allocated or generated are written through the ORM.
+    """
+
+    def __init__(self, session):
+        super(CoreWriter, self).__init__(session)
+        self.fallback = OrmWriter(session)
+
+    @property
+    def dialect(self):
+        return self.session.get_bind().dialect
+
+    def allocate_ids(self, column, count):
+        """
+        Reserve primary key values for new records of a table from the table's sequence.
+
+        :param column: Primary key column of table.
+        :param count: Number of key values.
+        :return: List of key values, or None if keys cannot be reserved on this backend.
+        """
+        sequence = column.default if isinstance(column.default, Sequence) else None
+        if sequence is not None and self.dialect.name == 'postgresql':
+            query = select([sequence.next_value()]).select_from(func.generate_series(1, count))
+            return [row[0] for row in self.session.execute(query)]
+        return None
+
+    def insert_base_rows(self, mapper, table, pk_field, records):
+        """
+        Insert base table rows of joined-inheritance records in one statement, and read back the primary
+        keys that the database generates for new records with one query on the natural key.
+
+        Keys are read from the rows whose key is greater than the table's largest key before insertion,
+        and are matched to records by natural key in insertion order.
+
+        :param mapper: Mapper of data model.
+        :param table: Base table of data model.
+        :param pk_field: Model field of the base table's primary key.
+        :param records: List of dictionaries of model fields/values.
+        :return: List of records with primary keys, or None if the model's natural key is not in the base table.
+        """
+        pk_column, = table.primary_key.columns
+        key_columns = [column for field in getattr(mapper.class_, '__natural_key__', ())
+                       for column in mapper.get_property(field).columns]
+        if not key_columns or any(column.table is not table for column in key_columns):
+            return None
+        new_records = [record for record in records if record.get(pk_field) is None]
+        params = self.table_params(mapper, table, new_records)
+        for param in params:
+            param.pop(pk_column.key, None)
+        floor = self.session.execute(select([func.max(pk_column)])).scalar()
+        self.session.execute(table.insert(), params)
+
+        query = select([pk_column] + key_columns).order_by(pk_column)
+        if floor is not None:
+            query = query.where(pk_column > floor)
+        if mapper.polymorphic_on is not None:
+            query = query.where(mapper.polymorphic_on == mapper.polymorphic_identity)
+        generated = {}
+        for row in self.session.execute(query):
+            generated.setdefault(tuple(row[1:]), []).append(row[0])
+        ids = []
+        for param in params:
+            pool = generated.get(tuple(param.get(column.key) for column in key_columns))
+            if not pool:
+                raise RuntimeError("Cannot read back key of new {} record".format(mapper.class_.__name__))
+            ids.append(pool.pop(0))
+
+        keyed_records = [record for record in records if record.get(pk_field) is not None]
+        if keyed_records:
+            self.insert_rows(table, self.table_params(mapper, table, keyed_records))
+        allocated = iter(ids)
+        return [record if record.get(pk_field) is not None else dict(record, **{pk_field: next(allocated)})
+                for record in records]
+
+    def write(self, model, records):
+        if not records:
+            return
+        mapper = class_mapper(model)
+        tables = self.tables(mapper)
+        if len(tables) > 1:
+            pk_column, = tables[0].primary_key.columns
+            pk_field = mapper.get_property_by_column(pk_column).key
+            new_records = [record for record in records if record.get(pk_field) is None]
+            if new_records:
+                ids = self.allocate_ids(pk_column, len(new_records))
+                keyed = None
+                if ids is None and not self.dialect.supports_sequences:
+                    keyed = self.insert_base_rows(mapper, tables[0], pk_field, records)
+                if ids is None and keyed is None:
+                    logger.debug("Cannot allocate {} keys on {}: writing through ORM".format(
+                        model.__name__, self.dialect.name))
+                    self.fallback.write(model, records)
+                    return
+                elif keyed is not None:
+                    records = keyed
+                    tables = tables[1:]
+                else:
+                    allocated = iter(ids)
+                    records = [record if record.get(pk_field) is not None
+                               else dict(record, **{pk_field: next(allocated)}) for record in records]
+        for table in tables:
+            self.insert_rows(table, self.table_params(mapper, table, records))
+
+    def upsert(self, model, records):
+        """
+        Write records of data model with the backend's native conflict handling on the natural key
+        unique constraint, one statement per table and batch.
+
+        Records with the same natural key as an existing record update its fields, and the last of
+        several records with the same natural key in a batch is kept.  Subclass tables of
+        joined-inheritance models are written with INSERT ... SELECT so that updated records keep the
+        primary key of their base table record.  On PostgreSQL, primary keys are allocated for all
+        records, so keys allocated to updated records are unused.  On SQLite and MySQL, primary keys
+        of new base table records are generated by the database.
+
+        Supported on PostgreSQL 9.5+ and SQLite 3.24+ (ON CONFLICT), and MySQL (ON DUPLICATE KEY).
+        """
+        if not records:
+            return
+        if self.dialect.name not in ('postgresql', 'sqlite', 'mysql'):
+            raise ValueError("Upserts not supported on {}".format(self.dialect.name))
+        mapper = class_mapper(model)
+        tables = self.tables(mapper)
+        base_table = tables[0]
+        pk_column, = base_table.primary_key.columns
+        pk_field = mapper.get_property_by_column(pk_column).key
+        records = OrderedDict((tuple(record.get(field) for field in model.__natural_key__), record)
+                              for record in records).values()
+        if self.dialect.name == 'postgresql':
+            ids = self.allocate_ids(pk_column, len(records))
+            if ids is None:
+                raise ValueError("Cannot allocate {} keys on {}".format(model.__name__, self.dialect.name))
+            records = [dict(record, **{pk_field: record_id}) for record, record_id in zip(records, ids)]
+        else:
+            records = [{field: value for field, value in record.items() if field != pk_field} for record in records]
+
+        key_columns = [mapper.get_property(field).columns[0] for field in model.__natural_key__]
+        if mapper.polymorphic_on is not None:
+            key_columns.append(mapper.polymorphic_on)
+        params = self.table_params(mapper, base_table, records)
+        self.session.execute(self.upsert_statement(base_table, params[0].keys(), key_columns), params)
+
+        for table in tables[1:]:
+            params = self.table_params(mapper, table, records)
+            child_pk, = table.primary_key.columns
+            for param, record in zip(params, records):
+                param.pop(child_pk.key, None)
+                for column in key_columns:
+                    param['key_{}'.format(column.key)] = mapper.polymorphic_identity \
+                        if column is mapper.polymorphic_on else record[mapper.get_property_by_column(column).key]
+            self.session.execute(self.upsert_statement(table, params[0].keys(), [child_pk],
+                                                       source=(pk_column, key_columns)), params)
+
+    def upsert_statement(self, table, keys, key_columns, source=None):
+        """
+        Create INSERT statement of a table that updates rows whose unique key conflicts.
+
+        :param table: Table object.
+        :param keys: Column keys of parameters.
+        :param key_columns: Columns of the unique key.
+        :param source: Tuple of (primary key column, key columns) of a base table from which the primary key
+                       of the inserted rows is selected, or None.
+        :return: TextClause object with typed bind parameters.
+        """
+        preparer = self.dialect.identifier_preparer
+        columns = [column for column in table.columns if column.key in keys]
+        update_columns = [preparer.format_column(column) for column in columns
+                          if column not in key_columns and not column.primary_key]
+        binds = [bindparam(column.key, type_=column.type) for column in columns]
+        values = [":{}".format(column.key) for column in columns]
+        if source is None:
+            statement = u"INSERT INTO {} ({}) VALUES ({})".format(
+                preparer.format_table(table), ', '.join(preparer.format_column(column) for column in columns),
+                ', '.join(values))
+        else:
+            source_pk, source_keys = source
+            source_table = source_pk.table
+            target_pk, = key_columns
+            conditions = []
+            for column in source_keys:
+                binds.append(bindparam('key_{}'.format(column.key), type_=column.type))
+                conditions.append("{} = :key_{}".format(preparer.format_column(column, use_table=True),
+                                                        column.key))
+            statement = u"INSERT INTO {} ({}) SELECT {} FROM {} WHERE {}".format(
+                preparer.format_table(table),
+                ', '.join(preparer.format_column(column) for column in [target_pk] + columns),
+                ', '.join([preparer.format_column(source_pk, use_table=True)] + values),
+                preparer.format_table(source_table), ' AND '.join(conditions))
+        if self.dialect.name == 'mysql':
+            assignments = ["{0} = VALUES({0})".format(name) for name in update_columns] or \
+                ["{0} = {0}".format(preparer.format_column(key_columns[0]))]
+            statement += " ON DUPLICATE KEY UPDATE {}".format(', '.join(assignments))
+        else:
+            statement += " ON CONFLICT ({})".format(', '.join(preparer.format_column(column)
+                                                               for column in key_columns))
+            statement += " DO UPDATE SET {}".format(', '.join("{0} = excluded.{0}".format(name)
+                                                              for name in update_columns)) \
+                if update_columns else " DO NOTHING"
+        return text(statement).bindparams(*binds)
+
+
+class CopyWriter(CoreWriter):
+    """
+    Write records to PostgreSQL tables by streaming them through COPY ... FROM STDIN.
+
+    Rows are formatted as CSV in memory and passed to psycopg2's copy_expert, one COPY statement per
+    table and batch.  Sequence and scalar default values of columns missing from the rows are filled in
+    before the COPY, because COPY does not apply client-side defaults.
+    """
+
+    def cursor(self):
+        """
+        Return DBAPI cursor on the session's connection.
+        """
+        return self.session.connection().connection.cursor()
+
+    @staticmethod
+    def copy_value(value):
+        """
+        Format processed column value as a field of a PostgreSQL COPY CSV row.
+
+        NULL is an empty unquoted field and all other values are quoted.
+
+        :param value: Column value after bind processing.
+        :return: Byte string.
+        """
+        if value is None:
+            return ''
+        elif isinstance(value, bool):
+            value = 't' if value else 'f'
+        elif isinstance(value, (date, datetime)):
+            value = value.isoformat()
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return '"{}"'.format(str(value).replace('"', '""'))
+
+    def insert_rows(self, table, params):
+        if not params:
+            return
+        keys = set(params[0])
+        for column in table.columns:
+            if column.key in keys:
+                continue
+            if isinstance(column.default, Sequence):
+                for param, value in zip(params, self.allocate_ids(column, len(params))):
+                    param[column.key] = value
+                keys.add(column.key)
+            elif getattr(column.default, 'is_scalar', False):
+                for param in params:
+                    param[column.key] = column.default.arg
+                keys.add(column.key)
+        columns = [column for column in table.columns if column.key in keys]
+        processors = [column.type.bind_processor(self.dialect) for column in columns]
+        buffer = StringIO()
+        for param in params:
+            buffer.write(','.join(self.copy_value(processor(param[column.key]) if processor
+                                                  else param[column.key])
+                                  for column, processor in zip(columns, processors)))
+            buffer.write('\n')
+        buffer.seek(0)
+        preparer = self.dialect.identifier_preparer
+        statement = "COPY {} ({}) FROM STDIN WITH CSV".format(
+            preparer.format_table(table), ', '.join(preparer.format_column(column) for column in columns))
+        cursor = self.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
+
+WRITERS = {
+    'orm': OrmWriter,
+    'core': CoreWriter,
+    'copy': CopyWriter,
+    'null': NullWriter
+}
+
+
+def create_writer(session, backend='core'):
+    """
+    Create record writer for the final write stage of an ingestion.
+
+    The COPY backend requires PostgreSQL with psycopg2; on other backends the Core writer is used.
+    The null backend writes nothing, for dry runs.
+
+    :param session: Transaction session object.
+    :param backend: Name of writer backend ('orm', 'core', 'copy' or 'null').
+    :return: RecordWriter object.
+    """
+    if backend not in WRITERS:
+        raise ValueError("Invalid record writer backend: {}".format(backend))
+    dialect = session.get_bind().dialect
+    if backend == 'copy' and (dialect.name, dialect.driver) != ('postgresql', 'psycopg2'):
+        logger.warning("COPY writer requires PostgreSQL with psycopg2, not {}+{}: using Core writer".format(
+            dialect.name, dialect.driver))
+        backend = 'core'
+    return WRITERS[backend](session)
@@ -1,6 +1,8 @@
 class Analytics(object):
     """
     Base class for analytics classes.
+
+    Analytics query the database in a read-only session, such as one created by Marcotti.read_session.
     """
 
     def __init__(self, session):
@@ -1,6 +1,7 @@
 from sqlalchemy.sql import func
 
 from base import Analytics
+from marcottimls.calendars import SeasonCalendar
 from marcottimls.models import *
 
 
@@ -14,6 +15,10 @@ class PayrollAnalytics(Analytics):
         self.competition_name = competition
         self.season_name = season
 
+    @property
+    def calendar(self):
+        return SeasonCalendar.for_session(self.session)
+
     @property
     def competition(self):
         return self.session.query(Competitions).filter_by(name=self.competition_name).one()
@@ -97,7 +102,7 @@ class PayrollAnalytics(Analytics):
             filter(PartialTenures.club == club, PartialTenures.comp_season == comp_season,
                    PartialTenures.player_id == player_on_roster.player_id)
         if tenure.count() == 0:
-            tenure = [(1, comp_season.weeks)]
+            tenure = [(1, self.calendar.weeks(comp_season.competition_id, comp_season.season_id))]
         duration = sum([(end_week - start_week) + 1 for (start_week, end_week) in tenure])
         return duration
 
@@ -5,3 +5,4 @@ from overview import (Clubs, Competitions, CompetitionSeasons, Countries, Domest
                       InternationalCompetitions, Persons, Players, Seasons, Years)
 from financial import (AcquisitionPaths, PartialTenures, PlayerDrafts, PlayerSalaries)
 from statistics import (CommonStats, FieldPlayerStats, GoalkeeperStats, LeaguePoints)
+from control import BootstrapStates, FeedCheckpoints, FeedManifests
@@ -0,0 +1,78 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Unicode, DateTime, Sequence, UniqueConstraint
+
+from marcottimls.models.common import BaseSchema
+
+
+class FeedManifests(BaseSchema):
+    """
+    Data model of data files ingested into the database.
+
+    Records the size, modification time and content hash of a data file at its last successful
+    ingestion by an entity, with the row counts of that ingestion.
+    """
+    __tablename__ = 'feed_manifests'
+    __table_args__ = (
+        UniqueConstraint('path', 'entity'),
+    )
+
+    id = Column(Integer, Sequence('manifest_id_seq', start=100), primary_key=True)
+
+    path = Column(Unicode(255), nullable=False)
+    entity = Column(String(40), nullable=False)
+    size = Column(BigInteger)
+    mtime = Column(DateTime)
+    checksum = Column(String(64))
+    loaded_at = Column(DateTime)
+    rows_read = Column(Integer)
+    rows_inserted = Column(Integer)
+    rows_skipped = Column(Integer)
+    rows_rejected = Column(Integer)
+
+    def __repr__(self):
+        return u"<FeedManifest(path={0}, entity={1}, checksum={2}, loaded={3})>".format(
+            self.path, self.entity, self.checksum, self.loaded_at).encode('utf-8')
+
+
+class BootstrapStates(BaseSchema):
+    """
+    Data model of the database bootstrap.
+
+    Records the fingerprint of the schema and reference data (Years, Seasons and Countries) at the
+    last bootstrap of the database.
+    """
+    __tablename__ = 'bootstrap_states'
+
+    id = Column(Integer, Sequence('bootstrap_id_seq', start=100), primary_key=True)
+
+    name = Column(String(40), nullable=False, unique=True)
+    fingerprint = Column(String(64), nullable=False)
+    loaded_at = Column(DateTime)
+
+    def __repr__(self):
+        return u"<BootstrapState(name={0}, fingerprint={1}, loaded={2})>".format(
+            self.name, self.fingerprint, self.loaded_at).encode('utf-8')
+
+
+class FeedCheckpoints(BaseSchema):
+    """
+    Data model of the progress of data file ingestions.
+
+    Records the number of rows of a data file that an entity has processed up to its last committed
+    batch.  Checkpoints are removed when the ingestion of the data file is complete.
+    """
+    __tablename__ = 'feed_checkpoints'
+    __table_args__ = (
+        UniqueConstraint('path', 'entity'),
+    )
+
+    id = Column(Integer, Sequence('checkpoint_id_seq', start=100), primary_key=True)
+
+    path = Column(Unicode(255), nullable=False)
+    entity = Column(String(40), nullable=False)
+    checksum = Column(String(64))
+    rows_committed = Column(Integer)
+    updated_at = Column(DateTime)
+
+    def __repr__(self):
+        return u"<FeedCheckpoint(path={0}, entity={1}, rows={2}, updated={3})>".format(
+            self.path, self.entity, self.rows_committed, self.updated_at).encode('utf-8')
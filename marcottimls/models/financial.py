@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Sequence, ForeignKey, ForeignKeyConstraint, Boolean
+from sqlalchemy import (Column, Integer, String, Sequence, ForeignKey, ForeignKeyConstraint, UniqueConstraint,
+                        Boolean)
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.schema import CheckConstraint
 
@@ -13,6 +14,7 @@ class AcquisitionPaths(BaseSchema):
     Captures **initial** entry path into league.
     """
     __tablename__ = 'acquisitions'
+    __natural_key__ = ('player_id', 'year_id')
 
     player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
     year_id = Column(Integer, ForeignKey('years.id'), primary_key=True)
@@ -55,11 +57,13 @@ class PlayerSalaries(BaseSchema):
     Player salary data model.
     """
     __tablename__ = 'salaries'
+    __natural_key__ = ('player_id', 'club_id', 'competition_id', 'season_id')
     __table_args__ = (
         ForeignKeyConstraint(
             ['competition_id', 'season_id'],
             ['competition_seasons.competition_id', 'competition_seasons.season_id'],
         ),
+        UniqueConstraint('player_id', 'club_id', 'competition_id', 'season_id'),
     )
 
     id = Column(Integer, Sequence('salary_id_seq', start=10000), primary_key=True)
@@ -95,11 +99,13 @@ class PartialTenures(BaseSchema):
     Data model that captures player's partial-season tenure at a club.
     """
     __tablename__ = 'partials'
+    __natural_key__ = ('player_id', 'club_id', 'competition_id', 'season_id')
     __table_args__ = (
         ForeignKeyConstraint(
             ['competition_id', 'season_id'],
             ['competition_seasons.competition_id', 'competition_seasons.season_id'],
         ),
+        UniqueConstraint('player_id', 'club_id', 'competition_id', 'season_id'),
     )
 
     id = Column(Integer, Sequence('partial_id_seq', start=10000), primary_key=True)
@@ -16,6 +16,7 @@ class Countries(BaseSchema):
     Countries are defined as FIFA-affiliated national associations.
     """
     __tablename__ = "countries"
+    __natural_key__ = ('name',)
 
     id = Column(Integer, Sequence('country_id_seq', start=100), primary_key=True)
 
@@ -32,6 +33,7 @@ class Years(BaseSchema):
     Years data model.
     """
     __tablename__ = "years"
+    __natural_key__ = ('yr',)
 
     id = Column(Integer, Sequence('year_id_seq', start=100), primary_key=True)
     yr = Column(Integer, unique=True)
@@ -45,6 +47,7 @@ class Seasons(BaseSchema):
     Seasons data model.
     """
     __tablename__ = "seasons"
+    __natural_key__ = ('start_year_id', 'end_year_id')
 
     id = Column(Integer, Sequence('season_id_seq', start=100), primary_key=True)
 
@@ -106,6 +109,7 @@ class Competitions(BaseSchema):
     Competitions common data model.
     """
     __tablename__ = 'competitions'
+    __natural_key__ = ('name',)
 
     id = Column(Integer, Sequence('competition_id_seq', start=1000), primary_key=True)
 
@@ -150,6 +154,7 @@ class CompetitionSeasons(BaseSchema):
     Data model for a season's league competition. (Regular season only)
     """
     __tablename__ = 'competition_seasons'
+    __natural_key__ = ('competition_id', 'season_id')
 
     competition_id = Column(Integer, ForeignKey('competitions.id'), primary_key=True)
     season_id = Column(Integer, ForeignKey('seasons.id'), primary_key=True)
@@ -186,6 +191,7 @@ class Clubs(BaseSchema):
     Football club data model.
     """
     __tablename__ = 'clubs'
+    __natural_key__ = ('name', 'symbol', 'country_id')
 
     id = Column(Integer, Sequence('club_id_seq', start=10000), primary_key=True)
 
@@ -207,6 +213,8 @@ class Persons(BaseSchema):
     Persons common data model.   This model is subclassed by other Personnel data models.
     """
     __tablename__ = 'persons'
+    __natural_key__ = ('first_name', 'known_first_name', 'middle_name', 'last_name', 'second_last_name',
+                       'nick_name', 'birth_date', 'country_id')
 
     person_id = Column(Integer, Sequence('person_id_seq', start=100000), primary_key=True)
     first_name = Column(Unicode(40))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Sequence, Index, ForeignKeyConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, Sequence, Index, ForeignKeyConstraint, UniqueConstraint
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.schema import CheckConstraint
 
@@ -10,11 +10,13 @@ class CommonStats(BaseSchema):
     Data model of common season statistics for football players.
     """
     __tablename__ = 'common_stats'
+    __natural_key__ = ('player_id', 'club_id', 'competition_id', 'season_id')
     __table_args__ = (
         ForeignKeyConstraint(
             ['competition_id', 'season_id'],
             ['competition_seasons.competition_id', 'competition_seasons.season_id'],
         ),
+        UniqueConstraint('player_id', 'club_id', 'competition_id', 'season_id', 'type'),
     )
 
     id = Column(Integer, Sequence('stat_id_seq', start=100000), primary_key=True)
@@ -88,11 +90,13 @@ class LeaguePoints(BaseSchema):
     Data model of points earned in league competitions.
     """
     __tablename__ = "league_points"
+    __natural_key__ = ('club_id', 'competition_id', 'season_id')
     __table_args__ = (
         ForeignKeyConstraint(
             ['competition_id', 'season_id'],
             ['competition_seasons.competition_id', 'competition_seasons.season_id'],
         ),
+        UniqueConstraint('club_id', 'competition_id', 'season_id'),
     )
 
     id = Column(Integer, Sequence('leaguept_id_seq', start=10000), primary_key=True)
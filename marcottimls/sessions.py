@@ -0,0 +1,41 @@
+from sqlalchemy import event
+
+
+class SessionCache(object):
+    """
+    Base class of in-memory caches that are attached to a session and shared by all its users.
+
+    Subclasses name the key of the cache in the session's info dictionary (KEY).  Caches see the
+    records flushed by the session (after_flush), and are reset when the session is rolled back.
+    """
+
+    KEY = None
+
+    def __init__(self, session):
+        self.session = session
+        event.listen(session, 'after_flush', self.after_flush)
+        event.listen(session, 'after_soft_rollback', self.after_rollback)
+
+    @classmethod
+    def for_session(cls, session):
+        """
+        Retrieve cache attached to session, creating it if it does not exist.
+
+        :param session: Transaction session object.
+        :return: Cache object.
+        """
+        if cls.KEY not in session.info:
+            session.info[cls.KEY] = cls(session)
+        return session.info[cls.KEY]
+
+    def after_flush(self, session, flush_context):
+        pass
+
+    def after_rollback(self, session, previous_transaction):
+        self.reset()
+
+    def reset(self):
+        """
+        Discard cached data, so that it is loaded from the database on next use.
+        """
+        raise NotImplementedError
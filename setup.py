@@ -31,7 +31,8 @@ setup(
         'MySQL': ['mysql-python>=1.2.3'],
         'MSSQL': ['pyodbc>=3.0'],
         'Oracle': ['cx_oracle>=5.0'],
-        'Firebird': ['fdb>=1.6']
+        'Firebird': ['fdb>=1.6'],
+        'XZ': ['backports.lzma>=0.0.6']
     },
     tests_require=['pytest>=2.8.2'],
     description='Software library for creating and querying football databases specific to Major League Soccer',
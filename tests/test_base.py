@@ -0,0 +1,159 @@
+# coding=utf-8
+import sys
+import threading
+import types
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import InvalidRequestError
+
+from marcottimls import Marcotti, MarcottiConfig
+from marcottimls.base import ReadOnlySession, batch_executemany, ping_connection
+from marcottimls.models import Countries
+
+
+class SQLiteConfig(MarcottiConfig):
+    DIALECT = 'sqlite'
+    START_YEAR = 2015
+    END_YEAR = 2016
+
+
+class PostgresConfig(MarcottiConfig):
+    DIALECT = 'postgresql'
+    DBNAME = 'marcotti'
+    DBUSER = 'user'
+    DBPASSWD = 'passwd'
+    HOSTNAME = 'localhost'
+    PORT = 5432
+
+
+def test_engine_options():
+    """Engine Options 001: Pass pool and isolation options that are set to the database engine."""
+    config = PostgresConfig()
+    assert config.engine_options == {}
+    config.POOL_SIZE, config.MAX_OVERFLOW, config.POOL_RECYCLE = 10, 5, 3600
+    config.ISOLATION_LEVEL = 'READ COMMITTED'
+    assert config.engine_options == dict(pool_size=10, max_overflow=5, pool_recycle=3600,
+                                         isolation_level='READ COMMITTED')
+
+    config = SQLiteConfig()
+    config.POOL_SIZE, config.POOL_RECYCLE = 10, 3600
+    assert config.engine_options == dict(pool_recycle=3600)
+
+
+def test_pooled_sessions(tmpdir):
+    """Engine Options 002: Check session connections out of the engine pool, with pre-ping."""
+    config = SQLiteConfig()
+    config.DBNAME = '/{}'.format(tmpdir.join('marcotti.db'))
+    config.POOL_PRE_PING = True
+    marcotti = Marcotti(config)
+    assert event.contains(marcotti.engine, 'engine_connect', ping_connection)
+    Countries.__table__.create(marcotti.engine)
+
+    with marcotti.create_session() as sess:
+        assert sess.bind is marcotti.engine
+        sess.add(Countries(name=u"Canada"))
+    with marcotti.create_session(dedicated=True) as sess:
+        assert sess.bind is not marcotti.engine
+        assert sess.query(Countries).count() == 1
+    marcotti.engine.dispose()
+
+    config.EXECUTEMANY_MODE = 'batch'
+    with pytest.raises(ValueError):
+        Marcotti(config)
+
+
+def test_batch_executemany_fallback(monkeypatch):
+    """Engine Options 003: Fall back to executemany() if psycopg2 does not provide execute_batch."""
+    extras = types.ModuleType('psycopg2.extras')
+    psycopg2 = types.ModuleType('psycopg2')
+    psycopg2.extras = extras
+    monkeypatch.setitem(sys.modules, 'psycopg2', psycopg2)
+    monkeypatch.setitem(sys.modules, 'psycopg2.extras', extras)
+    assert batch_executemany(100) is None
+
+    calls = []
+    extras.execute_batch = lambda cursor, statement, parameters, page_size: calls.append(page_size)
+    assert batch_executemany(100)(None, "INSERT", [{}], None)
+    assert calls == [100]
+
+
+def test_session_errors(tmpdir):
+    """Sessions 001: Roll back session on error, and raise the error again if requested."""
+    config = SQLiteConfig()
+    config.DBNAME = '/{}'.format(tmpdir.join('marcotti.db'))
+    marcotti = Marcotti(config)
+    Countries.__table__.create(marcotti.engine)
+
+    with marcotti.create_session() as sess:
+        sess.add(Countries(name=u"Canada"))
+        raise RuntimeError("Bad feed")
+    with pytest.raises(RuntimeError):
+        with marcotti.create_session(dedicated=True, reraise=True) as sess:
+            sess.add(Countries(name=u"Canada"))
+            raise RuntimeError("Bad feed")
+    with marcotti.create_session() as sess:
+        assert sess.query(Countries).count() == 0
+    marcotti.engine.dispose()
+
+
+def test_read_sessions(tmpdir):
+    """Read Sessions 001: Query the database concurrently in thread-local read-only sessions."""
+    config = SQLiteConfig()
+    config.DBNAME = '/{}'.format(tmpdir.join('marcotti.db'))
+    marcotti = Marcotti(config)
+    Countries.__table__.create(marcotti.engine)
+    with marcotti.create_session() as sess:
+        sess.add_all([Countries(name=u"Canada"), Countries(name=u"Mexico")])
+
+    results = {}
+
+    def count_countries(index):
+        with marcotti.read_session() as sess:
+            with marcotti.read_session() as inner:
+                assert inner is sess
+            results[index] = (sess, sess.query(Countries).count())
+
+    threads = [threading.Thread(target=count_countries, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(count for _, count in results.values()) == [2, 2, 2, 2]
+    assert len(set(id(session) for session, _ in results.values())) == 4
+
+    with marcotti.read_session() as sess:
+        assert isinstance(sess, ReadOnlySession)
+        sess.query(Countries).filter_by(name=u"Canada").one().name = u"Canadia"
+        with pytest.raises(InvalidRequestError):
+            sess.flush()
+    with marcotti.read_session() as sess:
+        assert sess.query(Countries).filter_by(name=u"Canada").count() == 1
+    marcotti.engine.dispose()
+
+
+def test_read_engine_routing(tmpdir):
+    """Read Sessions 002: Route read sessions to the read database and ETL sessions to the write database."""
+    config = SQLiteConfig()
+    config.DBNAME = '/{}'.format(tmpdir.join('primary.db'))
+    config.READ_DATABASE_URI = 'sqlite:///{}'.format(tmpdir.join('replica.db'))
+    marcotti = Marcotti(config)
+    assert marcotti.read_engine is not marcotti.engine
+    for engine in [marcotti.engine, marcotti.read_engine]:
+        Countries.__table__.create(engine)
+    with marcotti.read_engine.begin() as connection:
+        connection.execute(Countries.__table__.insert(), [dict(name=u"Mexico")])
+
+    with marcotti.create_session() as sess:
+        sess.add(Countries(name=u"Canada"))
+    with marcotti.read_session() as sess:
+        assert sess.bind is marcotti.read_engine
+        assert [name for name, in sess.query(Countries.name)] == [u"Mexico"]
+    with marcotti.create_session() as sess:
+        assert [name for name, in sess.query(Countries.name)] == [u"Canada"]
+    marcotti.engine.dispose()
+    marcotti.read_engine.dispose()
+
+    config.READ_DATABASE_URI = None
+    marcotti = Marcotti(config)
+    assert marcotti.read_engine is marcotti.engine
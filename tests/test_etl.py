@@ -0,0 +1,1252 @@
+# coding=utf-8
+import threading
+import time
+import zipfile
+from datetime import date
+from functools import partial
+from StringIO import StringIO
+import bz2
+import csv
+import gzip
+import json
+import imp
+import mmap
+import os
+import re
+import sqlite3
+
+import jinja2
+import pkg_resources
+import pytest
+from sqlalchemy.engine import create_engine
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm.session import Session
+
+from marcottimls import Marcotti, MarcottiConfig
+from marcottimls.calendars import SeasonCalendar
+from marcottimls.etl import (CountryIngest, PlayerIngest, PlayerSalaryIngest, PartialTenureIngest, FieldStatIngest,
+                             PlayerMinuteIngest,
+                             ETLScheduler,
+                             SalaryStagingIngest, MinuteStagingIngest, FieldStatStagingIngest,
+                             get_local_handles, ingest_feeds, ingest_feeds_parallel, create_seasons,
+                             CSV_ETL_CLASSES, CSV_ETL_DEPENDENCIES)
+from marcottimls.etl.bootstrap import (bootstrap_db, add_unique_constraints, check_unique_constraints,
+                                       missing_unique_constraints)
+from marcottimls.etl.cache import ParsedFeedCache
+from marcottimls.etl.matching import PlayerMatchIndex, name_tokens
+from marcottimls.etl.sources import FeedStream, MappedFeed
+from marcottimls.etl.rejects import CSVRejectSink, SQLiteRejectSink, create_reject_sink
+from marcottimls.etl.base import (BaseIngest, CSVRecordReader, DimensionCache, NaturalKeyRegistry,
+                                  PlayerNameResolver, SeasonalDataIngest)
+from marcottimls.etl.pipeline import ETLPipeline
+from marcottimls.etl.writers import CoreWriter, CopyWriter, NullWriter, OrmWriter, create_writer
+from marcottimls.models import *
+
+
+@pytest.fixture()
+def file_session(request, tmpdir):
+    """Session on a database file of its own, for ingestions that create tables or run in other processes."""
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('marcotti.db')))
+    BaseSchema.metadata.create_all(engine)
+    session = Session(engine)
+
+    def fin():
+        session.close()
+        engine.dispose()
+    request.addfinalizer(fin)
+    return session
+
+
+def stat_record_key(session, comp_data, club_data, person_data):
+    """Insert player, club and competition season records and return their IDs as a statistical record key."""
+    yr = Years(yr=2015)
+    comp_season = CompetitionSeasons(competition=DomesticCompetitions(**comp_data['domestic']),
+                                     season=Seasons(start_year=yr, end_year=yr),
+                                     start_date=date(2015, 3, 6), end_date=date(2015, 10, 25), matchdays=34)
+    club = Clubs(**club_data['orlando'])
+    player = Players(**person_data['generic'])
+    session.add_all([comp_season, club, player])
+    session.flush()
+    return dict(player_id=player.id, club_id=club.id,
+                competition_id=comp_season.competition_id, season_id=comp_season.season_id)
+
+
+def test_dimension_cache_lookup(session, club_data):
+    """Dimension Cache 001: Retrieve dimension record IDs from cache after a single preload query."""
+    clubs = [Clubs(**data) for data in club_data.values()]
+    session.add_all(clubs)
+    session.commit()
+
+    ingest = BaseIngest(session)
+    orlando_id = ingest.get_id(Clubs, symbol="ORL")
+    assert orlando_id == session.query(Clubs).filter_by(name=u"Orlando City SC").one().id
+    assert ingest.get_id(Clubs, name=u"New York City FC", symbol="NYCFC") is not None
+    assert ingest.get_id(Clubs, name=u"Toronto FC") is None
+    assert (Clubs, ('symbol',)) in ingest.dimensions.indexes
+
+
+def test_dimension_cache_shared_by_session(session):
+    """Dimension Cache 002: Verify that ingestion objects of a session share one dimension cache."""
+    assert BaseIngest(session).dimensions is BaseIngest(session).dimensions
+    assert DimensionCache.for_session(session) is BaseIngest(session).dimensions
+
+
+def test_dimension_cache_register_insert(session, country_data):
+    """Dimension Cache 003: Add dimension records flushed by session to loaded lookup tables."""
+    ingest = BaseIngest(session)
+    assert ingest.get_id(Countries, name=u"England") is None
+
+    session.add(Countries(**country_data['england']))
+    session.flush()
+    assert ingest.get_id(Countries, name=u"England") is not None
+
+
+def test_dimension_cache_memoized_miss(session, country_data):
+    """Dimension Cache 004: Memoize lookups on non-indexed fields, including misses."""
+    ingest = BaseIngest(session)
+    conditions = dict(name=u"England", confederation=ConfederationType.europe)
+    assert ingest.get_id(Countries, **conditions) is None
+    assert len(ingest.dimensions.memo) == 1
+
+    session.add(Countries(**country_data['england']))
+    session.flush()
+    assert ingest.get_id(Countries, **conditions) is not None
+
+
+def test_dimension_cache_season_and_year(session):
+    """Dimension Cache 005: Look up Seasons by name and Years by year string."""
+    yr1, yr2 = Years(yr=2012), Years(yr=2013)
+    session.add_all([Seasons(start_year=yr1, end_year=yr1), Seasons(start_year=yr1, end_year=yr2)])
+    session.commit()
+
+    ingest = BaseIngest(session)
+    assert ingest.get_id(Seasons, name="2012") is not None
+    assert ingest.get_id(Seasons, name="2012-2013") is not None
+    assert ingest.get_id(Years, yr="2013") == yr2.id
+
+
+def test_player_resolver_full_name(session, person_data):
+    """Player Resolver 001: Resolve player IDs from full names without name queries."""
+    players = [Players(**data) for data in person_data['player']]
+    session.add_all(players)
+    session.commit()
+
+    ingest = SeasonalDataIngest(session)
+    assert ingest.get_player_from_name(u"Cristiano", u"Ronaldo") == players[1].id
+    assert ingest.get_player_from_name(u"Son", u"Heung-Min") == players[2].id
+    assert ingest.get_player_from_name(u"Miguel", u"Ponce") is None
+    assert (ingest.players.hits, ingest.players.misses, ingest.players.ambiguous) == (2, 1, 0)
+
+    ingest.players.report()
+    assert (ingest.players.hits, ingest.players.misses, ingest.players.ambiguous) == (0, 0, 0)
+
+
+def test_player_resolver_ambiguous_name(session, person_data):
+    """Player Resolver 002: Flag ambiguous names and disambiguate them by birth date."""
+    generic = dict(person_data['generic'])
+    players = [Players(**generic), Players(**dict(generic, birth_date=date(1985, 6, 1)))]
+    session.add_all(players)
+    session.commit()
+
+    ingest = SeasonalDataIngest(session)
+    assert ingest.get_player_from_name(u"Jim", u"Doe") is None
+    assert ingest.players.ambiguous == 1
+    assert ingest.get_player_from_name(u"Jim", u"Doe:1985-06-01") == players[1].id
+    assert ingest.get_player_from_name(u"Jim", u"Doe:1985-06-02") is None
+
+
+def test_player_resolver_register_insert(session, person_data):
+    """Player Resolver 003: Add players flushed by session to built resolver index."""
+    ingest = SeasonalDataIngest(session)
+    assert ingest.get_player_from_name(u"Jim", u"Doe") is None
+
+    player = Players(**person_data['generic'])
+    session.add(player)
+    session.flush()
+    assert ingest.get_player_from_name(u"Jim", u"Doe") == player.id
+
+
+def test_ingest_keyword_options(session):
+    """Ingest Options 001: Accept ingestion options by keyword only, with the defaults of the ingestion class."""
+    writer = NullWriter(session)
+    feed = FieldStatIngest(session, writer, upsert=True, match_threshold=0.8)
+    assert feed.writer is writer and feed.upsert and feed.match_threshold == 0.8
+    assert not feed.pipeline and not feed.mapped and feed.cache is None
+    assert not CountryIngest(session).upsert
+    with pytest.raises(TypeError):
+        FieldStatIngest(session, writer, True)
+    with pytest.raises(TypeError):
+        CountryIngest(session, upsert=True)
+
+
+def test_natural_key_claim(session, country_data):
+    """Natural Key 001: Reject natural keys of existing records and of records claimed earlier."""
+    session.add(Countries(**country_data['england']))
+    session.commit()
+
+    ingest = BaseIngest(session)
+    assert not ingest.claim_key(Countries, name=u"England")
+    assert ingest.claim_key(Countries, name=u"Côte d'Ivoire", confederation=ConfederationType.africa)
+    assert not ingest.claim_key(Countries, name=u"Côte d'Ivoire")
+
+
+def test_natural_key_season_scope(session):
+    """Natural Key 002: Load natural keys of competition- and season-specific models by competition season."""
+    ingest = BaseIngest(session)
+    salary = dict(player_id=1, club_id=2, competition_id=3, season_id=4)
+    assert NaturalKeyRegistry.is_scoped(PlayerSalaries)
+    assert not NaturalKeyRegistry.is_scoped(CompetitionSeasons)
+    assert ingest.claim_key(PlayerSalaries, base_salary=100, **salary)
+    assert not ingest.claim_key(PlayerSalaries, base_salary=200, **salary)
+    assert ingest.claim_key(PlayerSalaries, **dict(salary, season_id=5))
+    assert set(ingest.natural_keys.keys) == {(PlayerSalaries, (3, 4)), (PlayerSalaries, (3, 5))}
+
+
+def test_natural_key_subclass_models(session, comp_data, club_data, person_data):
+    """Natural Key 003: Keep natural keys of field player and goalkeeper statistics separate."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    session.add(FieldPlayerStats(minutes=900, **stat_key))
+    session.commit()
+
+    ingest = BaseIngest(session)
+    assert not ingest.claim_key(FieldPlayerStats, goals_total=3, **stat_key)
+    assert ingest.claim_key(GoalkeeperStats, wins=3, **stat_key)
+
+
+def test_core_writer_joined_inheritance(session, comp_data, club_data, person_data):
+    """Record Writer 001: Write joined-inheritance records to base and subclass tables in one batch."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    club = Clubs(**club_data['nyc'])
+    session.add(club)
+    session.flush()
+    records = [dict(minutes=900, goals_total=3, **stat_key),
+               dict(stat_key, minutes=450, shots_total=10, club_id=club.id)]
+    CoreWriter(session).write(FieldPlayerStats, records)
+
+    stats = session.query(FieldPlayerStats).order_by(FieldPlayerStats.minutes).all()
+    assert [(rec.minutes, rec.goals_total, rec.shots_total) for rec in stats] == [(450, None, 10), (900, 3, None)]
+    assert all(rec.type == 'field' for rec in stats)
+    assert session.query(CommonStats).count() == 2
+
+
+def test_core_writer_column_defaults(session, country_data):
+    """Record Writer 002: Apply column defaults to fields missing from some records of a batch."""
+    country = Countries(**country_data['england'])
+    session.add(country)
+    session.flush()
+    records = [dict(first_name=u"John", last_name=u"Smith", country_id=country.id),
+               dict(first_name=u"Heung-Min", last_name=u"Son", order=NameOrderType.eastern,
+                    primary_position=PositionType.forward, country_id=country.id)]
+    CoreWriter(session).write(Players, records)
+
+    players = {player.last_name: player for player in session.query(Players)}
+    assert players[u"Smith"].order == NameOrderType.western
+    assert players[u"Smith"].primary_position == PositionType.unknown
+    assert players[u"Son"].full_name == u"Son Heung-Min"
+    assert session.query(Persons).filter_by(type='players').count() == 2
+
+
+def test_core_writer_generated_keys(session, country_data):
+    """Record Writer 007: Match keys generated for base table rows to records by natural key and type."""
+    country = Countries(**country_data['england'])
+    session.add(country)
+    session.flush()
+    session.add(Persons(first_name=u"John", last_name=u"Smith", country_id=country.id))
+    session.flush()
+    records = [dict(first_name=u"John", last_name=u"Smith", country_id=country.id,
+                    primary_position=PositionType.forward),
+               dict(first_name=u"John", last_name=u"Smith", country_id=country.id,
+                    primary_position=PositionType.defender)]
+    CoreWriter(session).write(Players, records)
+
+    players = session.query(Players).order_by(Players.person_id).all()
+    assert [player.primary_position for player in players] == [PositionType.forward, PositionType.defender]
+    assert all(player.type == 'players' for player in players)
+    assert session.query(Persons).filter_by(type='persons').count() == 1
+
+
+def test_salary_ingest_core_writer(session, comp_data, club_data, person_data):
+    """Record Writer 003: Insert salary records from a data feed and skip duplicate rows."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    feed = StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n")
+    PlayerSalaryIngest(session).load_feed(feed)
+
+    salary = session.query(PlayerSalaries).one()
+    assert (salary.base_salary, salary.avg_guaranteed) == (6000000, 7250000)
+    assert salary.player.full_name == u"Jim Doe"
+
+
+def test_player_ingest_batches(session, country_data, monkeypatch):
+    """Player Ingest 001: Insert new players, promote existing persons and skip duplicate rows in batches."""
+    england = Countries(**country_data['england'])
+    person = Persons(first_name=u"John", last_name=u"Smith", birth_date=date(1990, 5, 1), country=england)
+    session.add(person)
+    session.commit()
+    person_id = person.person_id
+    feed = StringIO("First Name,Known First Name,Middle Name,Last Name,Second Last Name,Nickname,Birthdate,"
+                    "Name Order,Position,Country\n"
+                    "John,,,Smith,,,1990-05-01,,D,England\n"
+                    "James,Jim,,Doe,,,1980-01-01,,GK,England\n"
+                    "Heung-Min,,,Son,,,1992-07-08,Eastern,F/M,England\n"
+                    "James,Jim,,Doe,,,1980-01-01,,GK,England\n")
+    monkeypatch.setattr(PlayerIngest, 'BATCH_SIZE', 2)
+    PlayerIngest(session).load_feed(feed)
+
+    players = {player.full_name: player for player in session.query(Players)}
+    assert sorted(players) == [u"Jim Doe", u"John Smith", u"Son Heung-Min"]
+    assert players[u"John Smith"].person_id == person_id
+    assert players[u"John Smith"].primary_position == PositionType.defender
+    assert players[u"Son Heung-Min"].secondary_position == PositionType.midfielder
+    assert session.query(Persons).count() == 3
+
+
+def test_player_ingest_resets_indexes(session, country_data):
+    """Player Ingest 002: Find players written by the player ingestion in the session's name indexes."""
+    session.add(Countries(**country_data['england']))
+    session.commit()
+    matcher = PlayerMatchIndex.for_session(session)
+    assert matcher.candidates(u"Heung Min Son") == []
+    PlayerIngest(session).load_feed(StringIO("First Name,Known First Name,Middle Name,Last Name,Second Last Name,"
+                                             "Nickname,Birthdate,Name Order,Position,Country\n"
+                                             "Heung-Min,,,Son,,,1992-07-08,Eastern,F/M,England\n"))
+
+    player_id = session.query(Players.id).scalar()
+    assert matcher.candidates(u"Heung Min Son")[0].player_id == player_id
+    assert PlayerNameResolver.for_session(session).resolve(u"Son Heung-Min") == player_id
+
+
+class MockCopyCursor(object):
+    """Stand-in for psycopg2 cursor that captures COPY statements and their data."""
+
+    def __init__(self, copies):
+        self.copies = copies
+
+    def copy_expert(self, sql, data):
+        self.copies.append((sql, data.read()))
+
+    def close(self):
+        pass
+
+
+def test_copy_writer_statements(session, comp_data, club_data, person_data):
+    """Record Writer 004: Stream field player statistics to base and subclass tables through COPY."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    copies = []
+    writer = CopyWriter(session)
+    writer.cursor = lambda: MockCopyCursor(copies)
+    writer.allocate_ids = lambda column, count: range(500, 500 + count)
+    writer.write(FieldPlayerStats, [dict(minutes=900, goals_total=3, **stat_key),
+                                    dict(minutes=450, shots_total=10, **stat_key)])
+
+    assert [sql.split(' (')[0] for sql, data in copies] == ["COPY common_stats", "COPY field_stats"]
+    common_rows, field_rows = [[dict(zip(sql.split('(')[1].split(')')[0].split(', '), line.split(',')))
+                                for line in data.splitlines()] for sql, data in copies]
+    assert [row['minutes'] for row in common_rows] == ['"900"', '"450"']
+    assert all(row['type'] == '"field"' for row in common_rows)
+    assert [row['id'] for row in field_rows] == [row['id'] for row in common_rows] == ['"500"', '"501"']
+    assert [(row['goals_total'], row['shots_total']) for row in field_rows] == [('"3"', ''), ('', '"10"')]
+
+
+def test_copy_writer_values():
+    """Record Writer 005: Format NULL, Boolean, date and Unicode values as COPY CSV fields."""
+    assert CopyWriter.copy_value(None) == ''
+    assert CopyWriter.copy_value(True) == '"t"'
+    assert CopyWriter.copy_value(date(2015, 3, 6)) == '"2015-03-06"'
+    assert CopyWriter.copy_value(u'Côte d"Ivoire') == '"C\xc3\xb4te d""Ivoire"'
+
+
+def test_create_writer_backend(session):
+    """Record Writer 006: Fall back to Core writer when COPY backend is not available."""
+    assert type(create_writer(session, 'copy')) is CoreWriter
+    assert type(create_writer(session, 'orm')) is OrmWriter
+    with pytest.raises(ValueError):
+        create_writer(session, 'bulk')
+
+
+def test_scheduler_dependency_order():
+    """ETL Scheduler 001: Run stages concurrently after the stages they depend on."""
+    events = []
+    lock = threading.Lock()
+
+    def stage(entity):
+        with lock:
+            events.append(('start', entity))
+        time.sleep(0.01)
+        with lock:
+            events.append(('end', entity))
+
+    stages = [(entity, partial(stage, entity)) for entity, _ in CSV_ETL_CLASSES]
+    timings = ETLScheduler(stages, CSV_ETL_DEPENDENCIES, workers=4).run()
+
+    assert set(timings) == set(entity for entity, _ in CSV_ETL_CLASSES)
+    for entity, depends in CSV_ETL_DEPENDENCIES.items():
+        for dependency in depends:
+            assert events.index(('end', dependency)) < events.index(('start', entity))
+
+
+def test_scheduler_failed_stage():
+    """ETL Scheduler 002: Skip stages that depend on a failed stage."""
+    def fail():
+        raise RuntimeError("Bad feed")
+
+    done = []
+    stages = [('Clubs', fail), ('Players', lambda: done.append('Players')),
+              ('Salaries', lambda: done.append('Salaries'))]
+    scheduler = ETLScheduler(stages, {'Salaries': ('Clubs', 'Players')}, workers=2)
+    scheduler.run()
+
+    assert done == ['Players']
+    assert scheduler.failed == {'Clubs'}
+    assert scheduler.skipped == {'Salaries'}
+
+
+def test_scheduler_invalid_dependencies():
+    """ETL Scheduler 003: Reject dependencies on unscheduled stages and cyclic dependencies."""
+    stages = [('Clubs', lambda: None), ('Players', lambda: None)]
+    with pytest.raises(ValueError):
+        ETLScheduler(stages, {'Players': ('Countries',)})
+    with pytest.raises(ValueError):
+        ETLScheduler(stages, {'Players': ('Clubs',), 'Clubs': ('Players',)})
+
+
+def test_parallel_ingestion(tmpdir, comp_data, club_data, person_data):
+    """Parallel Ingestion 001: Ingest data files of an entity in worker processes and merge their counts."""
+    database_uri = 'sqlite:///{}'.format(tmpdir.join('marcotti.db'))
+    engine = create_engine(database_uri)
+    BaseSchema.metadata.create_all(engine)
+    session = Session(engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    dimensions = DimensionCache.for_session(session).snapshot()
+    session.close()
+
+    header = "Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+    tmpdir.join('salaries-1.csv').write(header + "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n")
+    tmpdir.join('salaries-2.csv').write(header + "Major League Soccer,2015,ORL,Smith,John,50000.00,50000.00\n"
+                                                 "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n")
+    totals = ingest_feeds_parallel(database_uri, str(tmpdir), ('salaries-*.csv',), PlayerSalaryIngest,
+                                   2, dimensions)
+
+    assert totals == dict(files=2, failed=0, unchanged=0, read=3, inserted=1, updated=0, skipped=0, rejected=2)
+    assert Session(engine).query(PlayerSalaries).count() == 1
+    engine.dispose()
+
+
+def test_loader_parallel_stage_failure(tmpdir, comp_data, club_data, person_data):
+    """Parallel Ingestion 003: Fail the loader stage of an entity if a data file fails in a worker process."""
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(pkg_resources.resource_filename('marcottimls', 'data/')),
+                             trim_blocks=True, lstrip_blocks=True)
+    tmpdir.join('loader.py').write(env.get_template('templates/loader.skel').render(
+        config_file='marcottimls', config_class='MarcottiConfig'))
+    loader = imp.load_source('marcotti_loader', str(tmpdir.join('loader.py')))
+
+    class LoaderConfig(MarcottiConfig):
+        DIALECT = 'sqlite'
+        DBNAME = '/{}'.format(tmpdir.join('marcotti.db'))
+        START_YEAR = 2015
+        END_YEAR = 2015
+        CSV_DATA_DIR = str(tmpdir)
+        CSV_DATA = {'Salaries': 'salaries-*.csv'}
+        ETL_PROCESSES = {'Salaries': 2}
+
+    settings = LoaderConfig()
+    marcotti = Marcotti(settings)
+    BaseSchema.metadata.create_all(marcotti.engine)
+    session = Session(marcotti.engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    session.close()
+
+    header = "Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+    tmpdir.join('salaries-1.csv').write(header + "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n")
+    tmpdir.join('salaries-2.csv').write(header + "Major League Soccer,2015,ORL,Doe,Jim,unknown,72500.00\n")
+    done = []
+    stages = [('Salaries', partial(loader.ingest_entity, marcotti, settings, None, 'Salaries', PlayerSalaryIngest)),
+              ('LeaguePoints', lambda: done.append('LeaguePoints'))]
+    scheduler = ETLScheduler(stages, {'LeaguePoints': ('Salaries',)}, workers=1)
+    scheduler.run()
+
+    assert scheduler.failed == {'Salaries'} and scheduler.skipped == {'LeaguePoints'}
+    assert done == []
+    marcotti.engine.dispose()
+
+
+def test_parallel_joined_inheritance_ingestion(tmpdir, comp_data, club_data, person_data):
+    """Parallel Ingestion 002: Ingest field player statistics of several seasons in concurrent worker processes."""
+    database_uri = 'sqlite:///{}'.format(tmpdir.join('marcotti.db'))
+    engine = create_engine(database_uri)
+    BaseSchema.metadata.create_all(engine)
+    session = Session(engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    create_seasons(session, 2008, 2015)
+    dimensions = DimensionCache.for_session(session).snapshot()
+    session.close()
+
+    header = "Last Name,First Name,Club,Competition,Year1,Year2,Gp,Sb,Min,Yc,Rc,Gl,Sht\n"
+    for yr in range(2008, 2016):
+        tmpdir.join('field-{}.csv'.format(yr)).write(
+            header + "Doe,Jim,Orlando City SC,Major League Soccer,{0},{0},30,2,2500,3,0,{1},40\n".format(yr, yr - 2000))
+    totals = ingest_feeds_parallel(database_uri, str(tmpdir), ('field-*.csv',), FieldStatIngest, 4, dimensions)
+
+    assert totals == dict(files=8, failed=0, unchanged=0, read=8, inserted=8, updated=0, skipped=0, rejected=0)
+    session = Session(engine)
+    stats = session.query(FieldPlayerStats).all()
+    assert sorted(stat.goals_total for stat in stats) == range(8, 16)
+    assert len(set(stat.id for stat in stats)) == 8
+    assert session.query(CommonStats).count() == 8
+    session.close()
+    engine.dispose()
+
+
+def test_csv_record_reader_types():
+    """CSV Reader 001: Read rows as records of typed fields, with empty and missing columns as None."""
+    feed = StringIO("Name,Birthdate,Mins,Base,Gen Adidas\n"
+                    "J\xc3\xbcrgen , 1990-06-01,90,1.50,1\n"
+                    "\n"
+                    "Doe,,,2.00,0\n")
+    columns = (('name', "Name", unicode), ('birth_date', "Birthdate", date), ('minutes', "Mins", int),
+               ('base', "Base", float), ('gen_adidas', "Gen Adidas", bool), ('club', "Club", str))
+    records = list(CSVRecordReader(feed, columns))
+    assert len(records) == 2
+    assert records[0] == (u"J\xfcrgen", date(1990, 6, 1), 90, 1.5, True, None)
+    assert records[1].birth_date is None and records[1].minutes is None
+    assert records[1].gen_adidas is False
+
+
+def test_feed_manifest_skips_unchanged(session, tmpdir):
+    """Feed Manifest 001: Skip data files that are unchanged since their last ingestion unless forced."""
+    data_file = tmpdir.join('countries.csv')
+    data_file.write("Name,Confederation\nPortugal,UEFA\n")
+    feed = CountryIngest(session)
+
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed)
+    entry = session.query(FeedManifests).one()
+    assert entry.path == unicode(data_file) and entry.entity == 'CountryIngest'
+    assert (entry.rows_read, entry.rows_inserted, entry.rows_rejected) == (1, 1, 0)
+
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed)
+    assert feed.summary['read'] == 1
+
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed, force=True)
+    assert feed.summary['read'] == 2
+    assert session.query(FeedManifests).one().rows_skipped == 1
+
+    data_file.write("Name,Confederation\nPortugal,UEFA\nSpain,UEFA\n")
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed)
+    assert (entry.rows_read, entry.rows_inserted, entry.rows_skipped) == (2, 1, 1)
+    assert session.query(Countries).count() == 2
+
+
+def test_feed_manifest_retries_rejected_rows(session, tmpdir, comp_data, club_data, person_data):
+    """Feed Manifest 002: Ingest unchanged data files again if rows were rejected at their last ingestion."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    data_file = tmpdir.join('salaries.csv')
+    data_file.write("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,50000.00,50000.00\n"
+                    "Major League Soccer,2015,ORL,Smith,John,60000.00,60000.00\n")
+    ingest_feeds(get_local_handles, str(tmpdir), ('salaries.csv',), PlayerSalaryIngest(session))
+    entry = session.query(FeedManifests).one()
+    assert (entry.rows_inserted, entry.rows_rejected) == (1, 1)
+
+    session.add(Players(first_name=u"John", last_name=u"Smith", birth_date=date(1985, 5, 5),
+                        country_id=session.query(Players).get(stat_key['player_id']).country_id))
+    session.commit()
+    feed = PlayerSalaryIngest(session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('salaries.csv',), feed)
+    assert feed.summary == dict(read=2, inserted=1, updated=0, skipped=1, rejected=0)
+    assert session.query(PlayerSalaries).count() == 2
+
+    feed = PlayerSalaryIngest(session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('salaries.csv',), feed)
+    assert feed.summary['read'] == 0
+
+
+def test_write_records_constraint_violation(file_session, comp_data, club_data, person_data):
+    """Upsert 003: Reject records of a batch whose natural key was written by another session."""
+    stat_key = stat_record_key(file_session, comp_data, club_data, person_data)
+    club = Clubs(**club_data['nyc'])
+    file_session.add_all([club, PlayerSalaries(base_salary=5000000, avg_guaranteed=5000000, **stat_key)])
+    file_session.commit()
+
+    ingest = PlayerSalaryIngest(file_session)
+    ingest.counts['read'] = 2
+    written = ingest.write_records([dict(stat_key, base_salary=6000000, avg_guaranteed=6000000),
+                                    dict(stat_key, club_id=club.id, base_salary=7000000, avg_guaranteed=7000000)],
+                                   PlayerSalaries)
+    assert written == 1
+    assert ingest.summary == dict(read=2, inserted=1, updated=0, skipped=0, rejected=1)
+    assert ingest.rejects.report() == {'constraint_violation': 1}
+    assert sorted(salary.base_salary for salary in file_session.query(PlayerSalaries)) == [5000000, 7000000]
+
+
+def test_salary_ingest_upsert(session, comp_data, club_data, person_data):
+    """Upsert 001: Replace salary records with the same natural key in upsert mode."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    header = "Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+    PlayerSalaryIngest(session).load_feed(
+        StringIO(header + "Major League Soccer,2015,ORL,Doe,Jim,50000.00,50000.00\n"))
+
+    ingest = PlayerSalaryIngest(session, upsert=True)
+    ingest.load_feed(StringIO(header + "Major League Soccer,2015,ORL,Doe,Jim,55000.00,60000.00\n"))
+    salary = session.query(PlayerSalaries).one()
+    session.refresh(salary)
+    assert (salary.base_salary, salary.avg_guaranteed) == (5500000, 6000000)
+    assert ingest.summary == dict(read=1, inserted=1, updated=1, skipped=0, rejected=0)
+
+
+def test_core_writer_upsert_joined_inheritance(session, comp_data, club_data, person_data):
+    """Upsert 002: Update base and subclass tables of existing statistics records and keep their IDs."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    session.add_all([FieldPlayerStats(minutes=900, goals_total=3, **stat_key),
+                     GoalkeeperStats(minutes=90, wins=1, **stat_key)])
+    session.commit()
+    stat_id = session.query(FieldPlayerStats.id).scalar()
+
+    club = Clubs(**club_data['nyc'])
+    session.add(club)
+    session.commit()
+    CoreWriter(session).upsert(FieldPlayerStats, [dict(minutes=1000, goals_total=2, **stat_key),
+                                                  dict(minutes=1100, goals_total=5, **stat_key),
+                                                  dict(stat_key, minutes=450, club_id=club.id)])
+    session.expire_all()
+
+    stats = session.query(FieldPlayerStats).order_by(FieldPlayerStats.minutes).all()
+    assert [(rec.minutes, rec.goals_total) for rec in stats] == [(450, None), (1100, 5)]
+    assert stats[1].id == stat_id
+    assert session.query(GoalkeeperStats).one().minutes == 90
+
+
+def test_field_stats_fill_minutes(session, comp_data, club_data, person_data):
+    """Statistics 001: Fill in player minutes records with the field statistics of the same player season."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    PlayerMinuteIngest(session).load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Mins\n"
+                                                   "Major League Soccer,2015,ORL,Doe,Jim,850\n"))
+
+    header = "Last Name,First Name,Club,Competition,Year1,Year2,Gp,Sb,Min,Yc,Rc,Gl,Sht\n"
+    row = "Doe,Jim,Orlando City SC,Major League Soccer,2015,2015,10,2,900,1,0,3,-1\n"
+    ingest = FieldStatIngest(session)
+    ingest.load_feed(StringIO(header + row + row))
+    assert ingest.summary == dict(read=2, inserted=1, updated=1, skipped=1, rejected=0)
+
+    stats = session.query(FieldPlayerStats).one()
+    session.refresh(stats)
+    assert (stats.appearances, stats.minutes, stats.goals_total, stats.shots_total) == (10, 900, 3, None)
+
+    ingest = FieldStatIngest(session)
+    ingest.load_feed(StringIO(header + row))
+    assert ingest.summary == dict(read=1, inserted=0, updated=0, skipped=1, rejected=0)
+
+
+def test_staging_salary_merge(file_session, comp_data, club_data, person_data):
+    """Staging Merge 001: Merge resolved and deduplicated salary rows from staging table."""
+    stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.commit()
+    feed = StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"
+                    "Major League Soccer,2015,ORL,Doe:1980-01-01,Jim,65000.00,72500.00\n"
+                    "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n"
+                    "Major League Soccer,2015,ORL,Smith,John,50000.00,50000.00\n")
+    ingest = SalaryStagingIngest(file_session)
+    ingest.load_feed(feed)
+
+    salary = file_session.query(PlayerSalaries).one()
+    assert (salary.base_salary, salary.avg_guaranteed) == (6000000, 7250000)
+    assert ingest.summary == dict(read=4, inserted=1, updated=0, skipped=1, rejected=2)
+
+
+@pytest.mark.parametrize('ingest_class', [PlayerSalaryIngest, SalaryStagingIngest])
+def test_salary_cents_rounding(file_session, comp_data, club_data, person_data, ingest_class):
+    """Staging Merge 005: Round salaries to the nearest cent in row-by-row and staging ingestion alike."""
+    stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.commit()
+    feed = StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,8.70,4.35\n")
+    ingest_class(file_session).load_feed(feed)
+
+    salary = file_session.query(PlayerSalaries).one()
+    assert (salary.base_salary, salary.avg_guaranteed) == (870, 435)
+    assert file_session.execute("SELECT count(*) FROM sqlite_temp_master").scalar() == 0
+
+
+def test_staging_field_stats_merge(file_session, comp_data, club_data, person_data):
+    """Staging Merge 002: Merge statistics rows into base and subclass tables, skipping existing records."""
+    stat_key = stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.add(GoalkeeperStats(minutes=90, wins=1, **stat_key))
+    file_session.commit()
+    header = "Last Name,First Name,Club,Competition,Year1,Year2,Gp,Sb,Min,Yc,Rc,Gl,Sht\n"
+    row = "Doe,Jim,Orlando City SC,Major League Soccer,2015,2015,10,2,900,1,0,3,-1\n"
+    FieldStatStagingIngest(file_session).load_feed(StringIO(header + row))
+    FieldStatStagingIngest(file_session).load_feed(StringIO(header + row))
+
+    stats = file_session.query(FieldPlayerStats).one()
+    assert (stats.appearances, stats.minutes, stats.goals_total, stats.shots_total) == (10, 900, 3, None)
+    assert file_session.query(CommonStats).count() == 2
+
+
+def test_staging_field_stats_fill_minutes(file_session, comp_data, club_data, person_data):
+    """Staging Merge 003: Fill in player minutes records with the field statistics of staging table rows."""
+    stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.commit()
+    MinuteStagingIngest(file_session).load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Mins\n"
+                                                         "Major League Soccer,2015,ORL,Doe,Jim,850\n"))
+
+    header = "Last Name,First Name,Club,Competition,Year1,Year2,Gp,Sb,Min,Yc,Rc,Gl,Sht\n"
+    row = "Doe,Jim,Orlando City SC,Major League Soccer,2015,2015,10,2,-1,1,0,3,-1\n"
+    ingest = FieldStatStagingIngest(file_session)
+    ingest.load_feed(StringIO(header + row + row))
+    assert ingest.summary == dict(read=2, inserted=1, updated=1, skipped=1, rejected=0)
+
+    stats = file_session.query(FieldPlayerStats).one()
+    assert (stats.appearances, stats.minutes, stats.goals_total, stats.shots_total) == (10, 850, 3, None)
+
+    ingest = FieldStatStagingIngest(file_session)
+    ingest.load_feed(StringIO(header + row))
+    assert ingest.summary == dict(read=1, inserted=0, updated=0, skipped=1, rejected=0)
+
+
+def test_staging_table_names(file_session):
+    """Staging Merge 004: Name staging tables uniquely for each ingestion and drop them afterwards."""
+    ingest = SalaryStagingIngest(file_session)
+    names = set(ingest.staging_table().name for _ in range(2))
+    assert len(names) == 2 and all(name.startswith('staging_salaries_') for name in names)
+
+    ingest.load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                              "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"))
+    assert file_session.execute("SELECT count(*) FROM sqlite_temp_master").scalar() == 0
+
+
+def test_reject_sink_csv(session, tmpdir, comp_data, club_data, person_data):
+    """Reject Sink 001: Write rejected rows to CSV side file and summarize them by reason."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    path = str(tmpdir.join('rejects.csv'))
+    sink = create_reject_sink(path)
+    assert isinstance(sink, CSVRejectSink)
+    ingest = PlayerSalaryIngest(session, rejects=sink)
+    ingest.load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                              "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n"
+                              "Major League Soccer,2015,ORL,Smith,John,50000.00,50000.00\n"
+                              "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n"
+                              "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"))
+    sink.close()
+
+    with open(path) as handle:
+        rows = list(csv.DictReader(handle))
+    assert [(row['entity'], row['row'], row['reason'], row['name']) for row in rows] == [
+        ('PlayerSalaryIngest', '1', 'unknown_club', 'XXX'),
+        ('PlayerSalaryIngest', '2', 'unknown_player', 'John Smith'),
+        ('PlayerSalaryIngest', '3', 'unknown_club', 'XXX')]
+    assert ingest.summary == dict(read=4, inserted=1, updated=0, skipped=0, rejected=3)
+
+
+def test_reject_sink_sqlite_staging(file_session, tmpdir, comp_data, club_data, person_data):
+    """Reject Sink 002: Write unresolved staging table rows to SQLite side file."""
+    stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.commit()
+    path = str(tmpdir.join('rejects.db'))
+    sink = create_reject_sink(path)
+    assert isinstance(sink, SQLiteRejectSink)
+    SalaryStagingIngest(file_session, rejects=sink).load_feed(
+        StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                 "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"
+                 "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n"
+                 "Major League Soccer,2015,ORL,Smith,John,50000.00,50000.00\n"))
+    sink.close()
+
+    connection = sqlite3.connect(path)
+    rows = connection.execute("SELECT row, reason, name FROM rejects ORDER BY row").fetchall()
+    connection.close()
+    assert rows == [(2, u'unknown_club', u'XXX'), (3, u'unknown_player', u'John Smith')]
+
+
+def test_season_calendar_weeks(session, comp_data, club_data, person_data):
+    """Season Calendar 001: Compute season weeks of dates from competition seasons loaded in one query."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    calendar = SeasonCalendar.for_session(session)
+    assert calendar is SeasonCalendar.for_session(session)
+    assert calendar.dates(stat_key['competition_id'], stat_key['season_id']) == (
+        date(2015, 3, 6), date(2015, 10, 25), 33)
+    assert calendar.week(stat_key['competition_id'], stat_key['season_id'], date(2015, 3, 12)) == 1
+    assert calendar.week(stat_key['competition_id'], stat_key['season_id'], date(2015, 5, 1)) == 9
+    assert calendar.last_week(stat_key['competition_id'], stat_key['season_id']) == 34
+    assert calendar.weeks(stat_key['competition_id'], stat_key['season_id']) == \
+        session.query(CompetitionSeasons).one().weeks
+    assert calendar.dates(stat_key['competition_id'], -1) is None
+
+
+def test_season_calendar_reset(session, comp_data, club_data, person_data):
+    """Season Calendar 003: Keep missing competition seasons out of the calendar until it is reset."""
+    stat_key = stat_record_key(session, comp_data, club_data, person_data)
+    calendar = SeasonCalendar.for_session(session)
+    assert calendar.dates(stat_key['competition_id'], stat_key['season_id']) is not None
+
+    yr = Years(yr=2016)
+    session.add(CompetitionSeasons(competition_id=stat_key['competition_id'],
+                                   season=Seasons(start_year=yr, end_year=yr),
+                                   start_date=date(2016, 3, 6), end_date=date(2016, 10, 23), matchdays=34))
+    session.flush()
+    season_id = session.query(Seasons.id).filter_by(name='2016').scalar()
+    assert calendar.dates(stat_key['competition_id'], season_id) is None
+
+    calendar.reset()
+    assert calendar.dates(stat_key['competition_id'], season_id) == (date(2016, 3, 6), date(2016, 10, 23), 33)
+
+
+def test_partial_tenure_season_weeks(session, comp_data, club_data, person_data):
+    """Season Calendar 002: Convert tenure dates to season weeks with the season calendar."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    PartialTenureIngest(session).load_feed(StringIO(
+        "Competition,Season,Club Symbol,Last Name,First Name,Start Term,End Term,Start Date,End Date\n"
+        "Major League Soccer,2015,ORL,Doe,Jim,,,2015-05-01,\n"))
+    tenure = session.query(PartialTenures).one()
+    assert (tenure.start_week, tenure.end_week) == (9, 34)
+
+
+def test_bootstrap_unchanged_database(file_session):
+    """Bootstrap 001: Populate validation tables once and skip bootstrap while fingerprint is unchanged."""
+    data_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'marcottimls', 'data')
+    assert bootstrap_db(file_session, 2013, 2015, data_path)
+    assert file_session.query(Years).count() == 3
+    assert sorted(season.name for season in file_session.query(Seasons)) == [
+        '2013', '2013-2014', '2014', '2014-2015', '2015']
+    countries = file_session.query(Countries).count()
+    assert countries > 200
+
+    assert not bootstrap_db(file_session, 2013, 2015, data_path)
+    assert bootstrap_db(file_session, 2013, 2016, data_path)
+    assert file_session.query(Years).count() == 4
+    assert file_session.query(Seasons).count() == 7
+    assert file_session.query(Countries).count() == countries
+    assert file_session.query(BootstrapStates).count() == 1
+
+
+def test_bootstrap_add_unique_constraints(file_session):
+    """Bootstrap 002: Add unique constraints missing from tables created before they were declared."""
+    connection = file_session.connection()
+    ddl = str(CreateTable(PlayerSalaries.__table__).compile(dialect=connection.dialect))
+    connection.execute("DROP TABLE salaries")
+    connection.execute(re.sub(r',\s*UNIQUE \([^)]*\)', '', ddl))
+    assert missing_unique_constraints(connection, BaseSchema.metadata) == [
+        ('salaries', ['player_id', 'club_id', 'competition_id', 'season_id'])]
+    with pytest.raises(ValueError):
+        check_unique_constraints(connection, BaseSchema.metadata)
+
+    assert add_unique_constraints(connection, BaseSchema.metadata) == [
+        'uq_salaries_player_id_club_id_competition_id_season_id']
+    assert missing_unique_constraints(connection, BaseSchema.metadata) == []
+    check_unique_constraints(connection, BaseSchema.metadata)
+    assert add_unique_constraints(connection, BaseSchema.metadata) == []
+
+
+def test_bootstrap_dimension_cache(file_session):
+    """Bootstrap 003: Reload dimension cache entries of the validation records inserted by bootstrap."""
+    data_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'marcottimls', 'data')
+    BaseSchema.metadata.create_all(file_session.connection())
+    cache = DimensionCache.for_session(file_session)
+    assert cache.lookup(Years, yr=2015) == []
+    assert cache.lookup(Seasons, name='2014-2015') == []
+    assert cache.lookup(Countries, name=u"Canada") == []
+
+    assert bootstrap_db(file_session, 2014, 2015, data_path)
+    assert cache.lookup(Years, yr=2015) == [file_session.query(Years.id).filter_by(yr=2015).scalar()]
+    assert len(cache.lookup(Seasons, name='2014-2015')) == 1
+    assert cache.lookup(Countries, name=u"Canada") == [
+        file_session.query(Countries.id).filter_by(name=u"Canada").scalar()]
+
+
+def test_dry_run_seasonal_ingest(file_session, tmpdir, comp_data, club_data, person_data):
+    """Dry Run 001: Count rows that would be inserted, skipped and rejected without writing them."""
+    stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.commit()
+    tmpdir.join('salaries.csv').write("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                                      "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"
+                                      "Major League Soccer,2015,ORL,Doe,Jim,65000.00,72500.00\n"
+                                      "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n")
+    feed = PlayerSalaryIngest(file_session, create_writer(file_session, 'null'))
+    assert isinstance(feed.writer, NullWriter) and feed.dry_run
+    ingest_feeds(get_local_handles, str(tmpdir), ('salaries.csv',), feed)
+
+    assert feed.summary == dict(read=3, inserted=1, updated=0, skipped=1, rejected=1)
+    assert file_session.query(PlayerSalaries).count() == 0
+    assert file_session.query(FeedManifests).count() == 0
+
+    feed = PlayerSalaryIngest(file_session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('salaries.csv',), feed)
+    assert feed.summary == dict(read=3, inserted=1, updated=0, skipped=1, rejected=1)
+    assert file_session.query(PlayerSalaries).count() == 1
+
+
+def test_dry_run_staging_ingest(file_session, comp_data, club_data, person_data):
+    """Dry Run 002: Count staging table rows that would be merged without merging them."""
+    stat_record_key(file_session, comp_data, club_data, person_data)
+    file_session.commit()
+    ingest = SalaryStagingIngest(file_session, NullWriter(file_session))
+    ingest.load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                              "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"
+                              "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n"))
+    assert ingest.summary == dict(read=2, inserted=1, updated=0, skipped=0, rejected=1)
+    assert file_session.query(PlayerSalaries).count() == 0
+
+
+def test_dry_run_loader_skips_staging(tmpdir, monkeypatch, comp_data, club_data, person_data):
+    """Dry Run 003: Validate data files without staging tables in a dry run of the loader."""
+    def load_feed(self, handle):
+        raise AssertionError("Staging table created in dry run")
+
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(pkg_resources.resource_filename('marcottimls', 'data/')),
+                             trim_blocks=True, lstrip_blocks=True)
+    tmpdir.join('loader.py').write(env.get_template('templates/loader.skel').render(
+        config_file='marcottimls', config_class='MarcottiConfig'))
+    loader = imp.load_source('marcotti_loader', str(tmpdir.join('loader.py')))
+    monkeypatch.setattr(SalaryStagingIngest, 'load_feed', load_feed)
+
+    class LoaderConfig(MarcottiConfig):
+        DIALECT = 'sqlite'
+        DBNAME = '/{}'.format(tmpdir.join('marcotti.db'))
+        START_YEAR = 2015
+        END_YEAR = 2015
+        CSV_DATA_DIR = str(tmpdir)
+        CSV_DATA = {'Salaries': 'salaries.csv'}
+        ETL_STAGING = True
+        ETL_DRY_RUN = True
+
+    settings = LoaderConfig()
+    marcotti = Marcotti(settings)
+    BaseSchema.metadata.create_all(marcotti.engine)
+    session = Session(marcotti.engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    tmpdir.join('salaries.csv').write("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                                      "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n")
+    loader.ingest_entity(marcotti, settings, None, 'Salaries', PlayerSalaryIngest)
+
+    assert session.query(PlayerSalaries).count() == 0
+    session.close()
+    marcotti.engine.dispose()
+
+
+def test_checkpoint_resumes_interrupted_ingestion(file_session, tmpdir, monkeypatch):
+    """Checkpoint 001: Resume interrupted ingestion of a data file after its last committed batch."""
+    def write_records(self, record_list, model=None):
+        if self.counts['inserted']:
+            raise RuntimeError("Connection lost")
+        return BaseIngest.write_records(self, record_list, model)
+
+    monkeypatch.setattr(CountryIngest, 'BATCH_SIZE', 2)
+    tmpdir.join('countries.csv').write("Name,Confederation\nCanada,CONCACAF\nMexico,CONCACAF\n"
+                                       "Canada,CONCACAF\nFrance,UEFA\nSpain,UEFA\nJapan,AFC\n")
+    feed = CountryIngest(file_session)
+    feed.write_records = partial(write_records, feed)
+    with pytest.raises(RuntimeError):
+        ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed)
+    file_session.rollback()
+    assert file_session.query(Countries).count() == 2
+    assert file_session.query(FeedCheckpoints.rows_committed).scalar() == 2
+
+    feed = CountryIngest(file_session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed)
+    assert feed.summary == dict(read=4, inserted=3, updated=0, skipped=1, rejected=0)
+    assert file_session.query(Countries).count() == 5
+    assert file_session.query(FeedCheckpoints).count() == 0
+    assert file_session.query(FeedManifests.rows_read).scalar() == 4
+
+
+def test_pipeline_ingestion(tmpdir, comp_data, club_data, person_data):
+    """Pipeline 001: Ingest data file through pipeline stages with the same result as a serial ingestion."""
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('marcotti.db')),
+                           connect_args=dict(check_same_thread=False))
+    BaseSchema.metadata.create_all(engine)
+    session = Session(engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    feed = StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,65000.00,72500.00\n"
+                    "Major League Soccer,2015,XXX,Doe,Jim,60000.00,72500.00\n")
+    ingest = PlayerSalaryIngest(session)
+    pipeline = ETLPipeline(ingest, queue_size=1, resolve_thread=True)
+    assert pipeline.load_feed(feed) == 1
+
+    salary = session.query(PlayerSalaries).one()
+    assert (salary.base_salary, salary.avg_guaranteed) == (6000000, 7250000)
+    assert ingest.summary == dict(read=3, inserted=1, updated=0, skipped=1, rejected=1)
+    stats = {stage['name']: stage for stage in pipeline.stats}
+    assert sorted(stats) == ['parse', 'read', 'resolve', 'write']
+    assert (stats['read']['items'], stats['parse']['items'], stats['resolve']['items']) == (4, 3, 3)
+    assert all(stage['max_depth'] <= 1 for stage in stats.values())
+    session.close()
+    engine.dispose()
+
+
+def test_pipeline_stage_error(session, comp_data, club_data, person_data, monkeypatch):
+    """Pipeline 002: Raise errors of pipeline stages in the writing thread and stop the pipeline."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+
+    def transform(self, row):
+        raise ValueError("Bad row")
+    monkeypatch.setattr(PlayerSalaryIngest, 'transform', transform)
+    ingest = PlayerSalaryIngest(session, pipeline=True)
+    with pytest.raises(ValueError):
+        ingest.load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n" +
+                                  "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n" * 10))
+    time.sleep(0.3)
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+    assert session.query(PlayerSalaries).count() == 0
+
+
+def test_pipeline_resolve_overlaps_write(tmpdir, monkeypatch, comp_data, club_data, person_data):
+    """Pipeline 003: Resolve records in a session of their own while other records are written."""
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('marcotti.db')),
+                           connect_args=dict(check_same_thread=False))
+    BaseSchema.metadata.create_all(engine)
+    session = Session(engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    transforms = []
+    overlaps = []
+    transform = PlayerSalaryIngest.transform
+    write_records = PlayerSalaryIngest.write_records
+
+    def slow_transform(self, row):
+        time.sleep(0.01)
+        transforms.append(self.session)
+        return transform(self, row)
+
+    def slow_write_records(self, record_list, model=None):
+        before = len(transforms)
+        time.sleep(0.1)
+        overlaps.append(len(transforms) - before)
+        return write_records(self, record_list, model)
+
+    monkeypatch.setattr(PlayerSalaryIngest, 'BATCH_SIZE', 1)
+    monkeypatch.setattr(PlayerSalaryIngest, 'transform', slow_transform)
+    monkeypatch.setattr(PlayerSalaryIngest, 'write_records', slow_write_records)
+    ingest = PlayerSalaryIngest(session)
+    pipeline = ETLPipeline(ingest, resolve_thread=True)
+    pipeline.load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n" +
+                                "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n" * 20))
+
+    assert ingest.summary == dict(read=20, inserted=1, updated=0, skipped=19, rejected=0)
+    assert overlaps[0] > 0
+    assert all(resolve_session is not session for resolve_session in transforms)
+    session.close()
+    engine.dispose()
+
+
+def test_pipeline_cached_feed(session, tmpdir, comp_data, club_data, person_data):
+    """Pipeline 004: Do not read data file whose parsed records are cached."""
+    class Unreadable(object):
+        name = 'salaries.csv'
+
+        def __iter__(self):
+            raise AssertionError("data file read again")
+
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    cache = ParsedFeedCache(str(tmpdir.join('cache')))
+    ingest = PlayerSalaryIngest(session, cache=cache)
+    ingest.checksum = 'salaries'
+    feed = StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                    "Major League Soccer,2015,ORL,Doe,Jim,60000.00,72500.00\n")
+    feed.name = Unreadable.name
+    ETLPipeline(ingest).load_feed(feed)
+
+    ingest = PlayerSalaryIngest(session, cache=cache)
+    ingest.checksum = 'salaries'
+    pipeline = ETLPipeline(ingest)
+    pipeline.load_feed(Unreadable())
+    assert ingest.summary == dict(read=1, inserted=0, updated=0, skipped=1, rejected=0)
+    assert [stage['name'] for stage in pipeline.stats] == ['parse', 'write']
+
+
+def test_compressed_feed_sources(session, tmpdir):
+    """Compressed Sources 001: Stream gzip, bz2 and zip member data files and track them in the manifest."""
+    header = "Name,Confederation\n"
+    with gzip.open(str(tmpdir.join('countries1.csv.gz')), 'wb') as fh:
+        fh.write(header + "Canada,CONCACAF\n")
+    bz2_file = bz2.BZ2File(str(tmpdir.join('countries2.csv.bz2')), 'wb')
+    bz2_file.write(header + "France,UEFA\n")
+    bz2_file.close()
+    with zipfile.ZipFile(str(tmpdir.join('countries3.zip')), 'w') as archive:
+        archive.writestr('spain.csv', header + "Spain,UEFA\n")
+        archive.writestr('japan.csv', header + "Japan,AFC\n")
+
+    feed = CountryIngest(session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries*',), feed)
+    assert sorted(name for name, in session.query(Countries.name)) == ['Canada', 'France', 'Japan', 'Spain']
+    paths = sorted(path for path, in session.query(FeedManifests.path))
+    assert [os.path.basename(path) for path in paths] == [
+        'countries1.csv.gz', 'countries2.csv.bz2', 'countries3.zip!japan.csv', 'countries3.zip!spain.csv']
+
+    feed = CountryIngest(session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries*',), feed)
+    assert feed.summary['read'] == 0
+
+
+def test_stream_feed_source(session, monkeypatch):
+    """Compressed Sources 002: Read data file from standard input."""
+    monkeypatch.setattr('sys.stdin', StringIO("Name,Confederation\nCanada,CONCACAF\n"))
+    handles = list(get_local_handles('', ('-',)))
+    assert len(handles) == 1 and isinstance(handles[0], FeedStream)
+
+    monkeypatch.setattr('sys.stdin', StringIO("Name,Confederation\nCanada,CONCACAF\n"))
+    feed = CountryIngest(session)
+    ingest_feeds(get_local_handles, '', ('-',), feed)
+    assert feed.summary == dict(read=1, inserted=1, updated=0, skipped=0, rejected=0)
+    assert session.query(FeedManifests).count() == 0
+
+
+def test_parsed_feed_cache(session, tmpdir, monkeypatch):
+    """Feed Cache 001: Read records of unchanged data file from parsed-feed cache."""
+    tmpdir.join('countries.csv').write("Name,Confederation\nCanada,CONCACAF\nFrance,UEFA\n")
+    cache = ParsedFeedCache(str(tmpdir.join('cache')))
+
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), CountryIngest(session, cache=cache))
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+    def fail(self):
+        raise AssertionError("data file parsed again")
+    monkeypatch.setattr(CSVRecordReader, '__iter__', fail)
+    feed = CountryIngest(session, cache=cache)
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed, force=True)
+    assert feed.summary['read'] == 2
+    monkeypatch.undo()
+
+    tmpdir.join('countries.csv').write("Name,Confederation\nCanada,CONCACAF\nFrance,UEFA\nJapan,AFC\n")
+    feed = CountryIngest(session, cache=cache)
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.csv',), feed)
+    assert feed.summary['read'] == 3
+    assert len(tmpdir.join('cache').listdir()) == 1
+    assert sorted(name for name, in session.query(Countries.name)) == ['Canada', 'France', 'Japan']
+
+
+def test_json_lines_feed(session, tmpdir):
+    """Feed Cache 002: Ingest JSON Lines data file."""
+    tmpdir.join('countries.jsonl').write('{"Name": "Canada", "Confederation": "CONCACAF"}\n\n'
+                                         '{"Name": "C\\u00f4te d\'Ivoire", "Confederation": "CAF"}\n')
+    feed = CountryIngest(session)
+    ingest_feeds(get_local_handles, str(tmpdir), ('countries.jsonl',), feed)
+    assert feed.summary['inserted'] == 2
+    assert session.query(Countries).filter_by(name=u"Côte d'Ivoire").one().confederation.value == 'CAF'
+
+
+def test_parsed_feed_cache_eviction(tmpdir):
+    """Feed Cache 003: Replace older cache files of a data file when a new cache file is complete."""
+    cache = ParsedFeedCache(str(tmpdir))
+
+    def store(checksum, name, rows):
+        return list(cache.records(checksum, 'signature', tuple, lambda: iter(rows), name))
+
+    store('a1', 'a.csv', [(1,)])
+    store('b1', 'b.csv', [(2,)])
+    store('s1', None, [(3,)])
+    paths = set(tmpdir.listdir())
+    assert len(paths) == 3
+
+    records = cache.records('a2', 'signature', tuple, lambda: iter([(4,), (5,)]), 'a.csv')
+    next(records)
+    assert set(tmpdir.listdir()) - paths
+    records.close()
+    assert set(tmpdir.listdir()) == paths
+    assert store('a2', 'a.csv', [(4,), (5,)]) == [(4,), (5,)]
+    assert len(tmpdir.listdir()) == 3
+    assert not os.path.exists(cache.path('a1', 'signature', 'a.csv'))
+    assert os.path.exists(cache.path('b1', 'signature', 'b.csv'))
+    assert store('a2', 'a.csv', [AssertionError]) == [(4,), (5,)]
+
+
+def test_mapped_feed_ranges(tmpdir, monkeypatch):
+    """Mapped Reader 001: Split data file into byte ranges on line boundaries and read them through mapped windows."""
+    monkeypatch.setattr(MappedFeed, 'WINDOW_SIZE', mmap.ALLOCATIONGRANULARITY)
+    lines = ["Name,Confederation\n"] + ["Country {:05d},UEFA\n".format(index) for index in range(2000)]
+    tmpdir.join('countries.csv').write(''.join(lines))
+    feed = MappedFeed(str(tmpdir.join('countries.csv')))
+    ranges = feed.ranges(3)
+    assert ranges[0][0] == len(lines[0]) and ranges[-1][1] == feed.size
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    parts = [list(feed.lines(start, end)) for start, end in ranges]
+    assert all(part[0] == lines[0] for part in parts)
+    assert sum((part[1:] for part in parts), []) == lines[1:]
+    assert list(feed.lines()) == lines
+    feed.close()
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.jsonl'])
+def test_mapped_parallel_ingestion(tmpdir, comp_data, club_data, person_data, extension):
+    """Mapped Reader 002: Ingest byte ranges of a data file in worker processes and in mapped mode."""
+    database_uri = 'sqlite:///{}'.format(tmpdir.join('marcotti.db'))
+    engine = create_engine(database_uri)
+    BaseSchema.metadata.create_all(engine)
+    session = Session(engine)
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    dimensions = DimensionCache.for_session(session).snapshot()
+
+    headers = ["Competition", "Season", "Club Symbol", "Last Name", "First Name", "Base", "Guaranteed"]
+    rows = [["Major League Soccer", "2015", "ORL", "Doe", "Jim", "60000.00", "72500.00"],
+            ["Major League Soccer", "2015", "ORL", "Smith", "John", "50000.00", "50000.00"],
+            ["Major League Soccer", "2015", "XXX", "Doe", "Jim", "60000.00", "72500.00"]]
+    filename = 'salaries' + extension
+    if extension == '.csv':
+        tmpdir.join(filename).write(''.join(','.join(row) + '\n' for row in [headers] + rows))
+    else:
+        tmpdir.join(filename).write(''.join(json.dumps(dict(zip(headers, row))) + '\n' for row in rows))
+    totals = ingest_feeds_parallel(database_uri, str(tmpdir), (filename,), PlayerSalaryIngest,
+                                   2, dimensions, ranges=2)
+    assert totals == dict(files=1, failed=0, unchanged=0, read=3, inserted=1, updated=0, skipped=0, rejected=2)
+    paths = [path for path, in session.query(FeedManifests.path)]
+    assert len(paths) == 2 and all(filename + '#' in path for path in paths)
+
+    feed = PlayerSalaryIngest(session, mapped=True)
+    ingest_feeds(get_local_handles, str(tmpdir), (filename,), feed)
+    assert feed.summary == dict(read=3, inserted=0, updated=0, skipped=1, rejected=2)
+    assert session.query(PlayerSalaries).count() == 1
+    session.close()
+    engine.dispose()
+
+
+def test_player_match_index_candidates(session, person_data):
+    """Player Matching 001: Rank players by similarity of accented, transliterated and reordered names."""
+    players = [Players(**data) for data in [person_data['generic']] + person_data['player']]
+    session.add_all(players)
+    session.commit()
+    doe, ponce, ronaldo, son = [player.id for player in players]
+
+    assert name_tokens(u"Heung-Min Søn") == [u'heung', u'min', u'son']
+    matcher = PlayerMatchIndex.for_session(session)
+    assert matcher is PlayerMatchIndex.for_session(session)
+    assert matcher.candidates(u"Miguel Angel Ponce")[0].player_id == ponce
+    assert matcher.candidates(u"Ronaldo Cristiano")[0].player_id == ronaldo
+    assert matcher.candidates(u"Son Heung Min")[0] == (son, u"Son Heung-Min", 1.0)
+    assert matcher.candidates(u"James Doe", birth_date=date(1980, 1, 1))[0].player_id == doe
+    assert matcher.candidates(u"James Doe", birth_date=date(1990, 1, 1)) == []
+    assert matcher.match(u"Miguel Ponce Briseno", 0.8)[0] == ponce
+    assert matcher.match(u"Xavier Quux", 0.5) == (None, [])
+
+
+def test_player_match_ingest(session, tmpdir, comp_data, club_data, person_data):
+    """Player Matching 002: Match unresolved player names above threshold and reject others with suggestions."""
+    stat_record_key(session, comp_data, club_data, person_data)
+    session.commit()
+    path = str(tmpdir.join('rejects.csv'))
+    sink = create_reject_sink(path)
+    ingest = PlayerSalaryIngest(session, rejects=sink, match_threshold=0.8)
+    ingest.load_feed(StringIO("Competition,Season,Club Symbol,Last Name,First Name,Base,Guaranteed\n"
+                              "Major League Soccer,2015,ORL,Doe,James,60000.00,72500.00\n"
+                              "Major League Soccer,2015,ORL,Doe,Jimmy,50000.00,50000.00\n"))
+    sink.close()
+
+    assert ingest.summary == dict(read=2, inserted=1, updated=0, skipped=0, rejected=1)
+    with open(path) as handle:
+        rows = list(csv.DictReader(handle))
+    assert [(row['reason'], row['name']) for row in rows] == [('unknown_player', 'Jimmy Doe')]
+    assert 'Jim Doe' in json.loads(rows[0]['data'])['candidates']